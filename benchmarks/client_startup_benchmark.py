@@ -0,0 +1,116 @@
+"""
+Compares the overhead of reaching the daemon through pytest and through the fast client.
+
+Import times are measured with python -X importtime. The end to end times are of
+complete client processes against a daemon that doesn't run pytest, so only the
+client startup and the round trip are measured.
+
+Usage: python benchmarks/client_startup_benchmark.py [--runs 20]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from threading import Thread
+
+from pytest_hot_reloading.daemon import PytestDaemon
+from pytest_hot_reloading.jurigged_daemon_signalers import JuriggedDaemonSignaler
+from pytest_hot_reloading.transport import unix_socket_path
+
+CLIENTS = {
+    "pytest": ["-m", "pytest", "-p", "pytest_hot_reloading.plugin"],
+    "fast client": ["-m", "pytest_hot_reloading.fast_client"],
+}
+IMPORTS = {
+    "pytest": "import pytest, pytest_hot_reloading.plugin",
+    "fast client": "import pytest_hot_reloading.fast_client",
+}
+
+
+class FakeRunDaemon(PytestDaemon):
+    def _run_pytest(
+        self, cwd, env, sys_path, args, stdout, stderr, plugins=None, cancellation=None
+    ) -> int:
+        stdout.write("1 passed\n")
+        return 0
+
+
+def import_time(statement: str) -> float:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # the top level imports are not indented, their cumulative times add up to the total
+    total_us = 0
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.partition(":")[2].split("|")
+        # nested imports are indented past the single space after the separator
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            total_us += int(cumulative)
+    return total_us / 1000
+
+
+def run_time(client_args: list[str], cwd: Path, env: dict[str, str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, *client_args, "-q"],
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    )
+    return (time.perf_counter() - start) * 1000
+
+
+def report(name: str, timings_ms: list[float]) -> None:
+    print(
+        f"  {name:<14} mean {statistics.mean(timings_ms):8.1f} ms"
+        f"  p50 {statistics.median(timings_ms):8.1f} ms  min {min(timings_ms):8.1f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=20)
+    options = parser.parse_args()
+
+    print(f"Import time, {options.runs} runs")
+    for name, statement in IMPORTS.items():
+        report(name, [import_time(statement) for _ in range(options.runs)])
+
+    project = Path(tempfile.mkdtemp())
+    (project / "pytest.ini").write_text("[pytest]\n")
+    socket_path = unix_socket_path(project)
+    daemon = FakeRunDaemon(JuriggedDaemonSignaler(), socket_path=socket_path)
+    Thread(target=daemon.run_forever, daemon=True).start()
+    PytestDaemon.wait_to_be_ready(socket_path=socket_path)
+    env = {
+        **os.environ,
+        "PYTEST_DAEMON_UNIX_SOCKET": "True",
+        "PYTHONPATH": os.pathsep.join(sys.path),
+    }
+
+    print(f"Client process to result, {options.runs} runs")
+    for name, client_args in CLIENTS.items():
+        # the daemon echoes the output of each run, keep it out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            # warm up
+            run_time(client_args, project, env)
+            timings = [run_time(client_args, project, env) for _ in range(options.runs)]
+        report(name, timings)
+
+    daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Compares the cost of copying the cached test items for a run, with clone_item and
+with best_effort_copy, which the daemon used before. clone_item is also measured
+with the garbage collector paused, as the daemon runs it.
+
+Each suite is generated and collected once. Half of the items are parametrized test
+functions that use a fixture, the other half are test methods of classes.
+
+Usage: python benchmarks/item_clone_benchmark.py [--runs 5] [--sizes 1000,10000,100000]
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+from pytest_hot_reloading.items import best_effort_copy, clone_item, gc_paused
+
+TESTS_PER_MODULE = 1000
+
+MODULE = """
+import pytest
+
+
+@pytest.fixture
+def value():
+    return 1
+
+
+@pytest.mark.parametrize("n", range({half}))
+def test_function(n, value):
+    assert value
+
+
+class TestMethods:
+{methods}
+"""
+
+
+class ItemCollector:
+    def __init__(self) -> None:
+        self.session: pytest.Session | None = None
+
+    def pytest_collection_finish(self, session: pytest.Session) -> None:
+        self.session = session
+
+
+def collect(size: int) -> pytest.Session:
+    project = Path(tempfile.mkdtemp())
+    (project / "pytest.ini").write_text("[pytest]\n")
+    for module in range(max(1, size // TESTS_PER_MODULE)):
+        half = min(size, TESTS_PER_MODULE) // 2
+        methods = "\n".join(f"    def test_{i}(self):\n        pass\n" for i in range(half))
+        source = MODULE.format(half=half, methods=methods)
+        # unique across the suites, they are all imported in this process
+        (project / f"test_{size}_{module}.py").write_text(source)
+    collector = ItemCollector()
+    with contextlib.redirect_stdout(io.StringIO()):
+        pytest.main([str(project), "--co", "-q", "-p", "no:cacheprovider"], plugins=[collector])
+    assert collector.session is not None
+    return collector.session
+
+
+def best_effort_reuse(item, config: pytest.Config, session: pytest.Session):
+    """
+    How the daemon copied the cached items before clone_item
+    """
+    i = best_effort_copy(item)
+    i.config = config
+    i.session = session
+    if i._request:
+        i._request._pyfuncitem = i
+    return i
+
+
+def measure(runs: int, run: Callable[[], object]) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        # the garbage of the previous run is not this run's cost
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list[float], items: int) -> None:
+    mean = statistics.mean(timings)
+    print(
+        f"  {name:<18} mean {mean * 1000:10.1f} ms  min {min(timings) * 1000:10.1f} ms"
+        f"  per item {mean / items * 1_000_000:6.1f} us"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    options = parser.parse_args()
+
+    for size in (int(size) for size in options.sizes.split(",")):
+        session = collect(size)
+        config = session.config
+        print(f"{len(session.items)} items, {options.runs} runs")
+
+        templates = [best_effort_copy(item) for item in session.items]
+        timings = measure(
+            options.runs, lambda: [best_effort_reuse(x, config, session) for x in templates]
+        )
+        report("best_effort_copy", timings, len(templates))
+
+        templates = [clone_item(item) for item in session.items]
+        timings = measure(
+            options.runs, lambda: [clone_item(x, config, session) for x in templates]
+        )
+        report("clone_item", timings, len(templates))
+
+        def clone_paused() -> list[pytest.Item]:
+            with gc_paused():
+                return [clone_item(x, config, session) for x in templates]
+
+        # as the daemon does it
+        report("clone_item, no gc", measure(options.runs, clone_paused), len(templates))
+
+
+if __name__ == "__main__":
+    main()
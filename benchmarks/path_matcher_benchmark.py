@@ -0,0 +1,106 @@
+"""
+Compares the cost of deciding which imported files to watch, with the PathMatcher and
+with one regex per glob, which the daemon used before.
+
+The paths look like the modules a large project imports: most belong to libraries in
+a virtual environment, the rest to the project. Each path is asked about several times,
+as jurigged asks again for modules that are imported again.
+
+Usage: python benchmarks/path_matcher_benchmark.py [--runs 5] [--files 100000]
+    [--ignore-globs 40] [--repeats 3]
+"""
+
+import argparse
+import fnmatch
+import gc
+import re
+import statistics
+import time
+from typing import Callable
+
+from pytest_hot_reloading.path_matcher import PathMatcher
+
+ROOT = "/home/user/project"
+
+
+def regex_per_glob(watch_globs: list[str], ignore_globs: list[str]) -> Callable[[str], bool]:
+    """
+    How the daemon matched the paths before the PathMatcher
+    """
+    regex_matches = [re.compile(fnmatch.translate(glob)).match for glob in watch_globs]
+    ignore_regex_matches = [re.compile(fnmatch.translate(glob)).match for glob in ignore_globs]
+
+    def matcher(filename: str) -> bool:
+        if any(regex_match(filename) for regex_match in regex_matches):
+            if not any(ignore_match(filename) for ignore_match in ignore_regex_matches):
+                return True
+        return False
+
+    return matcher
+
+
+def paths(files: int) -> list[str]:
+    generated = []
+    for i in range(files):
+        if i % 10 == 0:
+            generated.append(f"{ROOT}/src/package_{i % 97}/module_{i}.py")
+        elif i % 10 == 1:
+            generated.append(f"{ROOT}/build/lib/module_{i}.py")
+        else:
+            generated.append(f"{ROOT}/.venv/lib/python3.12/site-packages/lib_{i % 500}/m_{i}.py")
+    return generated
+
+
+def measure(runs: int, run: Callable[[], object]) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list[float], lookups: int) -> None:
+    mean = statistics.mean(timings)
+    print(
+        f"  {name:<16} mean {mean * 1000:10.1f} ms  min {min(timings) * 1000:10.1f} ms"
+        f"  per lookup {mean / lookups * 1_000_000_000:6.0f} ns"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--files", type=int, default=100_000)
+    parser.add_argument("--ignore-globs", type=int, default=40)
+    parser.add_argument("--repeats", type=int, default=3)
+    options = parser.parse_args()
+
+    watch_globs = [f"{ROOT}/*.py"]
+    ignore_globs = [f"{ROOT}/.venv/*", f"{ROOT}/build/*"]
+    ignore_globs += [
+        f"{ROOT}/src/generated_{i}/*" for i in range(options.ignore_globs - len(ignore_globs))
+    ]
+    lookups = paths(options.files) * options.repeats
+    print(
+        f"{options.files} files, {len(ignore_globs)} ignore globs,"
+        f" {len(lookups)} lookups, {options.runs} runs"
+    )
+
+    def run_regex_per_glob() -> None:
+        matcher = regex_per_glob(watch_globs, ignore_globs)
+        for path in lookups:
+            matcher(path)
+
+    def run_path_matcher() -> None:
+        matcher = PathMatcher(watch_globs, ignore_globs)
+        for path in lookups:
+            matcher(path)
+
+    report("regex per glob", measure(options.runs, run_regex_per_glob), len(lookups))
+    report("PathMatcher", measure(options.runs, run_path_matcher), len(lookups))
+
+
+if __name__ == "__main__":
+    main()
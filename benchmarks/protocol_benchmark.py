@@ -0,0 +1,106 @@
+"""
+Compares the round trip overhead of the client/daemon protocols.
+
+The daemon used here does not run pytest. Each run writes a fixed amount
+of output instead, so only the protocol and transport are measured.
+
+Usage: python benchmarks/protocol_benchmark.py [--runs 200] [--sizes 0,10000,1000000]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from threading import Thread
+from typing import Callable
+
+from pytest_hot_reloading.client import PytestClient
+from pytest_hot_reloading.daemon import PytestDaemon
+from pytest_hot_reloading.jurigged_daemon_signalers import JuriggedDaemonSignaler
+
+
+class FakeRunDaemon(PytestDaemon):
+    output_size = 0
+
+    def _run_pytest(
+        self, cwd, env, sys_path, args, stdout, stderr, plugins=None, cancellation=None
+    ) -> int:
+        line = "." * 79 + "\n"
+        lines, remainder = divmod(self.output_size, len(line))
+        for _ in range(lines):
+            stdout.write(line)
+        stdout.write("." * remainder)
+        return 0
+
+
+def measure(runs: int, run: Callable[[], int]) -> list[float]:
+    # warm up
+    run()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            run()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings: list[float]) -> None:
+    timings_ms = sorted(t * 1000 for t in timings)
+    p95 = timings_ms[int(len(timings_ms) * 0.95) - 1]
+    print(
+        f"  {name:<28} mean {statistics.mean(timings_ms):8.3f} ms"
+        f"  p50 {statistics.median(timings_ms):8.3f} ms  p95 {p95:8.3f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--sizes", default="0,10000,1000000", help="Output sizes in bytes")
+    options = parser.parse_args()
+
+    socket_path = os.path.join(tempfile.mkdtemp(), "benchmark.sock")
+    daemon = FakeRunDaemon(JuriggedDaemonSignaler(), socket_path=socket_path)
+    Thread(target=daemon.run_forever, daemon=True).start()
+    PytestDaemon.wait_to_be_ready(socket_path=socket_path)
+
+    cwd = Path.cwd()
+    xmlrpc_client = PytestClient(socket_path=socket_path, protocol="xmlrpc")
+    xmlrpc_streaming_client = PytestClient(
+        socket_path=socket_path, protocol="xmlrpc", stream_output=True
+    )
+    binary_client = PytestClient(socket_path=socket_path)
+
+    print(f"{options.runs} runs per measurement over a unix domain socket")
+    for size in (int(size) for size in options.sizes.split(",")):
+        FakeRunDaemon.output_size = size
+        print(f"{size} bytes of output")
+        report("xml-rpc", measure(options.runs, lambda: xmlrpc_client.run(cwd, [])))
+        report(
+            "xml-rpc streaming",
+            measure(options.runs, lambda: xmlrpc_streaming_client.run(cwd, [])),
+        )
+        report(
+            "binary, new connection", measure(options.runs, lambda: binary_client.run(cwd, []))
+        )
+        # the daemon serves one connection at a time, so this has to be closed
+        # before anything else can talk to the daemon
+        binary_client.abort()
+        kept_alive_client = PytestClient(socket_path=socket_path)
+        kept_alive_client.is_daemon_running()
+        report(
+            "binary, kept alive",
+            measure(options.runs, lambda: kept_alive_client._run_framed(cwd, [])),
+        )
+        kept_alive_client.abort()
+
+    daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
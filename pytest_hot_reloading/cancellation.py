@@ -0,0 +1,144 @@
+"""
+Cancellation of the run in progress when its client goes away or asks to cancel.
+
+The client's connection is watched from a thread while its run is queued or in
+progress. A cancelled run is interrupted the same way as pressing Ctrl-C in a local run:
+the test in progress gets a KeyboardInterrupt, and pytest tears down the session
+and reports what ran. The daemon is then free to serve the next request.
+"""
+
+import _thread
+import os
+import select
+import signal
+import socket
+import threading
+from types import FrameType
+from typing import Any, Callable
+
+from pytest_hot_reloading.protocol import MessageType, ProtocolError, recv_message
+
+
+class ConnectionWatcher:
+    """
+    Used as a context manager while a client waits for its run. Calls on_cancel from
+    a thread when the client hangs up or asks to cancel.
+    """
+
+    def __init__(
+        self, sock: socket.socket, on_cancel: Callable[[], None], framed: bool = True
+    ) -> None:
+        self._sock = sock
+        self._on_cancel = on_cancel
+        # XML-RPC clients don't send anything while waiting, only hanging up counts
+        self._framed = framed
+        self._thread: threading.Thread | None = None
+        self._stop_read_fd, self._stop_write_fd = -1, -1
+
+    def __enter__(self) -> "ConnectionWatcher":
+        self._stop_read_fd, self._stop_write_fd = os.pipe()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        assert self._thread is not None
+        os.write(self._stop_write_fd, b"x")
+        self._thread.join()
+        os.close(self._stop_read_fd)
+        os.close(self._stop_write_fd)
+
+    def _watch(self) -> None:
+        while True:
+            readable, _, _ = select.select([self._sock, self._stop_read_fd], [], [])
+            if self._stop_read_fd in readable:
+                return
+            if not self._framed:
+                if not self._sock.recv(1, socket.MSG_PEEK):
+                    self._on_cancel()
+                return
+            try:
+                message_type, _ = recv_message(self._sock)
+            except (ProtocolError, OSError):
+                # the client hung up
+                self._on_cancel()
+                return
+            if message_type == MessageType.CANCEL:
+                self._on_cancel()
+                return
+
+
+class RunCancellation:
+    """
+    Used as a context manager around a run, which is cancelled by calling cancel(),
+    such as from a ConnectionWatcher. A run that is cancelled before it starts is
+    interrupted as soon as it does.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._active = False
+        self.cancelled = False
+        # when set, the run happens in this forked process
+        self.run_pid: int | None = None
+        self._previous_handler: Any = None
+        self._can_interrupt = False
+        self._started = False
+
+    def __enter__(self) -> "RunCancellation":
+        with self._lock:
+            self._started = True
+            if self.cancelled:
+                raise KeyboardInterrupt
+        # only the main thread receives signals
+        self._can_interrupt = threading.current_thread() is threading.main_thread()
+        if self._can_interrupt:
+            self._previous_handler = signal.signal(signal.SIGINT, self._on_interrupt)
+        self._active = True
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        # first thing, so that a late interrupt doesn't get raised in here
+        self._active = False
+        # wait for a cancel that is being sent to finish
+        with self._lock:
+            pass
+        if self._can_interrupt:
+            # an interrupt that arrived too late is handled, and ignored, before this returns
+            signal.signal(signal.SIGINT, self._previous_handler)
+
+    def set_run_pid(self, pid: int | None) -> None:
+        """
+        Interrupt this forked process instead of the daemon, until it is reaped
+        """
+        with self._lock:
+            self.run_pid = pid
+
+    def cancel(self) -> None:
+        with self._lock:
+            if not self._started:
+                # remembered until the run starts
+                self.cancelled = True
+                return
+            if not self._active or self.cancelled:
+                return
+            self.cancelled = True
+            if self.run_pid is not None:
+                os.kill(self.run_pid, signal.SIGINT)
+            elif self._can_interrupt:
+                if hasattr(signal, "pthread_kill"):
+                    # a real signal also wakes up the main thread if it's blocked
+                    signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)  # type: ignore
+                else:
+                    _thread.interrupt_main()
+
+    def _on_interrupt(self, signum: int, frame: FrameType | None) -> None:
+        if self.cancelled:
+            if self._active:
+                raise KeyboardInterrupt
+            return
+        # Ctrl-C in the daemon's terminal stops the daemon as usual
+        if callable(self._previous_handler):
+            self._previous_handler(signum, frame)
+        elif self._previous_handler != signal.SIG_IGN:
+            raise KeyboardInterrupt
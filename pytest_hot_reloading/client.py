@@ -1,21 +1,57 @@
+import io
 import json
 import os
 import socket
 import sys
 import time
-import xmlrpc.client
 from pathlib import Path
-from typing import Sequence, cast
+from typing import TYPE_CHECKING, Callable, Sequence, cast
+
+from pytest_hot_reloading.environment import baseline_path, diff_env, read_baseline
+from pytest_hot_reloading.protocol import (
+    BASELINE_MISMATCH,
+    VERSION,
+    MessageType,
+    ProtocolError,
+    recv_message,
+    send_json,
+    send_message,
+)
+from pytest_hot_reloading.remote import OutputPathMapper, PathMap, is_loopback, sign
+from pytest_hot_reloading.transport import connect
+
+if TYPE_CHECKING:
+    import xmlrpc.client
+
+# POSTing to this path runs pytest and streams back the output as it is produced
+STREAM_PATH = "/stream"
+
+
+def show_progress_in_title(progress: dict) -> None:
+    """
+    Show how far a streaming run is in the title of the terminal. The streamed output
+    shows it too, but not while the terminal is scrolled back or in another tab.
+    """
+    title = f"pytest {progress['completed']}/{progress['total']}"
+    sys.stdout.write(f"\x1b]2;{title}\x07")
+    sys.stdout.flush()
 
 
 class PytestClient:
     _socket: socket.socket | None
     _daemon_host: str
     _daemon_port: int
+    _socket_path: str | None
     _pytest_name: str
     _will_start_daemon_if_needed: bool
     _do_not_autowatch_fixtures: bool
     _use_os_events: bool
+    _fork_per_run: bool
+    _stream_output: bool
+    _protocol: str
+    _handshake_done: bool
+    _secret: str | None
+    _path_map: PathMap
 
     def __init__(
         self,
@@ -27,18 +63,46 @@ class PytestClient:
         use_os_events: bool = False,
         poll_throttle: float = 1.0,
         additional_args: Sequence[str] = [],
+        stream_output: bool = False,
+        on_progress: Callable[[dict], None] | None = None,
+        socket_path: str | None = None,
+        protocol: str = "binary",
+        fork_per_run: bool = False,
+        secret: str | None = None,
+        path_map: PathMap | None = None,
     ) -> None:
+        if protocol not in ("binary", "xmlrpc"):
+            raise ValueError(f"Unknown protocol {protocol}, expected binary or xmlrpc")
+        if secret and protocol != "binary":
+            raise ValueError("A daemon secret can only be used with the binary protocol")
         self._socket = None
         self._daemon_host = daemon_host
         self._daemon_port = daemon_port
+        self._socket_path = socket_path
         self._pytest_name = pytest_name
         self._will_start_daemon_if_needed = start_daemon_if_needed
         self._do_not_autowatch_fixtures = do_not_autowatch_fixtures
         self._use_os_events = use_os_events
+        self._fork_per_run = fork_per_run
         self._additional_args = additional_args
         self._poll_throttle = poll_throttle
+        self._stream_output = stream_output
+        self._on_progress = on_progress
+        self._protocol = protocol
+        self._handshake_done = False
+        self._secret = secret
+        self._path_map = path_map or PathMap()
+
+    def _get_server(self) -> "xmlrpc.client.ServerProxy":
+        # imported here since the binary protocol doesn't need them
+        import xmlrpc.client
+
+        from pytest_hot_reloading.http_transport import UnixStreamTransport
 
-    def _get_server(self) -> xmlrpc.client.ServerProxy:
+        if self._socket_path:
+            return xmlrpc.client.ServerProxy(
+                "http://localhost", transport=UnixStreamTransport(self._socket_path)
+            )
         server_url = f"http://{self._daemon_host}:{self._daemon_port}"
         server = xmlrpc.client.ServerProxy(server_url)
 
@@ -47,11 +111,16 @@ class PytestClient:
     def run(self, cwd: Path, args: list[str]) -> int:
         if self._will_start_daemon_if_needed:
             self._start_daemon_if_needed()
-        elif not self._daemon_running():
+        elif not self.is_daemon_running():
             raise Exception(
                 "Daemon is not running and must be started, or add --daemon-start-if-needed"
             )
 
+        if self._protocol == "binary":
+            return self._run_framed(cwd, args)
+        if self._stream_output:
+            return self._run_streaming(cwd, args)
+
         server = self._get_server()
 
         env = os.environ.copy()
@@ -69,14 +138,216 @@ class PytestClient:
 
         return result["status_code"]
 
+    def _run_framed(self, cwd: Path, args: list[str]) -> int:
+        """
+        Run the tests over the framed protocol.
+
+        Output is printed as it arrives when streaming, otherwise it's held until the end
+        """
+        sock = self._get_socket()
+        start = time.time()
+        send_json(sock, MessageType.RUN, self._run_request(cwd, args))
+        self._finish_handshake(sock)
+
+        stdout = sys.stdout if self._stream_output else io.StringIO()
+        stderr = sys.stderr if self._stream_output else io.StringIO()
+        streams = {MessageType.STDOUT: stdout, MessageType.STDERR: stderr}
+        # paths can be split between messages
+        mappers = {message_type: OutputPathMapper(self._path_map) for message_type in streams}
+        cancelling = False
+        while True:
+            try:
+                message_type, payload = recv_message(sock)
+            except KeyboardInterrupt:
+                if cancelling:
+                    # pressed twice, don't wait for the daemon to tear down
+                    self.abort()
+                    self._socket = None
+                    raise
+                # the daemon interrupts the run and tears down the session, the same as
+                # Ctrl-C does in a local run, and the output shows what ran
+                print("\nCancelling the run, press Ctrl-C again to stop waiting", file=sys.stderr)
+                cancelling = True
+                send_message(sock, MessageType.CANCEL)
+                continue
+            if message_type in (MessageType.STDOUT, MessageType.STDERR):
+                stream = streams[message_type]
+                stream.write(mappers[message_type].feed(payload.decode("utf-8")))
+                stream.flush()
+            elif message_type == MessageType.PROGRESS:
+                if self._on_progress:
+                    progress = json.loads(payload)
+                    if "nodeid" in progress:
+                        progress["nodeid"] = self._path_map.to_client(progress["nodeid"])
+                    self._on_progress(progress)
+            elif message_type == MessageType.RESULT:
+                status_code = json.loads(payload)["status_code"]
+                for message_type, mapper in mappers.items():
+                    streams[message_type].write(mapper.flush())
+                break
+            elif message_type == MessageType.ERROR:
+                error = json.loads(payload)
+                if error.get("code") == BASELINE_MISMATCH:
+                    # the daemon was restarted since the baseline was read, send everything
+                    send_json(sock, MessageType.RUN, self._run_request(cwd, args, False))
+                    continue
+                raise ProtocolError(error["error"])
+
+        if self._stream_output:
+            print(f"Daemon took {(time.time() - start):.3f} seconds to finish")
+        else:
+            print(f"Daemon took {(time.time() - start):.3f} seconds to reply")
+            print(cast(io.StringIO, stdout).getvalue(), file=sys.stdout)
+            print(cast(io.StringIO, stderr).getvalue(), file=sys.stderr)
+
+        return status_code
+
+    def _run_request(self, cwd: Path, args: list[str], use_baseline: bool = True) -> dict:
+        """
+        The run request. The environment and sys.path are sent as changes to
+        the daemon's baseline when it is available, otherwise they're sent in full.
+        """
+        env = os.environ.copy()
+        request = {
+            "cwd": str(cwd),
+            "args": args,
+            "env_base": None,
+            "env_set": env,
+            "env_unset": [],
+            "sys_path": sys.path,
+        }
+        baseline = (
+            read_baseline(baseline_path(self._daemon_port, self._socket_path))
+            if use_baseline and not self._is_remote()
+            else None
+        )
+        if self._is_remote():
+            # the client's environment doesn't describe the daemon's machine,
+            # so the daemon keeps its own and only gets the project's paths
+            mapped_sys_path = [self._path_map.to_daemon(path) for path in sys.path]
+            request.update(
+                cwd=self._path_map.arg_to_daemon(str(cwd)),
+                args=[self._path_map.arg_to_daemon(arg) for arg in args],
+                env_set=None,
+                sys_path=None,
+                sys_path_extra=[path for path in mapped_sys_path if path],
+            )
+        elif baseline:
+            env_set, env_unset = diff_env(baseline["env"], env)
+            request.update(
+                env_base=baseline["fingerprint"],
+                env_set=env_set,
+                env_unset=env_unset,
+                sys_path=None if sys.path == baseline["sys_path"] else sys.path,
+            )
+        return request
+
+    def _is_remote(self) -> bool:
+        """
+        Whether the daemon runs on another machine or in a container, rather than
+        alongside the client
+        """
+        if self._path_map:
+            return True
+        return not self._socket_path and not is_loopback(self._daemon_host)
+
+    def _get_socket(self) -> socket.socket:
+        """
+        The connection to the daemon. It is kept open and reused for later requests
+        """
+        if self._socket is None:
+            self._socket = connect(self._daemon_host, self._daemon_port, self._socket_path)
+        if not self._handshake_done:
+            # the reply is read after the first request has been sent
+            # so the handshake doesn't cost an extra round trip
+            send_json(
+                self._socket,
+                MessageType.HELLO,
+                {
+                    "version": VERSION,
+                    "python": sys.version,
+                    "python_version": list(sys.version_info[:2]),
+                },
+            )
+            if self._secret:
+                # the daemon's challenge must be answered before anything else is sent
+                self._finish_handshake(self._socket)
+        return self._socket
+
+    def _finish_handshake(self, sock: socket.socket) -> None:
+        if self._handshake_done:
+            return
+        message_type, payload = recv_message(sock)
+        if message_type == MessageType.ERROR:
+            raise ProtocolError(json.loads(payload)["error"])
+        if message_type != MessageType.HELLO:
+            raise ProtocolError(f"Expected the daemon to say hello, got {message_type.name}")
+        challenge = json.loads(payload).get("challenge")
+        if challenge:
+            if not self._secret:
+                raise ProtocolError("The daemon requires a secret, set --daemon-secret")
+            send_json(sock, MessageType.AUTH, {"signature": sign(self._secret, challenge)})
+        self._handshake_done = True
+
+    def _run_streaming(self, cwd: Path, args: list[str]) -> int:
+        """
+        Run the tests, printing the output as the daemon sends it
+        """
+        body = json.dumps(
+            {
+                "cwd": str(cwd),
+                "env_json": json.dumps(os.environ.copy()),
+                "sys_path": sys.path,
+                "args": args,
+            }
+        )
+        import http.client
+
+        from pytest_hot_reloading.http_transport import UnixStreamHTTPConnection
+
+        connection: http.client.HTTPConnection
+        if self._socket_path:
+            connection = UnixStreamHTTPConnection(self._socket_path)
+        else:
+            connection = http.client.HTTPConnection(self._daemon_host, self._daemon_port)
+
+        start = time.time()
+        connection.request("POST", STREAM_PATH, body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        if response.status != 200:
+            raise Exception(f"Daemon refused to run: {response.status} {response.reason}")
+
+        status_code = -1
+        # each line is a JSON event
+        for line in response:
+            event = json.loads(line)
+            if "stream" in event:
+                stream = sys.stdout if event["stream"] == "stdout" else sys.stderr
+                stream.write(event["data"])
+                stream.flush()
+            elif "progress" in event:
+                if self._on_progress:
+                    self._on_progress(event["progress"])
+            elif "status_code" in event:
+                status_code = event["status_code"]
+        connection.close()
+        print(f"Daemon took {(time.time() - start):.3f} seconds to finish")
+
+        return status_code
+
     def stop(self) -> None:
         """
         Stop the daemon
         """
-        server = self._get_server()
-
         try:
-            server.stop()
+            if self._protocol == "binary":
+                sock = self._get_socket()
+                send_message(sock, MessageType.STOP)
+                self._finish_handshake(sock)
+                recv_message(sock)
+                self.abort()
+            else:
+                self._get_server().stop()
         except OSError:
             print("Daemon is not running")
         else:
@@ -87,23 +358,27 @@ class PytestClient:
         if self._socket:
             self._socket.close()
 
-    def _daemon_running(self) -> bool:
+    def is_daemon_running(self) -> bool:
         # first, try to connect
         try:
-            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._socket.connect((self._daemon_host, self._daemon_port))
-            # the daemon is running
-            # close the socket
-            self._socket.close()
-            return True
-        except ConnectionRefusedError:
+            sock = connect(self._daemon_host, self._daemon_port, self._socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
             # the daemon is not running
             return False
+        # the daemon is running
+        if self._protocol == "binary":
+            # hold on to the connection so the run can use it
+            self.abort()
+            self._socket = sock
+            self._handshake_done = False
+        else:
+            sock.close()
+        return True
 
     def _start_daemon_if_needed(self) -> None:
         # check if the daemon is running on the expected host and port
         # if not, start the daemon
-        if not self._daemon_running():
+        if not self.is_daemon_running():
             self._start_daemon()
 
     def _start_daemon(self) -> None:
@@ -118,4 +393,6 @@ class PytestClient:
             use_os_events=self._use_os_events,
             additional_args=self._additional_args,
             poll_throttle=self._poll_throttle,
+            socket_path=self._socket_path,
+            fork_per_run=self._fork_per_run,
         )
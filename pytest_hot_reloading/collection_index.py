@@ -0,0 +1,101 @@
+"""
+An index of what the daemon collected, kept in the pytest cache so that it outlives
+the daemon.
+
+The collected items are bound to the imported test modules, so they can't be saved.
+What is saved is which modules each set of arguments collected, and the directories
+that were walked to find them. As long as none of those directories, their
+conftest.py files or the ini file changed, no test module was added, removed or
+renamed since, and a restarted daemon collects the indexed modules directly instead
+of walking the whole tree and calling the collection hooks on every file in it.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Sequence
+
+import pytest
+
+INDEX_KEY = "pytest_hot_reloading/collection_index"
+# argument sets kept per project
+MAX_ENTRIES = 16
+
+
+class CollectionRecorder:
+    """
+    Pytest plugin that records the directories walked during collection and the
+    modules the tests were collected from
+    """
+
+    def __init__(self) -> None:
+        self.directories: list[str] = []
+        self.modules: list[str] = []
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_ignore_collect(self, collection_path: Path) -> None:
+        if collection_path.is_dir():
+            self.directories.append(str(collection_path))
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collection_modifyitems(self, items: list[pytest.Item]) -> None:
+        # before -k and -m deselect any, the deselected are still reported
+        self.modules = list(dict.fromkeys(str(item.path) for item in items))
+
+
+class CollectionIndex:
+    def __init__(self, config: pytest.Config, sys_path_digest: str) -> None:
+        # not available with -p no:cacheprovider
+        self._cache = getattr(config, "cache", None)
+        # virtualenvs of the same project can have different plugins
+        self._key = f"{INDEX_KEY}/{sys_path_digest}"
+        inipath = config.inipath
+        self._inipath = str(inipath) if inipath else None
+
+    def modules(self, args: Sequence[str], options: Sequence[str]) -> list[str] | None:
+        """
+        The modules collected for the arguments, if nothing that decides which
+        modules are collected changed since
+        """
+        if self._cache is None or any("::" in arg for arg in args):
+            return None
+        entry = self._cache.get(self._key, {}).get(_entry_key(args, options))
+        if entry is None:
+            return None
+        for path, mtime in entry["mtimes"].items():
+            if _mtime(path) != mtime:
+                return None
+        return entry["modules"]
+
+    def record(
+        self, args: Sequence[str], options: Sequence[str], recorder: CollectionRecorder
+    ) -> None:
+        if self._cache is None or any("::" in arg for arg in args):
+            return
+        paths = [*recorder.directories]
+        paths += [os.path.join(directory, "conftest.py") for directory in recorder.directories]
+        if self._inipath:
+            paths.append(self._inipath)
+        entries = self._cache.get(self._key, {})
+        key = _entry_key(args, options)
+        entries.pop(key, None)
+        # a missing conftest.py is recorded too, adding one changes its mtime
+        entries[key] = {
+            "mtimes": {path: _mtime(path) for path in paths},
+            "modules": recorder.modules,
+        }
+        # the oldest entries come first
+        for old_key in list(entries)[:-MAX_ENTRIES]:
+            del entries[old_key]
+        self._cache.set(self._key, entries)
+
+
+def _entry_key(args: Sequence[str], options: Sequence[str]) -> str:
+    return json.dumps([list(args), list(options)])
+
+
+def _mtime(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
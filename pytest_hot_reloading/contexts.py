@@ -0,0 +1,470 @@
+"""
+Per-project state kept by the daemon.
+
+One daemon can serve several projects, for example the packages of a monorepo,
+or the same project from different virtualenvs. Each gets its own context so
+their caches never mix. Contexts that haven't been used recently are evicted when
+the estimated size of their caches goes over the daemon's memory budget.
+"""
+
+import hashlib
+import sys
+import time
+import types
+import weakref
+from collections import OrderedDict
+from typing import Callable, Collection, Iterable, NamedTuple, Sequence
+
+import pytest
+
+from pytest_hot_reloading.jurigged_daemon_signalers import CacheInvalidation
+from pytest_hot_reloading.selections import covers
+
+
+class ContextKey(NamedTuple):
+    rootdir: str
+    # virtualenvs that share the daemon's interpreter differ by their sys.path
+    sys_path: str
+
+
+def context_key(rootdir: str, sys_path: Sequence[str]) -> ContextKey:
+    digest = hashlib.sha1("\0".join(sys_path).encode("utf-8")).hexdigest()
+    return ContextKey(rootdir, digest)
+
+
+def fixture_closure(item: pytest.Item) -> Sequence[str]:
+    """
+    The names of the fixtures the item uses, directly or through other fixtures
+    """
+    fixture_info = getattr(item, "_fixtureinfo", None)
+    return getattr(fixture_info, "names_closure", ())
+
+
+def item_selection(item: pytest.Item) -> str:
+    """
+    The absolute selection of just this item
+    """
+    names = item.nodeid.partition("::")[2]
+    return f"{item.path}::{names}" if names else str(item.path)
+
+
+class CachedCollection:
+    """
+    The items collected for one set of arguments. The modules that changed since
+    are collected again on the next run, the items of the others are reused.
+
+    Runs of narrower selections, collected with the same options, are answered by
+    picking their items from here.
+    """
+
+    def __init__(
+        self, items: tuple, selections: Sequence[str] = (), options: Sequence[str] = ()
+    ) -> None:
+        self._items = items
+        self._index: dict[str, list[int]] | None = None
+        # absolute, so runs from other directories of the project can use them
+        self.selections = tuple(selections)
+        self.options = tuple(options)
+        self.stale_paths: set[str] = set()
+        # fixtures that request other fixtures now, the closures of their tests are stale
+        self.stale_closures: set[str] = set()
+
+    @property
+    def items(self) -> tuple:
+        return self._items
+
+    @items.setter
+    def items(self, items: tuple) -> None:
+        self._items = items
+        self._index = None
+
+    @property
+    def index(self) -> dict[str, list[int]]:
+        """
+        The positions of the items of each module
+        """
+        if self._index is None:
+            self._index = {}
+            for i, item in enumerate(self._items):
+                self._index.setdefault(str(item.path), []).append(i)
+        return self._index
+
+    def covers(self, selections: Sequence[str], options: Sequence[str]) -> bool:
+        return (
+            not (self.stale_paths or self.stale_closures)
+            and self.options == tuple(options)
+            and all(
+                any(covers(broad, narrow) for broad in self.selections) for narrow in selections
+            )
+        )
+
+    def select(self, selections: Sequence[str]) -> list | None:
+        """
+        The items of the absolute selections, in the order collecting them would give.
+        None if a selection has no items here, since collecting a path directly can
+        find tests that collecting its parent doesn't, such as a file that doesn't
+        match python_files.
+        """
+        selected: dict[int, None] = {}
+        for selection in selections:
+            path = selection.partition("::")[0]
+            candidates = sorted(
+                i
+                for module_path, positions in self.index.items()
+                if covers(path, module_path)
+                for i in positions
+            )
+            matches = [i for i in candidates if covers(selection, item_selection(self._items[i]))]
+            if not matches:
+                return None
+            selected.update(dict.fromkeys(matches))
+        return [self._items[i] for i in selected]
+
+    def invalidate(
+        self, paths: Collection[str], fixtures: Collection[str], closures: Collection[str] = ()
+    ) -> None:
+        changed_fixtures = set(fixtures)
+        changed_closures = set(closures)
+        for item in self.items:
+            path = str(item.path)
+            item_closure = fixture_closure(item)
+            if path in paths or not changed_fixtures.isdisjoint(item_closure):
+                self.stale_paths.add(path)
+            self.stale_closures |= changed_closures.intersection(item_closure)
+
+
+def estimate_size(objects: Iterable[object], depth: int = 3) -> int:
+    """
+    A rough estimate of the memory the objects hold, in bytes. Only a few levels of
+    attributes and containers are followed, past that items mostly share the same
+    objects, such as the config and the session. Each object is counted once.
+    """
+    seen: set[int] = set()
+    total = 0
+    pending = [(obj, depth) for obj in objects]
+    while pending:
+        obj, depth_remaining = pending.pop()
+        # modules, classes and functions belong to the code under test, not the cache
+        if id(obj) in seen or isinstance(
+            obj, (type, types.ModuleType, types.FunctionType, types.MethodType)
+        ):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj, 0)
+        if depth_remaining <= 0:
+            continue
+        children: Iterable[object]
+        if isinstance(obj, dict):
+            children = [*obj.keys(), *obj.values()]
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            children = obj
+        elif hasattr(obj, "__dict__"):
+            children = [obj.__dict__]
+        else:
+            continue
+        pending += [(child, depth_remaining - 1) for child in children]
+    return total
+
+
+class CacheEntry(NamedTuple):
+    collection: CachedCollection
+    size: int
+    last_used: float
+
+
+class CollectionCache:
+    """
+    The cached collections of a project, keyed by their arguments. The least recently
+    used collections are evicted to keep their estimated size within the budget.
+    Collections that aren't used for longer than the TTL expire, if there is one.
+    """
+
+    def __init__(self, budget_bytes: int = 0, ttl: float = 0) -> None:
+        # 0 disables the budget and the TTL
+        self.budget_bytes = budget_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.broader_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        # least recently used first
+        self._entries: OrderedDict[tuple, CacheEntry] = OrderedDict()
+
+    def __len__(self) -> int:
+        self._expire()
+        return len(self._entries)
+
+    def __contains__(self, key: tuple) -> bool:
+        self._expire()
+        return key in self._entries
+
+    def __setitem__(self, key: tuple, collection: CachedCollection) -> None:
+        """
+        Add or update a collection. Set it again after changing its items, so that
+        its size is estimated again.
+        """
+        if not self._remove(key):
+            # a run that had to collect
+            self.misses += 1
+        entry = CacheEntry(collection, estimate_size(collection.items), time.monotonic())
+        self._entries[key] = entry
+        self.size += entry.size
+        # the newest collection is kept even if it doesn't fit on its own
+        while self.budget_bytes and self.size > self.budget_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def get(self, key: tuple) -> CachedCollection | None:
+        self._expire()
+        entry = self._entries.get(key)
+        if entry is None:
+            # only counted as a miss once it's collected, it may be answered by select()
+            return None
+        self.hits += 1
+        self._touch(key)
+        return entry.collection
+
+    def items(self) -> list[tuple[tuple, CachedCollection]]:
+        """
+        The collections, most recently used first. Doesn't count as using them.
+        """
+        self._expire()
+        return [(key, entry.collection) for key, entry in reversed(self._entries.items())]
+
+    def values(self) -> list[CachedCollection]:
+        return [collection for _, collection in self.items()]
+
+    def select(self, key: tuple) -> None:
+        """
+        Count a run answered from the collection of a broader selection
+        """
+        if key in self._entries:
+            self.broader_hits += 1
+            self._touch(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict[str, int | float]:
+        # also read from the server threads, so nothing is expired here
+        return {
+            "collections": len(self._entries),
+            "size_mb": self.size / (1024 * 1024),
+            "budget_mb": self.budget_bytes / (1024 * 1024),
+            "hits": self.hits,
+            "broader_hits": self.broader_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _touch(self, key: tuple) -> None:
+        self._entries[key] = self._entries[key]._replace(last_used=time.monotonic())
+        self._entries.move_to_end(key)
+
+    def _remove(self, key: tuple) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self.size -= entry.size
+        return True
+
+    def _expire(self) -> None:
+        if not self.ttl:
+            return
+        expired_before = time.monotonic() - self.ttl
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.last_used > expired_before:
+                break
+            self._remove(key)
+            self.expirations += 1
+
+
+class ModuleItems(NamedTuple):
+    digest: str | None
+    items: tuple
+
+
+class ModuleCache:
+    """
+    The items of each module, for collections of other selections. A module's items
+    are used as long as its content hash is the same.
+    """
+
+    def __init__(self) -> None:
+        self._modules: dict[str, ModuleItems] = {}
+
+    def __len__(self) -> int:
+        return len(self._modules)
+
+    def get(self, path: str) -> tuple | None:
+        entry = self._modules.get(path)
+        if entry is None or entry.digest != file_digest(path):
+            return None
+        return entry.items
+
+    def store(self, path: str, items: Sequence[pytest.Item]) -> None:
+        self._modules[path] = ModuleItems(file_digest(path), tuple(items))
+
+    def invalidate(
+        self, paths: Collection[str], fixtures: Collection[str], closures: Collection[str] = ()
+    ) -> None:
+        # the modules whose tests have stale fixture closures are collected again
+        changed_fixtures = set(fixtures) | set(closures)
+        for path, entry in list(self._modules.items()):
+            if path in paths or any(
+                not changed_fixtures.isdisjoint(fixture_closure(item)) for item in entry.items
+            ):
+                del self._modules[path]
+
+    def clear(self) -> None:
+        self._modules.clear()
+
+
+def file_digest(path: str) -> str | None:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+class RunContext:
+    """
+    The caches that belong to one project
+    """
+
+    def __init__(self, key: ContextKey, cache: CollectionCache | None = None) -> None:
+        self.key = key
+        self.session_item_cache = cache if cache is not None else CollectionCache()
+        self.module_cache = ModuleCache()
+        # hack: keeping a session cache since pytest has session references
+        #       littered everywhere on objects. Weak, so unreferenced sessions are freed
+        self.prior_sessions: weakref.WeakSet[pytest.Session] = weakref.WeakSet()
+        self.last_used = time.monotonic()
+
+    def prior_sessions_size(self) -> int:
+        """
+        The estimated memory the earlier sessions keep alive, in bytes. They share the
+        state of the latest session, so it is counted once.
+        """
+        return estimate_size(list(self.prior_sessions))
+
+    def invalidate(
+        self, paths: Collection[str], fixtures: Collection[str], closures: Collection[str] = ()
+    ) -> None:
+        for cached in self.session_item_cache.values():
+            cached.invalidate(paths, fixtures, closures)
+        self.module_cache.invalidate(paths, fixtures, closures)
+
+    def select_cached(self, selections: Sequence[str], options: Sequence[str]) -> list | None:
+        """
+        The items of the absolute selections, taken from a cached collection of a
+        broader selection collected with the same options
+        """
+        for key, cached in self.session_item_cache.items():
+            if cached.covers(selections, options):
+                items = cached.select(selections)
+                if items is not None:
+                    self.session_item_cache.select(key)
+                    return items
+        return None
+
+
+class ContextRegistry:
+    def __init__(
+        self, memory_budget_mb: int = 0, cache_budget_mb: int = 0, cache_ttl: float = 0
+    ) -> None:
+        self.memory_budget_mb = memory_budget_mb
+        # of the collection cache of each project
+        self.cache_budget_mb = cache_budget_mb
+        self.cache_ttl = cache_ttl
+        self._contexts: dict[ContextKey, RunContext] = {}
+
+    def __len__(self) -> int:
+        return len(self._contexts)
+
+    def serves(self, rootdir: str) -> bool:
+        """
+        Whether a context of the project is kept, from any of its virtualenvs
+        """
+        return any(key.rootdir == rootdir for key in self._contexts)
+
+    def get(
+        self, key: ContextKey, on_new: Callable[[RunContext], None] | None = None
+    ) -> RunContext:
+        context = self._contexts.get(key)
+        if context is None:
+            cache = CollectionCache(self.cache_budget_mb * 1024 * 1024, self.cache_ttl)
+            context = self._contexts[key] = RunContext(key, cache)
+            if on_new:
+                on_new(context)
+        context.last_used = time.monotonic()
+        return context
+
+    def cache_stats(self) -> list[dict]:
+        """
+        The counters of the collection cache of each project
+        """
+        return [
+            {
+                "rootdir": key.rootdir,
+                **context.session_item_cache.stats(),
+                "cached_modules": len(context.module_cache),
+                # earlier sessions that something still refers to
+                "prior_session_count": len(context.prior_sessions),
+                "prior_sessions_mb": context.prior_sessions_size() / (1024 * 1024),
+            }
+            for key, context in list(self._contexts.items())
+        ]
+
+    def clear_caches(self) -> None:
+        for context in self._contexts.values():
+            context.session_item_cache.clear()
+            context.module_cache.clear()
+
+    def invalidate(self, invalidation: CacheInvalidation) -> None:
+        """
+        Drop the cached collection of what changed, or of everything if it isn't known
+        what the change affects
+        """
+        if invalidation.clear_all:
+            self.clear_caches()
+            return
+        for context in self._contexts.values():
+            context.invalidate(invalidation.paths, invalidation.fixtures, invalidation.closures)
+
+    def size(self) -> int:
+        """
+        The estimated size of the cached collections of all the projects, in bytes
+        """
+        return sum(context.session_item_cache.size for context in self._contexts.values())
+
+    def evict_idle(self, keep: RunContext) -> list[ContextKey]:
+        """
+        Drop the least recently used contexts until the estimated size of the caches is
+        within the memory budget. The context in use is always kept.
+
+        The resident memory of the daemon isn't used, it hardly ever goes down once
+        objects are freed.
+        """
+        evicted: list[ContextKey] = []
+        if not self.memory_budget_mb:
+            return evicted
+        budget = self.memory_budget_mb * 1024 * 1024
+        size = self.size()
+        idle = sorted(
+            (context for context in self._contexts.values() if context is not keep),
+            key=lambda context: context.last_used,
+        )
+        for context in idle:
+            if size <= budget:
+                break
+            size -= context.session_item_cache.size
+            del self._contexts[context.key]
+            evicted.append(context.key)
+        return evicted
@@ -1,26 +1,234 @@
-import copy
+import io
 import json
 import os
 import re
+import signal
 import socket
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import traceback
 from pathlib import Path
+from socketserver import ThreadingMixIn
 from threading import Thread
-from typing import Counter, Generator, Sequence
-from xmlrpc.server import SimpleXMLRPCServer
+from typing import Callable, Generator, Sequence, TextIO, cast
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
 
 import pytest
-from cachetools import TTLCache
 
+from pytest_hot_reloading.cancellation import RunCancellation
+from pytest_hot_reloading.client import STREAM_PATH
+from pytest_hot_reloading.collection_index import CollectionIndex, CollectionRecorder
+from pytest_hot_reloading.contexts import (
+    CachedCollection,
+    ContextRegistry,
+    RunContext,
+    context_key,
+    fixture_closure,
+)
+from pytest_hot_reloading.environment import (
+    baseline_path,
+    client_environment,
+    fingerprint,
+    write_baseline,
+)
+from pytest_hot_reloading.items import clone_item, gc_paused, refresh_fixture_closure
 from pytest_hot_reloading.jurigged_daemon_signalers import JuriggedDaemonSignaler
+from pytest_hot_reloading.module_reuse import ModuleReuse
+from pytest_hot_reloading.protocol import (
+    BASELINE_MISMATCH,
+    VERSION,
+    ConnectionClosedError,
+    MessageType,
+    ProtocolError,
+    is_framed,
+    recv_message,
+    send_json,
+    send_message,
+)
+from pytest_hot_reloading.remote import is_loopback, new_challenge, verify
+from pytest_hot_reloading.runqueue import RunBatch, RunQueue, RunRequest
+from pytest_hot_reloading.selections import absolute_selection
+from pytest_hot_reloading.startup import STARTUP_TIMEOUT, wait_for_startup
+from pytest_hot_reloading.transport import connect
 from pytest_hot_reloading.workarounds import (
     run_workarounds_post,
     run_workarounds_pre,
 )
+from pytest_hot_reloading.workers import ForkedWorkers
+
+
+def _major_minor(version: Sequence[int]) -> str:
+    return ".".join(str(part) for part in version[:2])
+
+
+def _remove_ansi_escape(s: str) -> str:
+    return re.sub(r"\x1b(\[.*?[@-~]|\].*?(\x07|\x1b\\))", "", s, flags=re.MULTILINE)
+
+
+class StreamingOutput(io.TextIOBase):
+    """
+    A stand-in for stdout or stderr that forwards every write as an event as soon
+    as it happens, rather than holding onto the output until the session ends.
+
+    Writes are also echoed to the daemon's own output.
+    """
+
+    def __init__(self, name: str, send: Callable[[str, str], None], echo: TextIO) -> None:
+        self._name = name
+        self._send = send
+        self._echo = echo
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, s: str) -> int:
+        self._echo.write(s)
+        if s:
+            self._send(self._name, _remove_ansi_escape(s))
+        return len(s)
+
+    def flush(self) -> None:
+        self._echo.flush()
+
+
+class ProgressReporter:
+    """
+    Pytest plugin that sends progress events while a streaming run is in progress
+    """
+
+    def __init__(self, send: Callable[[dict], None]) -> None:
+        self._send = send
+        self._total = 0
+        self._completed = 0
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session: pytest.Session) -> None:
+        self._total = len(session.items)
+        self._send({"completed": 0, "total": self._total})
+
+    def pytest_runtest_logfinish(self, nodeid: str) -> None:
+        self._completed += 1
+        self._send({"completed": self._completed, "total": self._total, "nodeid": nodeid})
+
+
+class StreamingRequestHandler(SimpleXMLRPCRequestHandler):
+    """
+    Handles XML-RPC requests as usual, plus POSTs to the stream path, which run pytest
+    and reply with newline delimited JSON events using chunked transfer encoding.
+    """
+
+    def setup(self) -> None:
+        # TCP_NODELAY can't be set on a unix domain socket
+        if self.server.address_family == socket.AF_UNIX:  # type: ignore
+            self.disable_nagle_algorithm = False  # type: ignore
+        super().setup()
+
+    def do_POST(self) -> None:
+        if self.server.pytest_daemon.requires_secret:  # type: ignore
+            # XML-RPC has no way to authenticate
+            self.rfile.read(int(self.headers["content-length"]))
+            self.send_error(403, "The daemon requires a secret, which needs the binary protocol")
+            return
+        if self.path != STREAM_PATH:
+            return super().do_POST()
+
+        request = json.loads(self.rfile.read(int(self.headers["content-length"])))
+
+        # chunked transfer encoding is only a thing in HTTP/1.1
+        self.protocol_version = "HTTP/1.1"
+        self.close_connection = True
+        self._client_gone = False
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def send(event: dict) -> None:
+            data = json.dumps(event).encode("utf-8") + b"\n"
+            self._write_chunk(data)
+
+        status_code = self.server.pytest_daemon.run_pytest_streaming(  # type: ignore
+            request["cwd"],
+            json.loads(request["env_json"]),
+            request["sys_path"],
+            request["args"],
+            send_output=lambda stream, data: send({"stream": stream, "data": data}),
+            send_progress=lambda progress: send({"progress": progress}),
+            connection=self.connection,
+            framed=False,
+        )
+        send({"status_code": status_code})
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data: bytes) -> None:
+        # if the client went away, the run is cancelled and there's nobody left
+        # to show the output to
+        if self._client_gone:
+            return
+        try:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+        except OSError:
+            self._client_gone = True
+
+    def address_string(self) -> str:
+        # clients of a unix domain socket don't have an address
+        if not self.client_address:
+            return "unix"
+        return super().address_string()
+
+
+class DaemonServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """
+    Serves both XML-RPC and the framed protocol on the same socket.
+
+    The first bytes of a connection decide which protocol it speaks. Each connection
+    is served on its own thread, the runs themselves are queued for the main thread.
+    """
+
+    daemon_threads = True
+    pytest_daemon: "PytestDaemon"
+    # the connection served by each thread, XML-RPC functions don't get it
+    _local = threading.local()
+
+    @property
+    def current_request(self) -> socket.socket | None:
+        return getattr(self._local, "request", None)
+
+    def finish_request(self, request, client_address) -> None:
+        self._local.request = request
+        if is_framed(request):
+            self.pytest_daemon.handle_framed_connection(request)
+        else:
+            super().finish_request(request, client_address)
+
+    def handle_error(self, request, client_address) -> None:
+        # a client that went away, such as after cancelling its run, isn't an error
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class UnixStreamDaemonServer(DaemonServer):
+    """
+    Daemon server listening on a unix domain socket. Only the current user
+    may connect to it.
+    """
+
+    address_family = socket.AF_UNIX
+
+    def server_bind(self) -> None:
+        super().server_bind()
+        os.chmod(self.server_address, 0o600)  # type: ignore
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.server_address):  # type: ignore
+            os.unlink(self.server_address)  # type: ignore
 
 
 class PytestDaemon:
@@ -29,16 +237,44 @@ class PytestDaemon:
         signaler: JuriggedDaemonSignaler,
         daemon_host: str = "localhost",
         daemon_port: int = 4852,
+        socket_path: str | None = None,
+        fork_per_run: bool = False,
+        memory_budget_mb: int = 0,
+        cache_budget_mb: int = 0,
+        cache_ttl: float = 0,
+        secret: str | None = None,
+        warmup: Sequence[Sequence[str]] = (),
     ) -> None:
         self._daemon_host = daemon_host
         self._daemon_port = daemon_port
+        self._socket_path = socket_path
         self._server: SimpleXMLRPCServer | None = None
         self._signaler = signaler
+        self._fork_per_run = fork_per_run and hasattr(os, "fork")
+        # the caches of every project served by this daemon
+        self._contexts = ContextRegistry(memory_budget_mb, cache_budget_mb, cache_ttl)
+        self._secret = secret
+        self._warmup = warmup
+        self._runs = RunQueue()
+        # clients send their environment relative to the one the daemon started with
+        self._baseline_env = os.environ.copy()
+        self._baseline_sys_path = list(sys.path)
+        self._baseline_fingerprint = fingerprint(self._baseline_env, self._baseline_sys_path)
 
     @property
     def pid_file(self) -> Path:
+        if self._socket_path:
+            return Path(f"{self._socket_path}.pid")
         return Path(tempfile.gettempdir()) / f".pytest_hot_reloading_{self._daemon_port}.pid"
 
+    @property
+    def requires_secret(self) -> bool:
+        return bool(self._secret)
+
+    @property
+    def baseline_file(self) -> Path:
+        return baseline_path(self._daemon_port, self._socket_path)
+
     @staticmethod
     def start(
         host: str,
@@ -50,9 +286,11 @@ class PytestDaemon:
         use_os_events: bool | None = None,
         poll_throttle: float | None = None,
         additional_args: Sequence[str] | None = None,
+        socket_path: str | None = None,
+        fork_per_run: bool | None = None,
     ) -> None:
         # start the daemon such that it will not close when the parent process closes
-        if host == "localhost":
+        if is_loopback(host):
             args = [
                 sys.executable,
                 "-m",
@@ -69,58 +307,224 @@ class PytestDaemon:
                 args += ["--daemon-do-not-autowatch-fixtures"]
             if use_os_events:
                 args += ["--daemon-use-os-events"]
+            elif use_os_events is not None:
+                args += ["--daemon-use-polling"]
             if poll_throttle:
                 args += ["--daemon-poll-throttle", str(poll_throttle)]
-            subprocess.Popen(
-                args + list(additional_args or []),
-                env=os.environ,
-                cwd=os.getcwd(),
-            )
+            if socket_path:
+                args += ["--daemon-unix-socket"]
+            if fork_per_run:
+                args += ["--daemon-fork-per-run"]
+            if os.name == "nt":
+                # there's no way to hand the daemon a pipe, so fall back to polling
+                subprocess.Popen(
+                    args + list(additional_args or []),
+                    env=os.environ,
+                    cwd=os.getcwd(),
+                )
+                PytestDaemon.wait_to_be_ready(host, port, socket_path)
+                return
+            # the daemon reports its progress on this pipe until it is ready
+            read_fd, write_fd = os.pipe()
+            try:
+                process = subprocess.Popen(
+                    args + ["--daemon-ready-fd", str(write_fd)] + list(additional_args or []),
+                    env=os.environ,
+                    cwd=os.getcwd(),
+                    pass_fds=(write_fd,),
+                )
+            finally:
+                os.close(write_fd)
+            wait_for_startup(read_fd, process)
         else:
-            raise NotImplementedError("Only localhost is supported for now")
-        PytestDaemon.wait_to_be_ready(host, port)
+            raise Exception(
+                f"The daemon at {host} can't be started from here. "
+                "Start it where it runs with --daemon --daemon-host and --daemon-secret"
+            )
 
     def stop(self) -> dict:
         if self._server:
-            t = Thread(target=self._server.shutdown, daemon=True)
-            t.start()
+            # the main thread shuts down the server once the run in progress is done
+            self._runs.close()
             self._delete_pid_file()
+            self._delete_baseline_file()
 
         return {"shutdown": "ok"}
 
     @staticmethod
-    def wait_to_be_ready(host: str = "localhost", port: int = 4852) -> None:
+    def wait_to_be_ready(
+        host: str = "localhost", port: int = 4852, socket_path: str | None = None
+    ) -> None:
         # poll the connection to the daemon using sockets
         # and return when it is ready
-        for _ in range(100):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
             try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect((host, port))
-            except ConnectionRefusedError:
-                time.sleep(0.1)
-                continue
+                connect(host, port, socket_path).close()
+            except (ConnectionRefusedError, FileNotFoundError):
+                if time.monotonic() >= deadline:
+                    raise Exception("Could not connect to the daemon")
+                time.sleep(0.01)
             else:
                 break
-        else:
-            raise Exception("Could not connect to the daemon")
 
-    def run_forever(self) -> None:  # create an XML-RPC server
+    def run_forever(
+        self,
+        on_ready: Callable[[], None] | None = None,
+        on_phase: Callable[[str], None] | None = None,
+    ) -> None:
+        # create an XML-RPC server
+        if not self._socket_path and not is_loopback(self._daemon_host) and not self._secret:
+            raise Exception(
+                f"Listening on {self._daemon_host} would let anyone who can reach it run code. "
+                "Set a shared secret with --daemon-secret"
+            )
         try:
-            server = SimpleXMLRPCServer((self._daemon_host, self._daemon_port))
+            server = self._create_server()
         except OSError as err:
             if "Address already in use" in str(err):
                 self._kill_existing_daemon()
                 time.sleep(2)
-                server = SimpleXMLRPCServer((self._daemon_host, self._daemon_port))
+                server = self._create_server()
 
         self._write_pid_file()
+        self._write_baseline_file()
 
         # register the 'run_pytest' function
         server.register_function(self.run_pytest, "run_pytest")  # type: ignore
         server.register_function(self.stop, "stop")
+        server.register_function(self._contexts.cache_stats, "cache_stats")
+        server.register_function(fixture_graph, "fixture_graph")
+        server.register_function(polling_stats, "polling_stats")
 
         self._server = server
-        server.serve_forever()
+        # clients that connect during the warm-up wait in the listen backlog,
+        # so their runs use the warmed up cache instead of collecting again
+        self._warm_up(on_phase)
+        if on_ready:
+            on_ready()
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            self._serve_runs()
+        finally:
+            self._runs.close()
+            server.shutdown()
+            server.server_close()
+
+    def _serve_runs(self) -> None:
+        """
+        Run the queued requests until the daemon is stopped
+        """
+        while (batch := self._runs.next_batch()) is not None:
+            try:
+                self._run_batch(batch)
+            finally:
+                self._runs.batch_done(batch)
+
+    def _run_batch(self, batch: RunBatch) -> None:
+        if len(batch.requests) > 1:
+            print(f"Pytest Daemon: Running {len(batch.requests)} requests in one session")
+        plugins = batch.plugins
+        stdout: io.TextIOBase
+        stderr: io.TextIOBase
+        if batch.streaming:
+            stdout = StreamingOutput("stdout", batch.send_output, echo=sys.stdout)
+            stderr = StreamingOutput("stderr", batch.send_output, echo=sys.stderr)
+            plugins.append(ProgressReporter(batch.send_progress))
+        else:
+            stdout = io.StringIO()
+            stderr = io.StringIO()
+        if self._fork_per_run:
+            # the fork has its own copy of the batch, joining it is only possible until then
+            batch.stop_joining()
+
+        try:
+            status_code = self._run_pytest(
+                batch.cwd,
+                batch.env,
+                batch.sys_path,
+                batch.args,
+                stdout,
+                stderr,
+                plugins=plugins,
+                cancellation=batch.cancellation,
+            )
+        except Exception:
+            batch.fail(traceback.format_exc())
+            return
+        finally:
+            if isinstance(stdout, io.StringIO) and isinstance(stderr, io.StringIO):
+                print(stdout.getvalue(), file=sys.stdout)
+                print(stderr.getvalue(), file=sys.stderr)
+        batch.finish(
+            status_code,
+            _remove_ansi_escape(stdout.getvalue()) if isinstance(stdout, io.StringIO) else "",
+            _remove_ansi_escape(stderr.getvalue()) if isinstance(stderr, io.StringIO) else "",
+        )
+
+    def _warm_up(self, on_phase: Callable[[str], None] | None = None) -> None:
+        """
+        Collect the tests for each of the warm-up argument sets, so the first runs
+        use the cached collection. This runs in the daemon itself, even when running
+        each test run in a fork, so that the forks start out with the cache filled.
+        """
+        for args in self._warmup:
+            description = " ".join(args) or "testpaths"
+            print(f"Pytest Daemon: Warming up {description}")
+            if on_phase:
+                # importing the tests is most of the startup of a large project
+                on_phase(f"warming up {description}")
+            output = io.StringIO()
+            start = time.time()
+            self._apply_invalidation()
+            try:
+                status_code = self._run_pytest_in_process(
+                    os.getcwd(),
+                    self._baseline_env,
+                    self._baseline_sys_path,
+                    ["--collect-only", "-q", *args],
+                    output,
+                    output,
+                )
+            except Exception:
+                print(f"Pytest Daemon: Warm-up of {description} failed\n{traceback.format_exc()}")
+                continue
+            if status_code not in (pytest.ExitCode.OK, pytest.ExitCode.NO_TESTS_COLLECTED):
+                print(f"Pytest Daemon: Warm-up of {description} failed\n{output.getvalue()}")
+                continue
+            print(
+                f"Pytest Daemon: Warmed up {description} in {(time.time() - start):0.3f} seconds"
+            )
+
+    def _create_server(self) -> DaemonServer:
+        server: DaemonServer
+        if self._socket_path:
+            self._remove_stale_socket()
+            server = UnixStreamDaemonServer(
+                self._socket_path,  # type: ignore
+                requestHandler=StreamingRequestHandler,
+                logRequests=False,
+            )
+        else:
+            server = DaemonServer(
+                (self._daemon_host, self._daemon_port), requestHandler=StreamingRequestHandler
+            )
+        # gives the request handlers a way back to the daemon
+        server.pytest_daemon = self
+        return server
+
+    def _remove_stale_socket(self) -> None:
+        """
+        A daemon that didn't shut down cleanly leaves its socket file behind,
+        which would otherwise block binding.
+        """
+        assert self._socket_path
+        if not os.path.exists(self._socket_path):
+            return
+        try:
+            connect(self._daemon_host, self._daemon_port, self._socket_path).close()
+        except ConnectionRefusedError:
+            os.unlink(self._socket_path)
 
     def _write_pid_file(self) -> None:
         with open(self.pid_file, "w") as f:
@@ -130,102 +534,350 @@ class PytestDaemon:
         if os.path.exists(self.pid_file):
             os.unlink(self.pid_file)
 
+    def _write_baseline_file(self) -> None:
+        write_baseline(self.baseline_file, self._baseline_env, self._baseline_sys_path)
+
+    def _delete_baseline_file(self) -> None:
+        if os.path.exists(self.baseline_file):
+            os.unlink(self.baseline_file)
+
     def _kill_existing_daemon(self) -> None:
         try:
             with open(self.pid_file, "r") as f:
                 pid = int(f.read())
             os.kill(pid, 9)
         except FileNotFoundError:
+            if self._socket_path:
+                raise Exception(f"Socket {self._socket_path} is already in use")
             raise Exception(f"Port {self._daemon_port} is already in use")
 
     def run_pytest(self, cwd: str, env_json: str, sys_path: list[str], args: list[str]) -> dict:
-        try:
-            # run pytest using command line args
-            # run the pytest main logic
-            in_progress_workarounds = self._workaround_library_issues_pre()
+        # capture stdout and stderr
+        # and return the output
+        request = RunRequest(cwd, json.loads(env_json), sys_path, args)
+        connection = self._server.current_request if self._server else None  # type: ignore
+        status_code = self._runs.run(request, connection, framed=False)
+        return {
+            "stdout": request.stdout.encode("utf-8"),
+            "stderr": request.stderr.encode("utf-8"),
+            "status_code": status_code,
+        }
 
-            import pytest_hot_reloading.plugin as plugin
+    def run_pytest_streaming(
+        self,
+        cwd: str,
+        env: dict[str, str],
+        sys_path: list[str],
+        args: list[str],
+        send_output: Callable[[str, str], None],
+        send_progress: Callable[[dict], None],
+        connection: socket.socket | None = None,
+        framed: bool = True,
+    ) -> int:
+        """
+        Run pytest, sending output and progress as it happens
+        instead of returning everything at the end.
+        """
+        request = RunRequest(cwd, env, sys_path, args, send_output, send_progress)
+        return self._runs.run(request, connection, framed)
 
-            # indicate to the plugin to NOT run custom pytest collect logic
-            plugin.i_am_server = True
+    def handle_framed_connection(self, sock: socket.socket) -> None:
+        """
+        Serve a framed protocol connection until the client hangs up
+        """
+        if sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client_gone = False
+        challenge = new_challenge() if self._secret else None
+        authenticated = not self._secret
 
-            # capture stdout and stderr
-            # and return the output
-            import io
+        def send(message_type: MessageType, payload: bytes) -> None:
+            # if the client went away, the run is cancelled and there's nobody left
+            # to show the output to
+            nonlocal client_gone
+            if client_gone:
+                return
+            try:
+                send_message(sock, message_type, payload)
+            except OSError:
+                client_gone = True
 
-            stdout = io.StringIO()
-            stderr = io.StringIO()
+        def send_output(stream: str, data: str) -> None:
+            message_type = MessageType.STDOUT if stream == "stdout" else MessageType.STDERR
+            send(message_type, data.encode("utf-8"))
 
-            # backup originals
-            stdout_bak = sys.stdout
-            stderr_bak = sys.stderr
+        def send_progress(progress: dict) -> None:
+            send(MessageType.PROGRESS, json.dumps(progress).encode("utf-8"))
 
-            sys.stdout = stdout
-            sys.stderr = stderr
+        while not client_gone:
+            try:
+                message_type, payload = recv_message(sock)
+            except ConnectionClosedError:
+                return
+            except ProtocolError as err:
+                send_json(sock, MessageType.ERROR, {"error": str(err)})
+                return
 
-            if self._signaler.receive_clear_cache_signal():
-                session_item_cache.clear()
+            if message_type == MessageType.HELLO:
+                # the build of the interpreter doesn't matter, such as when the client runs
+                # on the host and the daemon in a container
+                python = tuple(json.loads(payload).get("python_version", sys.version_info[:2]))
+                if python != sys.version_info[:2]:
+                    # one process can only host one interpreter
+                    send_json(
+                        sock,
+                        MessageType.ERROR,
+                        {
+                            "error": f"The daemon runs Python {_major_minor(sys.version_info[:2])} "
+                            f"but the client runs Python {_major_minor(python)}. Use a separate "
+                            "daemon for this interpreter with --daemon-port or "
+                            "--daemon-unix-socket."
+                        },
+                    )
+                    return
+                send_json(
+                    sock,
+                    MessageType.HELLO,
+                    {"version": VERSION, "pid": os.getpid(), "challenge": challenge},
+                )
+            elif message_type == MessageType.AUTH:
+                signature = json.loads(payload)["signature"]
+                if self._secret and challenge and not verify(self._secret, challenge, signature):
+                    send_json(sock, MessageType.ERROR, {"error": "Wrong daemon secret"})
+                    return
+                authenticated = True
+            elif not authenticated:
+                send_json(sock, MessageType.ERROR, {"error": "The daemon requires a secret"})
+                return
+            elif message_type == MessageType.RUN:
+                request = json.loads(payload)
+                if request["env_base"] not in (None, self._baseline_fingerprint):
+                    send_json(
+                        sock,
+                        MessageType.ERROR,
+                        {"error": "Environment baseline has changed", "code": BASELINE_MISMATCH},
+                    )
+                    continue
+                env, sys_path = self._resolve_environment(request)
+                status_code = self.run_pytest_streaming(
+                    request["cwd"],
+                    env,
+                    sys_path,
+                    request["args"],
+                    send_output,
+                    send_progress,
+                    connection=sock,
+                )
+                send(MessageType.RESULT, json.dumps({"status_code": status_code}).encode())
+            elif message_type == MessageType.STOP:
+                send(MessageType.RESULT, json.dumps(self.stop()).encode("utf-8"))
+                return
+            elif message_type == MessageType.CANCEL:
+                # the run finished before the cancel arrived, the client doesn't expect a reply
+                continue
+            else:
+                send_json(
+                    sock, MessageType.ERROR, {"error": f"Unexpected {message_type.name} message"}
+                )
 
-            import _pytest.main
+    def _resolve_environment(self, request: dict) -> tuple[dict[str, str], list[str]]:
+        """
+        The client's full environment and sys.path from the changes it sent.
 
-            # monkeypatch in the main that does test collection caching
-            orig_main = _pytest.main._main
-            _pytest.main._main = _pytest_main
+        Without a baseline, the client sent its whole environment. Remote clients
+        only send the paths of the project, which go in front of the daemon's own.
+        """
+        if request["env_set"] is None:
+            # a remote client, the daemon keeps its own environment
+            env = self._baseline_env
+        elif request["env_base"] is None:
+            env = request["env_set"]
+        else:
+            env = {**self._baseline_env, **request["env_set"]}
+            for key in request["env_unset"]:
+                env.pop(key, None)
+        sys_path = request["sys_path"]
+        if sys_path is None:
+            sys_path = self._baseline_sys_path
+        extra = [path for path in request.get("sys_path_extra", []) if path not in sys_path]
+        return env, extra + sys_path
 
-            # switch to client working directory
-            # do NOT store and restore previous because it might disappear and create errors
-            os.chdir(cwd)
+    def _run_pytest(
+        self,
+        cwd: str,
+        env: dict[str, str],
+        sys_path: list[str],
+        args: list[str],
+        stdout: io.TextIOBase,
+        stderr: io.TextIOBase,
+        plugins: list[object] | None = None,
+        cancellation: RunCancellation | None = None,
+    ) -> int:
+        """
+        Run pytest. The run is interrupted when it's cancelled, the same as with Ctrl-C,
+        and the session is torn down as usual.
+        """
+        cancellation = cancellation or RunCancellation()
+        # in the daemon, a fork only has a copy of the signaler that nothing signals
+        self._apply_invalidation()
+        try:
+            with cancellation:
+                if self._fork_per_run:
+                    return self._run_pytest_in_fork(
+                        cwd, env, sys_path, args, stdout, stderr, plugins, cancellation
+                    )
+                return self._run_pytest_in_process(
+                    cwd, env, sys_path, args, stdout, stderr, plugins
+                )
+        except KeyboardInterrupt:
+            if not cancellation.cancelled:
+                raise
+            # interrupted outside of the pytest session
+            return pytest.ExitCode.INTERRUPTED
+        finally:
+            if cancellation.cancelled:
+                print("Pytest Daemon: Run cancelled by the client")
 
-            # copy the environment
-            env_old = os.environ.copy()
-            # switch to client environment
-            new_env = json.loads(env_json)
-            os.environ.update(new_env)
+    def _apply_invalidation(self) -> None:
+        """
+        Wait for the changed files to be reloaded and drop what they invalidate
+        from the caches
+        """
+        invalidation = self._signaler.receive_invalidation()
+        if invalidation is not None:
+            self._contexts.invalidate(invalidation)
 
-            # copy sys.path
-            sys_path_old = sys.path
-            # switch to client path
-            sys.path = sys_path
+    def _run_pytest_in_fork(
+        self,
+        cwd: str,
+        env: dict[str, str],
+        sys_path: list[str],
+        args: list[str],
+        stdout: io.TextIOBase,
+        stderr: io.TextIOBase,
+        plugins: list[object] | None = None,
+        cancellation: RunCancellation | None = None,
+    ) -> int:
+        """
+        Run pytest in a forked copy of the daemon that exits when the run is done.
 
+        The daemon itself never runs any tests, so it stays as it was when it started,
+        apart from the reloads applied by jurigged. Streamed output is written by the fork
+        directly, while captured output is sent back when the run is done.
+        """
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            # cancelling interrupts the fork, even if the daemon was started with SIGINT ignored
+            signal.signal(signal.SIGINT, signal.default_int_handler)
             try:
-                # args must omit the calling program
-                status_code = pytest.main(["--color=yes"] + args)
-            finally:
-                self._workaround_library_issues_post(in_progress_workarounds)
+                status_code = self._run_pytest_in_process(
+                    cwd, env, sys_path, args, stdout, stderr, plugins
+                )
+                result: dict = {
+                    "status_code": status_code,
+                    "stdout": stdout.getvalue() if isinstance(stdout, io.StringIO) else None,
+                    "stderr": stderr.getvalue() if isinstance(stderr, io.StringIO) else None,
+                    # plugins that the daemon reads from after the run
+                    "plugin_states": [
+                        plugin.fork_state() if hasattr(plugin, "fork_state") else None
+                        for plugin in plugins or []
+                    ],
+                }
+            except BaseException:
+                result = {"error": traceback.format_exc()}
+            with open(write_fd, "w") as f:
+                json.dump(result, f)
+            # skip the daemon's cleanup, it belongs to the parent
+            os._exit(0)
+
+        if cancellation:
+            # the fork is interrupted instead of the daemon
+            cancellation.set_run_pid(pid)
+        os.close(write_fd)
+        try:
+            with open(read_fd) as f:
+                data = f.read()
+        finally:
+            if cancellation:
+                cancellation.set_run_pid(None)
+            os.waitpid(pid, 0)
+        if not data:
+            raise Exception("The forked test run exited unexpectedly")
+        result = json.loads(data)
+        if "error" in result:
+            raise Exception(f"The forked test run failed\n{result['error']}")
+        for plugin, state in zip(plugins or [], result["plugin_states"]):
+            if state is not None:
+                plugin.restore_fork_state(state)  # type: ignore
+        if result["stdout"] is not None:
+            stdout.write(result["stdout"])
+        if result["stderr"] is not None:
+            stderr.write(result["stderr"])
+        return result["status_code"]
 
-                # restore sys.path
-                sys.path = sys_path_old
+    def _run_pytest_in_process(
+        self,
+        cwd: str,
+        env: dict[str, str],
+        sys_path: list[str],
+        args: list[str],
+        stdout: io.TextIOBase,
+        stderr: io.TextIOBase,
+        plugins: list[object] | None = None,
+    ) -> int:
+        # run pytest using command line args
+        # run the pytest main logic
+        in_progress_workarounds = self._workaround_library_issues_pre()
 
-                # restore environment
-                os.environ.update(env_old)
+        import pytest_hot_reloading.plugin as plugin
 
-                # restore originals
-                _pytest.main._main = orig_main
+        # indicate to the plugin to NOT run custom pytest collect logic
+        plugin.i_am_server = True
 
-                sys.stdout = stdout_bak
-                sys.stderr = stderr_bak
+        # backup originals
+        stdout_bak = sys.stdout
+        stderr_bak = sys.stderr
 
-                stdout.seek(0)
-                stderr.seek(0)
-                stdout_str = stdout.read()
-                stderr_str = stderr.read()
+        sys.stdout = cast(TextIO, stdout)
+        sys.stderr = cast(TextIO, stderr)
 
-                print(stdout_str, file=sys.stdout)
-                print(stderr_str, file=sys.stderr)
-            return {
-                "stdout": self._remove_ansi_escape(stdout_str).encode("utf-8"),
-                "stderr": self._remove_ansi_escape(stderr_str).encode("utf-8"),
-                "status_code": int(status_code),
-            }
-        except Exception:
-            return {
-                "stdout": b"",
-                "stderr": traceback.format_exc().encode("utf-8"),
-                "status_code": -1,
-            }
+        import _pytest.main
+
+        # monkeypatch in the main that does test collection caching
+        orig_main = _pytest.main._main
+
+        def daemon_main(config: pytest.Config, session: pytest.Session):
+            # only the daemon's own session is cached. Tests that run pytest themselves,
+            # such as with pytester, get pytest's own main
+            _pytest.main._main = orig_main
+            return _pytest_main(config, session, self._contexts)
+
+        _pytest.main._main = daemon_main
+
+        # switch to client working directory
+        # do NOT store and restore previous because it might disappear and create errors
+        os.chdir(cwd)
+
+        try:
+            # switch to the client environment and sys.path, restoring them afterwards
+            with client_environment(env, sys_path):
+                try:
+                    # args must omit the calling program
+                    status_code = pytest.main(
+                        ["--color=yes"] + args,
+                        plugins=[*(plugins or []), ForkedWorkers(plugins or [])],
+                    )
+                finally:
+                    self._workaround_library_issues_post(in_progress_workarounds)
+        finally:
+            # restore originals
+            _pytest.main._main = orig_main
 
-    def _remove_ansi_escape(self, s: str) -> str:
-        return re.sub(r"\x1b(\[.*?[@-~]|\].*?(\x07|\x1b\\))", "", s, flags=re.MULTILINE)
+            sys.stdout = stdout_bak
+            sys.stderr = stderr_bak
+        return int(status_code)
 
     def _workaround_library_issues_pre(self) -> list[Generator]:
         return run_workarounds_pre()
@@ -234,72 +886,118 @@ class PytestDaemon:
         run_workarounds_post(in_progress_workarounds)
 
 
-session_item_cache: TTLCache[tuple, tuple] = TTLCache(16, 500)
-# hack: keeping a session cache since pytest has session references
-#       littered everywhere on objects
-prior_sessions: set[pytest.Session] = set()
+def fixture_graph() -> dict[str, list[str]]:
+    """
+    The fixtures each fixture of the watched files requests
+    """
+    import pytest_hot_reloading.plugin as plugin
+
+    return plugin.fixture_graph.as_dict()
+
 
+def polling_stats() -> dict:
+    """
+    The measured sweep time and detection latency of polling, empty when OS events
+    are used
+    """
+    import pytest_hot_reloading.plugin as plugin
+
+    if plugin.file_watcher is None or not plugin.file_watcher.polling:
+        return {}
+    return plugin.file_watcher.observer.stats()  # type: ignore
 
-def _manage_prior_session_garbage(session: pytest.Session) -> None:
+
+def _manage_prior_session_garbage(context: RunContext, session: pytest.Session) -> None:
     """
     Pytest creates a bunch of objects and nodes and assigns the session
     to them. This creates a lot of dangling references to sessions that
     can come up later due to reuse. To work around this, all prior
     sessions have their dicts updated to point to the latest session.
 
-    To avoid accumulating too many sessions and taking up memory as well
-    as runtime, this cleans out all the sessions that appear to be redundant.
-
-    This isn't quite perfect but should maybe be enough. There's likely some
-    corner cases where the session with the fewest references doesn't meet the
-    count requirement. There may also be cases where the smallest session
-    has something important on it and we don't want to clean it up, but it
-    gets cleaned up anyways.
+    The prior sessions are only weakly referenced. Once nothing else refers
+    to a session, such as the cached items of an evicted collection, the
+    garbage collector frees it with everything it holds.
 
     The use case that drew attention to this problem was an autouse session
     fixture. The fixture's request object was referencing the session that
     used the fixture, which at some point in the flow creates a problem
     because that old session is not properly set up anymore.
+
+    Sessions are only tracked per context, a session is never pointed at
+    the session of another project.
     """
-    ref_counts = {
-        prior_session: sys.getrefcount(prior_session) for prior_session in prior_sessions
-    }
-    counts = Counter(ref_counts.values())
-    min_count = min(counts.keys()) if ref_counts else 0
-
-    for prior_session in list(prior_sessions):
-        if (
-            len(prior_sessions) > 5
-            and counts[min_count] > 3
-            and ref_counts[prior_session] <= min_count
-        ):
-            prior_sessions.remove(prior_session)
-        else:
-            prior_session.__dict__ = session.__dict__
+    for prior_session in list(context.prior_sessions):
+        prior_session.__dict__ = session.__dict__
+
 
+def _recollection_args(config: pytest.Config, stale_paths: set[str]) -> list[str]:
+    """
+    The arguments that collect the changed modules again. Arguments that select
+    tests within a changed module are kept, so the same tests are collected.
+    """
+    invocation_dir = config.invocation_params.dir
+    args: list[str] = []
+    for path in sorted(stale_paths):
+        narrowed = [
+            arg
+            for arg in config.args
+            if os.path.abspath(os.path.join(invocation_dir, arg.split("::")[0])) == path
+        ]
+        args += narrowed or [path]
+    return args
 
-# performance improvements
-# when doing a best_effort_copy, do not copy these attributes
-no_copy = {
-    "_arg2fixturedefs",
-    "_fixtureinfo",
-    "keywords",
-    "_fixturemanager",
-    "_pyfuncitem",
-}
 
-# when doing a best_effort_copy, do not deep copy this
-# instead, force a best effort up to a given depth
-use_best_effort_copy = {
-    "_request",
-}
+def _collection_position(items: Sequence[pytest.Item], path: str) -> int:
+    """
+    Where the items of the module go among the items collected from a directory
+    """
+    order = _collection_order(path)
+    for position, item in enumerate(items):
+        if _collection_order(str(item.path)) > order:
+            return position
+    return len(items)
+
+
+def _collection_order(path: str) -> tuple:
+    *directories, name = Path(path).parts
+    if pytest.version_tuple >= (8,):
+        # the files and subdirectories of a directory are collected by name
+        return (*directories, name)
+    # pytest 7 collects the files of a directory before its subdirectories
+    return (*((1, directory) for directory in directories), (0, name))
+
+
+def _refresh_fixture_closures(cached: CachedCollection) -> None:
+    """
+    Compute the fixture closures of the cached tests that use fixtures which request
+    other fixtures now. The modules of the tests that can't be updated are collected
+    again instead.
+    """
+    changed = cached.stale_closures
+    refreshed = 0
+    for item in cached.items:
+        path = str(item.path)
+        if path in cached.stale_paths or changed.isdisjoint(fixture_closure(item)):
+            continue
+        if refresh_fixture_closure(item, changed):
+            refreshed += 1
+        else:
+            cached.stale_paths.add(path)
+    changed.clear()
+    print(f"Pytest Daemon: Computed the fixture closures of {refreshed} test(s) again")
 
 
-def _pytest_main(config: pytest.Config, session: pytest.Session):
+def _pytest_main(config: pytest.Config, session: pytest.Session, contexts: ContextRegistry):
     """
     A monkey patched version of _pytest._main that caches test collection
     """
-    _manage_prior_session_garbage(session)
+    import pytest_hot_reloading.plugin as plugin
+
+    context = contexts.get(
+        context_key(str(config.rootpath), sys.path),
+        on_new=lambda _: plugin.watch_project(config),
+    )
+    _manage_prior_session_garbage(context, session)
 
     import _pytest.capture
 
@@ -314,70 +1012,139 @@ def _pytest_main(config: pytest.Config, session: pytest.Session):
 
     _pytest.capture.CaptureManager.resume_global_capture = start_global_capture_if_needed  # type: ignore
 
-    def best_effort_copy(item, depth_remaining=2, force_best_effort=False):
-        """
-        Copy test items. The items have references to modules and
-        other things that cannot be deep copied.
-        """
-        if depth_remaining <= 0:
-            return item
-        try:
-            item_copy = copy.copy(item)
-        except TypeError:
-            return item
-        # NodeKeywords is an example of an object without a __dict__
-        if hasattr(item, "__dict__"):
-            for k, v in item.__dict__.items():
-                # performance-tweaks
-                if k in no_copy:
-                    item_copy.__dict__[k] = v
-                    continue
-                if k in use_best_effort_copy:
-                    item_copy.__dict__[k] = best_effort_copy(v, 2, force_best_effort=True)
-                    continue
-                if force_best_effort:
-                    item_copy.__dict__[k] = best_effort_copy(
-                        v, depth_remaining - 1, force_best_effort=True
-                    )
-                    continue
-
-                try:
-                    item_copy.__dict__[k] = copy.deepcopy(v)
-                except KeyboardInterrupt:
-                    raise
-                except TypeError:
-                    # Non-pickelable objects
-                    item_copy.__dict__[k] = best_effort_copy(v, depth_remaining - 1)
-        return item_copy
-
     num_tests_collected: int
 
     # here config.args becomes basically the tests to run. Other arguments are omitted
     # not 100% sure this is always the case
     session_key = tuple(config.args)
-    try:
-        items = session_item_cache[session_key]
-    except KeyError:
+    session_item_cache = context.session_item_cache
+    evictions = session_item_cache.evictions
+    cached = session_item_cache.get(session_key)
+    selections = [
+        absolute_selection(str(config.invocation_params.dir), arg) for arg in config.args
+    ]
+    # the options decide which of the collected tests are deselected
+    options = [arg for arg in config.invocation_params.args if arg not in config.args]
+    narrowed = None
+    reusable = not (config.option.pyargs or config.option.keepduplicates)
+    if cached is None and reusable:
+        narrowed = context.select_cached(selections, options)
+    if narrowed is not None:
+        print("Pytest Daemon: Using cached collection of a broader selection")
+        with gc_paused():
+            session.items = [clone_item(x, config, session) for x in narrowed]
+        num_tests_collected = session.testscollected = len(narrowed)
+        session.config = config
+    elif cached is None:
         # not in the cache, do test collection
         start = time.time()
-        config.hook.pytest_collection(session=session)
-        print(f"Pytest Daemon: Collection took {(time.time() - start):0.3f} seconds")
-        session_item_cache[session_key] = tuple(best_effort_copy(x) for x in session.items)
+        index = CollectionIndex(config, context.key.sys_path)
+        indexed_modules = None if config.option.pyargs else index.modules(selections, options)
+        recorder = CollectionRecorder()
+        # selections of tests within a module are matched against its classes
+        module_reuse = None
+        if reusable and not any("::" in arg for arg in config.args):
+            module_reuse = ModuleReuse(context.module_cache, config, session)
+        collection_plugins: list[object] = [recorder]
+        if module_reuse is not None:
+            collection_plugins.append(module_reuse)
+        for collection_plugin in collection_plugins:
+            config.pluginmanager.register(collection_plugin)
+        try:
+            if indexed_modules is not None:
+                # skips walking the tree, nothing in it changed since the index was written
+                config.args = indexed_modules
+            config.hook.pytest_collection(session=session)
+        finally:
+            config.args = list(session_key)
+            for collection_plugin in collection_plugins:
+                config.pluginmanager.unregister(collection_plugin)
+        if indexed_modules is not None:
+            print(
+                f"Pytest Daemon: Collected {len(indexed_modules)} module(s) from the index "
+                f"in {(time.time() - start):0.3f} seconds"
+            )
+        else:
+            print(f"Pytest Daemon: Collection took {(time.time() - start):0.3f} seconds")
+            if not session.testsfailed:
+                index.record(selections, options, recorder)
+        if module_reuse is not None and module_reuse.reused:
+            print(
+                f"Pytest Daemon: Reused the items of {len(module_reuse.reused)} "
+                "unchanged module(s)"
+            )
+        # the deselected items are cached per module too
+        collected = module_reuse.collected if module_reuse is not None else []
+        template_of: dict[int, pytest.Item] = {}
+        with gc_paused():
+            for x in [*collected, *session.items]:
+                if id(x) not in template_of:
+                    template_of[id(x)] = clone_item(x)
+            templates = tuple(template_of[id(x)] for x in session.items)
+        if module_reuse is not None:
+            module_reuse.store(template_of)
+        session_item_cache[session_key] = CachedCollection(templates, selections, options)
         num_tests_collected = session.testscollected
     else:
-        print("Pytest Daemon: Using cached collection")
+        stale_paths = cached.stale_paths
+        if cached.stale_closures:
+            _refresh_fixture_closures(cached)
+        recollected: dict[str, list[pytest.Item]] = {}
+        if stale_paths:
+            # only the modules that changed are collected again
+            start = time.time()
+            session.perform_collect(_recollection_args(config, stale_paths))
+            for item in session.items:
+                recollected.setdefault(str(item.path), []).append(item)
+            print(
+                f"Pytest Daemon: Collected {len(stale_paths)} changed module(s) again "
+                f"in {(time.time() - start):0.3f} seconds"
+            )
+        else:
+            print("Pytest Daemon: Using cached collection")
         # Assign the prior test items (tests to run) and config to the current session
-        session.items = tuple(best_effort_copy(x) for x in items)  # type: ignore
-        num_tests_collected = len(items)
+        items: list[pytest.Item] = []
+        cached_items: list[pytest.Item] = []
+        with gc_paused():
+            for cached_item in cached.items:
+                path = str(cached_item.path)
+                if path in stale_paths:
+                    # the items of a changed module take the place of its old items
+                    module_items = recollected.pop(path, [])
+                    items += module_items
+                    cached_items += [clone_item(x) for x in module_items]
+                    continue
+                items.append(clone_item(cached_item, config, session))
+                cached_items.append(cached_item)
+            for path, module_items in recollected.items():
+                # where collecting the selection would put the module, not at the end
+                position = _collection_position(items, path)
+                items[position:position] = module_items
+                cached_items[position:position] = [clone_item(x) for x in module_items]
+        if stale_paths and not session.testsfailed:
+            # a module that failed to collect is tried again on the next run
+            cached.items = tuple(cached_items)
+            stale_paths.clear()
+            # estimates its size again
+            session_item_cache[session_key] = cached
+        session.items = items
+        # the terminal reporter shows the progress out of this
+        num_tests_collected = session.testscollected = len(items)
         session.config = config
-        for i in session.items:
-            # Items have references to the config and the session
-            i.config = config
-            i.session = session
-            if i._request:  # type: ignore
-                i._request._pyfuncitem = i  # type: ignore
-    config.hook.pytest_runtestloop(session=session)
-    prior_sessions.add(session)
+    try:
+        config.hook.pytest_runtestloop(session=session)
+    finally:
+        # the cached items point at this session, even if the run was interrupted
+        context.prior_sessions.add(session)
+    if session_item_cache.evictions > evictions:
+        print(
+            f"Pytest Daemon: Evicted {session_item_cache.evictions - evictions} cached "
+            "collection(s) to stay within the cache budget"
+        )
+    for evicted in contexts.evict_idle(keep=context):
+        print(f"Pytest Daemon: Evicted idle project {evicted.rootdir} to stay within budget")
+        if not contexts.serves(evicted.rootdir):
+            plugin.unwatch_project(evicted.rootdir)
 
     if session.testsfailed:
         return pytest.ExitCode.TESTS_FAILED
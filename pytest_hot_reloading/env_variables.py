@@ -0,0 +1,31 @@
+"""
+The environment variables that configure the plugin. Kept apart from the plugin
+so that the fast client can read them without importing it.
+"""
+
+from enum import Enum
+
+
+class EnvVariables(str, Enum):
+    PYTEST_DAEMON_PORT = "PYTEST_DAEMON_PORT"
+    PYTEST_DAEMON_PYTEST_NAME = "PYTEST_DAEMON_PYTEST_NAME"
+    PYTEST_DAEMON_TIMEOUT = "PYTEST_DAEMON_TIMEOUT"
+    PYTEST_DAEMON_WATCH_GLOBS = "PYTEST_DAEMON_WATCH_GLOBS"
+    PYTEST_DAEMON_IGNORE_WATCH_GLOBS = "PYTEST_DAEMON_IGNORE_WATCH_GLOBS"
+    PYTEST_DAEMON_START_IF_NEEDED = "PYTEST_DAEMON_START_IF_NEEDED"
+    PYTEST_DAEMON_DISABLE = "PYTEST_DAEMON_DISABLE"
+    PYTEST_DAEMON_DO_NOT_AUTOWATCH_FIXTURES = "PYTEST_DAEMON_DO_NOT_AUTOWATCH_FIXTURES"
+    PYTEST_DAEMON_USE_OS_EVENTS = "PYTEST_DAEMON_USE_OS_EVENTS"
+    PYTEST_DAEMON_POLL_THROTTLE = "PYTEST_DAEMON_POLL_THROTTLE"
+    PYTEST_DAEMON_STREAM_OUTPUT = "PYTEST_DAEMON_STREAM_OUTPUT"
+    PYTEST_DAEMON_UNIX_SOCKET = "PYTEST_DAEMON_UNIX_SOCKET"
+    PYTEST_DAEMON_PROTOCOL = "PYTEST_DAEMON_PROTOCOL"
+    PYTEST_DAEMON_WORKERS = "PYTEST_DAEMON_WORKERS"
+    PYTEST_DAEMON_FORK_PER_RUN = "PYTEST_DAEMON_FORK_PER_RUN"
+    PYTEST_DAEMON_MEMORY_BUDGET = "PYTEST_DAEMON_MEMORY_BUDGET"
+    PYTEST_DAEMON_CACHE_BUDGET = "PYTEST_DAEMON_CACHE_BUDGET"
+    PYTEST_DAEMON_CACHE_TTL = "PYTEST_DAEMON_CACHE_TTL"
+    PYTEST_DAEMON_HOST = "PYTEST_DAEMON_HOST"
+    PYTEST_DAEMON_SECRET = "PYTEST_DAEMON_SECRET"
+    PYTEST_DAEMON_PATH_MAP = "PYTEST_DAEMON_PATH_MAP"
+    PYTEST_DAEMON_WARMUP = "PYTEST_DAEMON_WARMUP"
@@ -0,0 +1,84 @@
+"""
+Environment and sys.path handling for runs in the daemon.
+
+The daemon publishes the environment it started with as a baseline. Clients send
+only what differs from the baseline, and the daemon puts its own environment back
+exactly as it was once the run is done.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Mapping, Sequence
+
+
+def baseline_path(port: int, socket_path: str | None = None) -> Path:
+    """
+    Where the daemon listening on the port or socket publishes its baseline
+    """
+    if socket_path:
+        return Path(f"{socket_path}.baseline.json")
+    return Path(tempfile.gettempdir()) / f".pytest_hot_reloading_{port}.baseline.json"
+
+
+def fingerprint(env: Mapping[str, str], sys_path: Sequence[str]) -> str:
+    data = json.dumps([sorted(env.items()), list(sys_path)])
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def diff_env(
+    base: Mapping[str, str], target: Mapping[str, str]
+) -> tuple[dict[str, str], list[str]]:
+    """
+    The variables to set and the variables to remove to turn base into target
+    """
+    env_set = {key: value for key, value in target.items() if base.get(key) != value}
+    env_unset = [key for key in base if key not in target]
+    return env_set, env_unset
+
+
+def write_baseline(path: Path, env: Mapping[str, str], sys_path: Sequence[str]) -> None:
+    # the environment may hold secrets, so only the current user may read it
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "w") as f:
+        json.dump(
+            {"fingerprint": fingerprint(env, sys_path), "env": dict(env), "sys_path": sys_path}, f
+        )
+
+
+def read_baseline(path: Path) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def client_environment(env: Mapping[str, str], sys_path: Sequence[str]) -> Iterator[None]:
+    """
+    Switch os.environ and sys.path over to the client's for the duration of a run.
+
+    Afterwards both are restored exactly, which includes removing any variables
+    added by the client or by the tests.
+    """
+    env_old = os.environ.copy()
+    sys_path_old = sys.path
+    _set_environ(env)
+    sys.path = list(sys_path)
+    try:
+        yield
+    finally:
+        sys.path = sys_path_old
+        _set_environ(env_old)
+
+
+def _set_environ(env: Mapping[str, str]) -> None:
+    env_set, env_unset = diff_env(os.environ, env)
+    for key in env_unset:
+        del os.environ[key]
+    os.environ.update(env_set)
@@ -0,0 +1,131 @@
+"""
+A client that runs the tests on the daemon without loading pytest first.
+
+Going through pytest means importing it, loading the plugins and conftests and
+parsing the configuration, only to forward the arguments to the daemon. This
+client skips all of that. It reads the daemon options from the command line and
+the environment variables, not from the pytest configuration files, and hands
+over to pytest when the daemon isn't running or the options need pytest.
+
+Usage: python -m pytest_hot_reloading.fast_client [pytest args]
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+from typing import Sequence
+
+from pytest_hot_reloading.client import PytestClient
+from pytest_hot_reloading.env_variables import EnvVariables
+from pytest_hot_reloading.remote import PathMap
+from pytest_hot_reloading.transport import unix_socket_path
+
+# these need pytest itself
+PYTEST_ONLY_ARGS = {"--daemon", "--daemon-disable", "-h", "--help", "-V", "--version"}
+
+
+def _env_flag(name: EnvVariables) -> bool:
+    return os.getenv(name, "False").lower() in ("true", "1")
+
+
+def _parse_args(args: Sequence[str]) -> argparse.Namespace:
+    """
+    Parse the daemon options the client needs, the rest is left to the daemon
+    """
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    parser.add_argument(
+        "--daemon-port", type=int, default=int(os.getenv(EnvVariables.PYTEST_DAEMON_PORT, "4852"))
+    )
+    parser.add_argument(
+        "--daemon-host", default=os.getenv(EnvVariables.PYTEST_DAEMON_HOST, "localhost")
+    )
+    parser.add_argument(
+        "--daemon-unix-socket",
+        action="store_true",
+        default=_env_flag(EnvVariables.PYTEST_DAEMON_UNIX_SOCKET),
+    )
+    parser.add_argument(
+        "--daemon-protocol", default=os.getenv(EnvVariables.PYTEST_DAEMON_PROTOCOL, "binary")
+    )
+    parser.add_argument(
+        "--daemon-stream-output",
+        action="store_true",
+        default=_env_flag(EnvVariables.PYTEST_DAEMON_STREAM_OUTPUT),
+    )
+    parser.add_argument("--daemon-secret", default=os.getenv(EnvVariables.PYTEST_DAEMON_SECRET))
+    parser.add_argument(
+        "--daemon-path-map", default=os.getenv(EnvVariables.PYTEST_DAEMON_PATH_MAP, "")
+    )
+    parser.add_argument(
+        "--daemon-start-if-needed",
+        action="store_true",
+        default=_env_flag(EnvVariables.PYTEST_DAEMON_START_IF_NEEDED),
+    )
+    parser.add_argument("--stop-daemon", action="store_true", default=False)
+    options, _ = parser.parse_known_args(args)
+    return options
+
+
+def find_socket(cwd: Path) -> str | None:
+    """
+    The unix domain socket of the daemon serving the project. The project root isn't
+    known without loading the pytest configuration, so the daemon sockets of the
+    working directory and each of its parents are looked for instead.
+    """
+    for directory in (cwd, *cwd.parents):
+        socket_path = unix_socket_path(directory)
+        if os.path.exists(socket_path):
+            return socket_path
+    return None
+
+
+def run_pytest(args: Sequence[str], disable_daemon: bool) -> int:
+    """
+    Run pytest in this process, the same as if it had been run directly
+    """
+    if disable_daemon:
+        # the plugin may not be loaded, so the option can't be used
+        os.environ[EnvVariables.PYTEST_DAEMON_DISABLE] = "True"
+    import pytest
+
+    return int(pytest.main(list(args)))
+
+
+def main(args: Sequence[str] | None = None) -> int:
+    if args is None:
+        args = sys.argv[1:]
+    # match the sys.path of `python -m pytest` so the daemon sees the same project
+    sys.path[0] = os.getcwd()
+
+    if PYTEST_ONLY_ARGS.intersection(args) or _env_flag(EnvVariables.PYTEST_DAEMON_DISABLE):
+        return run_pytest(args, disable_daemon=False)
+
+    options = _parse_args(args)
+    cwd = Path.cwd()
+    socket_path = None
+    if options.daemon_unix_socket:
+        socket_path = find_socket(cwd)
+        if socket_path is None:
+            return run_pytest(args, disable_daemon=not options.daemon_start_if_needed)
+
+    client = PytestClient(
+        daemon_host=options.daemon_host,
+        daemon_port=options.daemon_port,
+        stream_output=options.daemon_stream_output,
+        socket_path=socket_path,
+        protocol=options.daemon_protocol,
+        secret=options.daemon_secret,
+        path_map=PathMap.parse(options.daemon_path_map),
+    )
+    if options.stop_daemon:
+        client.stop()
+        return 0
+    if not client.is_daemon_running():
+        # pytest starts the daemon with the project's configuration when that's wanted
+        return run_pytest(args, disable_daemon=not options.daemon_start_if_needed)
+    return client.run(cwd, list(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+The fixtures defined in the watched files and the fixtures each of them requests.
+
+A fixture whose body changes is reloaded in place, so the tests that use it keep
+the same fixture closure. Only a change in what a fixture requests changes the
+closures of the tests that use it, and only those closures are computed again.
+"""
+
+import ast
+import inspect
+from typing import Callable, Iterable
+
+
+class FixtureGraph:
+    def __init__(self) -> None:
+        # fixtures of the same name can be defined in several files, overriding each other
+        self._requests: dict[tuple[str, str], frozenset[str]] = {}
+
+    def define(self, path: str, name: str, requests: Iterable[str]) -> frozenset[str] | None:
+        """
+        Record what the fixture defined at path requests. Returns what it requested
+        before, or None if it wasn't defined.
+        """
+        key = (path, name)
+        previous = self._requests.get(key)
+        self._requests[key] = frozenset(requests)
+        return previous
+
+    def remove(self, path: str, name: str) -> None:
+        self._requests.pop((path, name), None)
+
+    def requests(self, name: str) -> frozenset[str]:
+        """
+        What the fixtures of this name request, directly
+        """
+        return frozenset().union(
+            *(requests for (_, fixture), requests in self._requests.items() if fixture == name)
+        )
+
+    def as_dict(self) -> dict[str, list[str]]:
+        """
+        The fixtures each fixture requests, for analysis
+        """
+        names = {name for _, name in self._requests}
+        return {name: sorted(self.requests(name)) for name in sorted(names)}
+
+
+def fixture_requests(func: Callable) -> list[str]:
+    """
+    The fixtures a fixture function requests. Like pytest, parameters with a default
+    value aren't requested.
+    """
+    try:
+        parameters = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return []
+    return [
+        p.name
+        for p in parameters
+        if p.kind not in (p.VAR_POSITIONAL, p.VAR_KEYWORD) and p.default is p.empty
+    ]
+
+
+def node_requests(node: ast.FunctionDef | ast.AsyncFunctionDef) -> list[str]:
+    """
+    The fixtures the fixture function of the syntax tree requests
+    """
+    positional = [*node.args.posonlyargs, *node.args.args]
+    # the defaults belong to the last positional parameters
+    requested = positional[: len(positional) - len(node.args.defaults)]
+    requested += [
+        arg
+        for arg, default in zip(node.args.kwonlyargs, node.args.kw_defaults)
+        if default is None
+    ]
+    return [arg.arg for arg in requested]
@@ -0,0 +1,34 @@
+"""
+HTTP and XML-RPC connections over a unix domain socket, used by the xmlrpc protocol
+"""
+
+import http.client
+import xmlrpc.client
+
+from pytest_hot_reloading.transport import connect
+
+
+class UnixStreamHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a unix domain socket
+    """
+
+    def __init__(self, socket_path: str) -> None:
+        super().__init__("localhost")
+        self._socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = connect(self.host, 0, self._socket_path)
+
+
+class UnixStreamTransport(xmlrpc.client.Transport):
+    """
+    XML-RPC transport over a unix domain socket
+    """
+
+    def __init__(self, socket_path: str) -> None:
+        super().__init__()
+        self._socket_path = socket_path
+
+    def make_connection(self, host) -> http.client.HTTPConnection:
+        return UnixStreamHTTPConnection(self._socket_path)
@@ -0,0 +1,236 @@
+"""
+Copies of cached test items for each run.
+
+The cached items are templates that never run. Each run gets a clone: a shallow copy
+that shares what collection computed, such as the fixture info, the parametrization
+and the keywords, and gets its own per-run state. That is the fixture request and
+values, the stash, the lists that tests and plugins add to, and a new instance of
+the test class for methods.
+
+Items that aren't test functions, such as doctests or the items of other plugins,
+are copied with best_effort_copy.
+"""
+
+import contextlib
+import copy
+import functools
+import gc
+import types
+from typing import Any, Collection, Iterator, Sequence
+
+import pytest
+from _pytest.compat import getfuncargnames
+from _pytest.fixtures import FixtureDef, FixtureManager, FuncFixtureInfo
+from _pytest.stash import Stash
+
+# performance improvements
+# when doing a best_effort_copy, do not copy these attributes
+no_copy = {
+    "_arg2fixturedefs",
+    "_fixtureinfo",
+    "keywords",
+    "_fixturemanager",
+    "_pyfuncitem",
+}
+
+# when doing a best_effort_copy, do not deep copy this
+# instead, force a best effort up to a given depth
+use_best_effort_copy = {
+    "_request",
+}
+
+# pytest 8 takes the node before the fixture names when computing a fixture closure
+_NODE_FIRST_CLOSURE = pytest.version_tuple >= (8,)
+
+# lists and sets that tests and plugins add to while running
+_PER_RUN_CONTAINERS = ("own_markers", "extra_keyword_matches", "user_properties")
+
+# the fixture manager of the session that collected the item
+_collected_by = pytest.StashKey[FixtureManager]()
+
+
+def best_effort_copy(item: Any, depth_remaining: int = 2, force_best_effort: bool = False) -> Any:
+    """
+    Copy test items. The items have references to modules and
+    other things that cannot be deep copied.
+    """
+    if depth_remaining <= 0:
+        return item
+    try:
+        item_copy = copy.copy(item)
+    except TypeError:
+        return item
+    # NodeKeywords is an example of an object without a __dict__
+    if hasattr(item, "__dict__"):
+        for k, v in item.__dict__.items():
+            # performance-tweaks
+            if k in no_copy:
+                item_copy.__dict__[k] = v
+                continue
+            if k in use_best_effort_copy:
+                item_copy.__dict__[k] = best_effort_copy(v, 2, force_best_effort=True)
+                continue
+            if force_best_effort:
+                item_copy.__dict__[k] = best_effort_copy(
+                    v, depth_remaining - 1, force_best_effort=True
+                )
+                continue
+
+            try:
+                item_copy.__dict__[k] = copy.deepcopy(v)
+            except KeyboardInterrupt:
+                raise
+            except TypeError:
+                # Non-pickelable objects
+                item_copy.__dict__[k] = best_effort_copy(v, depth_remaining - 1)
+    return item_copy
+
+
+def clone_item(
+    item: pytest.Item,
+    config: pytest.Config | None = None,
+    session: pytest.Session | None = None,
+) -> pytest.Item:
+    """
+    A copy of the item to run. Given a config and a session, the copy belongs to them
+    instead of to the ones the item was collected in. Otherwise it is a template to
+    cache.
+    """
+    if not isinstance(item, pytest.Function):
+        clone = best_effort_copy(item)
+        if config is not None:
+            clone.config = config
+            clone.session = session
+            if clone._request:  # type: ignore
+                clone._request._pyfuncitem = clone  # type: ignore
+        return clone
+    clone = _shallow_copy(item)
+    if config is not None:
+        clone.config = config
+        clone.session = session  # type: ignore
+    state = clone.__dict__
+    for name in _PER_RUN_CONTAINERS:
+        if name in state:
+            state[name] = state[name].copy()
+    state["_report_sections"] = []
+    stash = Stash()
+    stash._storage = dict(item.stash._storage)
+    clone.stash = clone._store = stash  # type: ignore
+    if config is None and _collected_by not in stash:
+        # the fixtures the test can see are matched against the nodes collected with it
+        stash[_collected_by] = item.session._fixturemanager
+    obj = state.get("_obj")
+    if isinstance(obj, types.MethodType) and isinstance(clone.parent, pytest.Class):
+        # each run gets a new instance of the test class, like each test does
+        instance = clone.parent.newinstance()
+        state["_obj"] = types.MethodType(obj.__func__, instance)
+        if "_instance" in state:
+            state["_instance"] = instance
+    # the fixture request refers to the session
+    clone._initrequest()
+    return clone
+
+
+@contextlib.contextmanager
+def gc_paused() -> Iterator[None]:
+    """
+    Pauses the garbage collector while cloning the items of a run. The clones are
+    all kept, and with a large suite each collection walks every cached item.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def refresh_fixture_closure(item: pytest.Item, changed: Collection[str]) -> bool:
+    """
+    Compute the fixture closure of a cached test again, after the changed fixtures
+    started requesting other fixtures. Their code was reloaded in place, only what
+    they request is read again. The fixtures the test didn't use before are looked
+    up with the fixture manager of the session that collected it.
+
+    Returns False if the test can't be updated, for example because it now uses a
+    fixture defined since, or a parametrized fixture, which changes its
+    parametrization. It has to be collected again then.
+    """
+    info = getattr(item, "_fixtureinfo", None)
+    manager = item.stash.get(_collected_by, None)
+    if not isinstance(info, FuncFixtureInfo) or manager is None:
+        return False
+    known = dict(info.name2fixturedefs)
+    for name in changed:
+        for fixturedef in known.get(name, ()):
+            fixturedef.argnames = getfuncargnames(fixturedef.func, name=name)  # type: ignore
+    lookup = _FixtureLookup(known, manager)
+    # the signature depends on the version of pytest
+    getfixtureclosure: Any = FixtureManager.getfixtureclosure
+    # direct parametrization was already applied, it is among the known fixtures
+    if _NODE_FIRST_CLOSURE:
+        closure, name2fixturedefs = getfixtureclosure(
+            lookup, parentnode=item, initialnames=info.initialnames, ignore_args=frozenset()
+        )
+    else:
+        _, closure, name2fixturedefs = getfixtureclosure(lookup, info.initialnames, item)
+    previous = set(info.names_closure)
+    for name in closure:
+        if name in previous or name == "request":
+            continue
+        fixturedefs = name2fixturedefs.get(name)
+        if not fixturedefs or fixturedefs[-1].params is not None:
+            return False
+    item._fixtureinfo = FuncFixtureInfo(  # type: ignore
+        argnames=info.argnames,
+        initialnames=info.initialnames,
+        names_closure=closure,
+        name2fixturedefs=name2fixturedefs,
+    )
+    item.fixturenames = closure  # type: ignore
+    return True
+
+
+class _FixtureLookup:
+    """
+    Finds the fixtures a test already used before asking the fixture manager
+    """
+
+    def __init__(self, known: dict[str, Sequence[FixtureDef]], manager: FixtureManager) -> None:
+        self._known = known
+        self._manager = manager
+
+    def getfixturedefs(self, argname: str, node: Any) -> Sequence[FixtureDef] | None:
+        # the node is its id before pytest 8.1
+        known = self._known.get(argname)
+        if known:
+            return known
+        return self._manager.getfixturedefs(argname, node)
+
+    def _getautousenames(self, nodeid: Any) -> Iterator[str]:
+        # pytest 7 adds the autouse fixtures while computing the closure
+        return self._manager._getautousenames(nodeid)
+
+
+def _shallow_copy(item: pytest.Item) -> pytest.Item:
+    # much faster than copy.copy, which goes through __reduce_ex__
+    clone = object.__new__(type(item))
+    for name in _slots(type(item)):
+        try:
+            setattr(clone, name, getattr(item, name))
+        except AttributeError:
+            # not set
+            pass
+    clone.__dict__.update(item.__dict__)
+    return clone
+
+
+@functools.lru_cache
+def _slots(cls: type) -> tuple[str, ...]:
+    slots: list[str] = []
+    for base in cls.__mro__:
+        # only the slots the class itself declares
+        names = base.__dict__.get("__slots__", ())
+        slots += [names] if isinstance(names, str) else names
+    return tuple(name for name in slots if name not in ("__dict__", "__weakref__"))
@@ -1,22 +1,95 @@
-import time
+import threading
+from typing import NamedTuple
+
+# how long a run waits for the changed files to be reloaded, in seconds
+RELOAD_TIMEOUT = 10.0
+
+
+class CacheInvalidation(NamedTuple):
+    # everything is collected again
+    clear_all: bool
+    # the modules that are collected again
+    paths: frozenset[str]
+    # the tests that use these fixtures are collected again
+    fixtures: frozenset[str]
+    # the tests that use these fixtures have their fixture closure computed again
+    closures: frozenset[str] = frozenset()
 
 
 class JuriggedDaemonSignaler:
     def __init__(self) -> None:
         self._do_cache_clear = False
+        self._changed_paths: set[str] = set()
+        self._changed_fixtures: set[str] = set()
+        self._changed_closures: set[str] = set()
         self._deleted_fixtures: set[str] = set()
-        self._block_until: float | None = None
+        # the changes seen to each file that haven't been reloaded yet
+        self._unapplied: dict[str, int] = {}
+        self._condition = threading.Condition()
 
     def signal_clear_cache(self) -> None:
-        self._do_cache_clear = True
-        self._block_until = time.time() + 1
-
-    def receive_clear_cache_signal(self) -> bool:
-        ret = self._do_cache_clear
-        cur_time = time.time()
-        while self._block_until is not None and cur_time < self._block_until:
-            time.sleep(self._block_until - cur_time)
-            cur_time = time.time()
-        self._block_until = None
-        self._do_cache_clear = False
-        return ret
+        with self._condition:
+            self._do_cache_clear = True
+
+    def signal_changed(
+        self, path: str | None = None, fixture: str | None = None, closure: str | None = None
+    ) -> None:
+        """
+        Signal that the tests in the file at path, and the tests that use the fixture,
+        need to be collected again. The tests that use the closure fixture only need
+        their fixture closure computed again, it requests other fixtures now.
+        """
+        with self._condition:
+            if path:
+                self._changed_paths.add(path)
+            if fixture:
+                self._changed_fixtures.add(fixture)
+            if closure:
+                self._changed_closures.add(closure)
+
+    def file_changed(self, path: str) -> None:
+        """
+        Signal that the file changed and is going to be reloaded
+        """
+        with self._condition:
+            self._unapplied[path] = self._unapplied.get(path, 0) + 1
+
+    def reloading(self, path: str) -> int:
+        """
+        The changes to the file that the reload about to read it is going to apply
+        """
+        with self._condition:
+            return self._unapplied.get(path, 0)
+
+    def reloaded(self, path: str, changes: int) -> None:
+        """
+        Signal that the reload applied the changes to the file
+        """
+        with self._condition:
+            unapplied = self._unapplied.get(path, 0) - changes
+            if unapplied > 0:
+                self._unapplied[path] = unapplied
+            else:
+                self._unapplied.pop(path, None)
+                self._condition.notify_all()
+
+    def receive_invalidation(self, timeout: float = RELOAD_TIMEOUT) -> CacheInvalidation | None:
+        """
+        What changed since the last call, or None if nothing did. Waits until the files
+        that changed are reloaded, up to the timeout.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: not self._unapplied, timeout):
+                print(
+                    "Pytest Daemon: Running before the reload of"
+                    f" {', '.join(sorted(self._unapplied))} finished"
+                )
+            clear_all, self._do_cache_clear = self._do_cache_clear, False
+            paths, self._changed_paths = self._changed_paths, set()
+            fixtures, self._changed_fixtures = self._changed_fixtures, set()
+            closures, self._changed_closures = self._changed_closures, set()
+        if not (clear_all or paths or fixtures or closures):
+            return None
+        return CacheInvalidation(
+            clear_all, frozenset(paths), frozenset(fixtures), frozenset(closures)
+        )
@@ -0,0 +1,69 @@
+"""
+Reuse of the items of unchanged modules when collecting a new selection.
+
+When a run isn't answered by a cached collection, collecting its selection would
+build every module it contains from scratch: its classes and functions, their
+fixtures and their parametrization. The modules that haven't changed since they
+were last collected have their items cloned from the module cache instead, so
+the time it takes scales with what changed.
+
+The clones are reported as the result of collecting the new module collector, but
+they keep the collectors of the session that first collected them as their
+parents. Selections that name tests within a module need its classes to match
+against, so they are collected as usual.
+"""
+
+import pytest
+
+from pytest_hot_reloading.contexts import ModuleCache
+from pytest_hot_reloading.items import clone_item
+
+
+class ModuleReuse:
+    """
+    Pytest plugin that takes the items of unchanged modules from the cache, and
+    records what was collected to cache it
+    """
+
+    def __init__(
+        self, cache: ModuleCache, config: pytest.Config, session: pytest.Session
+    ) -> None:
+        self._cache = cache
+        self._config = config
+        self._session = session
+        self.reused: set[str] = set()
+        self.collected: list[pytest.Item] = []
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_make_collect_report(
+        self, collector: pytest.Collector
+    ) -> pytest.CollectReport | None:
+        # subclasses, such as doctest modules, collect other items from the same file
+        if type(collector) is not pytest.Module:
+            return None
+        path = str(collector.path)
+        templates = self._cache.get(path)
+        if templates is None:
+            return None
+        self.reused.add(path)
+        items: list[pytest.Item | pytest.Collector] = [
+            clone_item(item, self._config, self._session) for item in templates
+        ]
+        return pytest.CollectReport(collector.nodeid, "passed", None, items)
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collection_modifyitems(self, items: list[pytest.Item]) -> None:
+        # before -k and -m deselect any
+        self.collected = list(items)
+
+    def store(self, template_of: dict[int, pytest.Item]) -> None:
+        """
+        Cache the templates of the items of the modules that were collected
+        """
+        modules: dict[str, list[pytest.Item]] = {}
+        for item in self.collected:
+            path = str(item.path)
+            if type(item.getparent(pytest.Module)) is pytest.Module and path not in self.reused:
+                modules.setdefault(path, []).append(template_of[id(item)])
+        for path, templates in modules.items():
+            self._cache.store(path, templates)
@@ -0,0 +1,43 @@
+"""
+Matching file paths against the watch and ignore globs.
+
+jurigged asks whether to watch every module that gets imported, and the daemon imports
+a lot of them, most of which belong to libraries. The globs are compiled into a single
+regex that is evaluated once per path, and the answer for each path is remembered.
+"""
+
+import fnmatch
+import re
+from typing import Sequence
+
+
+class PathMatcher:
+    """
+    Whether a path matches one of the watch globs and none of the ignore globs. The
+    globs have fnmatch semantics, where * also matches across directories.
+    """
+
+    def __init__(self, watch_globs: Sequence[str], ignore_globs: Sequence[str] = ()) -> None:
+        pattern = _alternatives(watch_globs)
+        if ignore_globs:
+            # the ignore globs are checked first, in the same pass
+            pattern = f"(?!{_alternatives(ignore_globs)}){pattern}"
+        self._match = re.compile(pattern).match
+        self._memo: dict[str, bool] = {}
+
+    def __contains__(self, path: str) -> bool:
+        """
+        Whether the path was matched before
+        """
+        return path in self._memo
+
+    def __call__(self, path: str) -> bool:
+        matched = self._memo.get(path)
+        if matched is None:
+            matched = self._memo[path] = self._match(path) is not None
+        return matched
+
+
+def _alternatives(globs: Sequence[str]) -> str:
+    # each translation is anchored at the end of the path
+    return "(?:" + "|".join(fnmatch.translate(glob) for glob in globs) + ")"
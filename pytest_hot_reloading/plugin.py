@@ -3,38 +3,41 @@ Pytest Hot Reloading plugin
 """
 from __future__ import annotations
 
+import argparse
 import inspect
 import os
+import shlex
 import sys
-import time
-from enum import Enum
+import traceback
 from pathlib import Path
 from typing import TYPE_CHECKING, Callable, Optional
 
-from pytest_hot_reloading.client import PytestClient
+from pytest_hot_reloading.client import PytestClient, show_progress_in_title
+from pytest_hot_reloading.env_variables import EnvVariables
+from pytest_hot_reloading.fixture_graph import FixtureGraph, fixture_requests, node_requests
 from pytest_hot_reloading.jurigged_daemon_signalers import JuriggedDaemonSignaler
+from pytest_hot_reloading.remote import PathMap
+from pytest_hot_reloading.startup import StartupReporter
+from pytest_hot_reloading.transport import unix_socket_path
 
 # this is modified by the daemon so that the pytest_collection hooks does not run
 i_am_server = False
 
 seen_paths: set[Path] = set()
+# the project roots that have their files watched by the daemon, with the filter of
+# their files
+watched_rootdirs: dict[Path, Callable[[str], bool]] = {}
+# stop jurigged from registering the files of the other projects that are watched
+unregister_projects: dict[Path, Callable[[], None]] = {}
 signaler = JuriggedDaemonSignaler()
 
 if TYPE_CHECKING:
     from pytest import Config, Item, Parser, Session
 
+    from pytest_hot_reloading.watcher import BatchingWatcher
 
-class EnvVariables(str, Enum):
-    PYTEST_DAEMON_PORT = "PYTEST_DAEMON_PORT"
-    PYTEST_DAEMON_PYTEST_NAME = "PYTEST_DAEMON_PYTEST_NAME"
-    PYTEST_DAEMON_TIMEOUT = "PYTEST_DAEMON_TIMEOUT"
-    PYTEST_DAEMON_WATCH_GLOBS = "PYTEST_DAEMON_WATCH_GLOBS"
-    PYTEST_DAEMON_IGNORE_WATCH_GLOBS = "PYTEST_DAEMON_IGNORE_WATCH_GLOBS"
-    PYTEST_DAEMON_START_IF_NEEDED = "PYTEST_DAEMON_START_IF_NEEDED"
-    PYTEST_DAEMON_DISABLE = "PYTEST_DAEMON_DISABLE"
-    PYTEST_DAEMON_DO_NOT_AUTOWATCH_FIXTURES = "PYTEST_DAEMON_DO_NOT_AUTOWATCH_FIXTURES"
-    PYTEST_DAEMON_USE_OS_EVENTS = "PYTEST_DAEMON_USE_OS_EVENTS"
-    PYTEST_DAEMON_POLL_THROTTLE = "PYTEST_DAEMON_POLL_THROTTLE"
+# watches the files jurigged reloads, in the daemon
+file_watcher: "BatchingWatcher | None" = None
 
 
 def pytest_addoption(parser) -> None:
@@ -57,6 +60,38 @@ def pytest_addoption(parser) -> None:
         default=int(os.getenv(EnvVariables.PYTEST_DAEMON_PORT, "4852")),
         help="The port to use for the daemon. You generally shouldn't need to set this.",
     )
+    group.addoption(
+        "--daemon-host",
+        action="store",
+        default=os.getenv(EnvVariables.PYTEST_DAEMON_HOST, "localhost"),
+        help=(
+            "The address of the daemon. The daemon listens on this address, "
+            "and anything other than localhost requires --daemon-secret."
+        ),
+    )
+    group.addoption(
+        "--daemon-secret",
+        action="store",
+        default=os.getenv(EnvVariables.PYTEST_DAEMON_SECRET),
+        help="Shared secret the client must know to use the daemon.",
+    )
+    group.addoption(
+        "--daemon-path-map",
+        action="store",
+        default=os.getenv(EnvVariables.PYTEST_DAEMON_PATH_MAP, ""),
+        help=(
+            "Colon separated list of client_path=daemon_path prefixes, for when the daemon "
+            "sees the project at a different path, such as in a container."
+        ),
+    )
+    group.addoption(
+        "--daemon-ready-fd",
+        action="store",
+        type=int,
+        default=None,
+        # internal, the pipe the daemon reports its startup on
+        help=argparse.SUPPRESS,
+    )
     group.addoption(
         "--pytest-name",
         action="store",
@@ -111,18 +146,27 @@ def pytest_addoption(parser) -> None:
             "Typically this would be used if there's too many fixtures and the watch glob is used instead."
         ),
     )
+    use_os_events = os.getenv(
+        EnvVariables.PYTEST_DAEMON_USE_OS_EVENTS,
+        "True" if sys.platform.startswith("linux") else "False",
+    ).lower() in ("true", "1")
     group.addoption(
         "--daemon-use-os-events",
         action="store_true",
-        default=(
-            os.getenv(EnvVariables.PYTEST_DAEMON_USE_OS_EVENTS, "False").lower() in ("true", "1")
-        ),
+        default=use_os_events,
         help=(
             "Use OS events such as inotify instead of polling. "
             "This reduces CPU usage, takes up open file handles, and improves responsiveness. "
-            "Some systems cannot reliably use this."
+            "Falls back to polling if they can't be used. The default on Linux."
         ),
     )
+    group.addoption(
+        "--daemon-use-polling",
+        action="store_false",
+        dest="daemon_use_os_events",
+        default=use_os_events,
+        help="Poll the file system for changes instead of using OS events.",
+    )
 
     group.addoption(
         "--daemon-poll-throttle",
@@ -131,6 +175,102 @@ def pytest_addoption(parser) -> None:
             "The throttle for polling, as a float multiplier. Higher numbers are slower but tax the CPU less."
         ),
     )
+    group.addoption(
+        "--daemon-stream-output",
+        action="store_true",
+        default=(
+            os.getenv(EnvVariables.PYTEST_DAEMON_STREAM_OUTPUT, "False").lower() in ("true", "1")
+        ),
+        help=(
+            "Show the test output as the daemon produces it, "
+            "instead of all at once when the test run finishes."
+        ),
+    )
+    group.addoption(
+        "--daemon-unix-socket",
+        action="store_true",
+        default=(
+            os.getenv(EnvVariables.PYTEST_DAEMON_UNIX_SOCKET, "False").lower() in ("true", "1")
+        ),
+        help=(
+            "Talk to the daemon over a unix domain socket instead of TCP. "
+            "The socket path is derived from the project root, so the port is not used."
+        ),
+    )
+    group.addoption(
+        "--daemon-protocol",
+        action="store",
+        choices=("binary", "xmlrpc"),
+        default=os.getenv(EnvVariables.PYTEST_DAEMON_PROTOCOL, "binary"),
+        help=(
+            "The protocol the client uses to talk to the daemon. "
+            "The daemon understands both. xmlrpc is the legacy protocol."
+        ),
+    )
+    group.addoption(
+        "--daemon-workers",
+        action="store",
+        type=int,
+        default=int(os.getenv(EnvVariables.PYTEST_DAEMON_WORKERS, "0")),
+        help=(
+            "Run the tests in this many workers forked from the daemon. "
+            "0 or 1 runs the tests serially in the daemon. Not available on Windows."
+        ),
+    )
+    group.addoption(
+        "--daemon-fork-per-run",
+        action="store_true",
+        default=(
+            os.getenv(EnvVariables.PYTEST_DAEMON_FORK_PER_RUN, "False").lower() in ("true", "1")
+        ),
+        help=(
+            "Run each test run in a process forked from the daemon, so nothing a run does "
+            "can leak into later runs. Not available on Windows."
+        ),
+    )
+    group.addoption(
+        "--daemon-memory-budget",
+        action="store",
+        type=int,
+        default=int(os.getenv(EnvVariables.PYTEST_DAEMON_MEMORY_BUDGET, "2048")),
+        help=(
+            "Memory budget of the daemon's caches in MB. When their estimated size exceeds "
+            "it, the caches of the projects that were used least recently are dropped. "
+            "0 disables the budget."
+        ),
+    )
+    group.addoption(
+        "--daemon-cache-budget",
+        action="store",
+        type=int,
+        default=int(os.getenv(EnvVariables.PYTEST_DAEMON_CACHE_BUDGET, "512")),
+        help=(
+            "Budget of the collection cache of each project in MB, by the estimated size "
+            "of the collected tests. The least recently used collections are evicted to "
+            "stay within it. 0 disables the budget."
+        ),
+    )
+    group.addoption(
+        "--daemon-cache-ttl",
+        action="store",
+        type=float,
+        default=float(os.getenv(EnvVariables.PYTEST_DAEMON_CACHE_TTL, "0")),
+        help=(
+            "Seconds a cached collection is kept without being used. 0 keeps them until "
+            "they are evicted."
+        ),
+    )
+    group.addoption(
+        "--daemon-warmup",
+        action="store",
+        default=os.getenv(EnvVariables.PYTEST_DAEMON_WARMUP, ""),
+        help=(
+            "Collect tests as soon as the daemon starts so the first run uses the cached "
+            "collection. Semicolon separated list of argument sets, such as "
+            "'tests/unit;tests/integration -m slow'. Use 'testpaths' for the tests that "
+            "pytest collects without arguments."
+        ),
+    )
 
 
 # list of pytest hooks
@@ -167,6 +307,8 @@ def pytest_cmdline_main(config: Config) -> Optional[int]:
 
 
 fixture_names: set[str] = set()
+# what each fixture requests, to tell which changes affect the fixture closures of tests
+fixture_graph = FixtureGraph()
 
 
 def monkey_patch_jurigged_function_definition():
@@ -186,12 +328,13 @@ def monkey_patch_jurigged_function_definition():
 
         def _signal_clear_cache_if_fixture(self) -> None:
             """
-            Clear the cache if a fixture is deleted.
+            Collect the tests using a fixture again if it is deleted.
 
             If this isn't here, then deleted fixtures may still exist.
             """
             if self.defn.name in fixture_names:
-                signaler.signal_clear_cache()
+                fixture_graph.remove(self.defn.filename, self.defn.name)
+                signaler.signal_changed(fixture=self.defn.name)
 
     class NewFunctionDefinition(OrigFunctionDefinition):
         def reevaluate(self, new_node, glb):
@@ -203,8 +346,12 @@ def monkey_patch_jurigged_function_definition():
                     old_sig = [x.arg for x in self.node.args.args]
             else:
                 if new_node.name in fixture_names:
-                    # if a fixture is updated, then clear the session cache to avoid stale responses
-                    signaler.signal_clear_cache()
+                    if self._decorators_changed(new_node):
+                        # the scope, params or autouse may have changed, which can
+                        # affect tests that don't use the fixture yet
+                        signaler.signal_clear_cache()
+                    else:
+                        self._signal_if_requests_changed(new_node)
             # monkeypatch: The assertion rewrite is from pytest. Jurigged doesn't
             #              seem to have a way to add rewrite hooks
             new_node = self.apply_assertion_rewrite(new_node, glb)
@@ -213,19 +360,39 @@ def monkey_patch_jurigged_function_definition():
             if is_test:
                 new_sig = [x.arg for x in new_node.args.args]
 
-            # if the signature changes, clear the session cache
+            # if the signature changes, collect the tests of the module again
             # otherwise pytest will use the old signature.
-            # This is a more of a band-aid because the session cache
-            # could be more intelligently updated based on what was changed.
-            # This band-aid fixes tests using stale fixture info, which
+            # This fixes tests using stale fixture info, which
             # can result in unpredictable behavior that requires
             # restarting the daemon.
             if is_test:
                 if old_sig != new_sig:
-                    signaler.signal_clear_cache()
+                    signaler.signal_changed(path=glb["__file__"])
 
             return obj
 
+        def _signal_if_requests_changed(self, new_node) -> None:
+            """
+            The body of a fixture is reloaded in place, so the tests using it only
+            need updating if it requests other fixtures now.
+            """
+            requests = node_requests(new_node)
+            previous = fixture_graph.define(self.filename, new_node.name, requests)
+            if previous is None:
+                # what it requested isn't known, collect the tests using it again
+                signaler.signal_changed(fixture=new_node.name)
+            elif previous != frozenset(requests):
+                signaler.signal_changed(closure=new_node.name)
+
+        def _decorators_changed(self, new_node) -> bool:
+            # once reevaluated, jurigged keeps the function without its decorators,
+            # so they are remembered here
+            old_decorators = getattr(self, "_decorators", None)
+            if old_decorators is None:
+                old_decorators = list(map(ast.dump, getattr(self.node, "decorator_list", [])))
+            self._decorators = list(map(ast.dump, new_node.decorator_list))
+            return old_decorators != self._decorators
+
         def apply_assertion_rewrite(self, ast_func, glb):
             from _pytest.assertion.rewrite import AssertionRewriter
 
@@ -302,6 +469,8 @@ def monkeypatch_group_definition():
 
 
 def setup_jurigged(config: Config):
+    global file_watcher
+
     import jurigged
 
     monkey_patch_jurigged_function_definition()
@@ -312,33 +481,54 @@ def setup_jurigged(config: Config):
         print("Not autowatching fixtures")
 
     pattern = _get_pattern_filters(config)
-    # TODO: intelligently use poll (https://github.com/JamesHutchison/pytest-hot-reloading/issues/16)
-
-    poll_throttle = float(config.option.daemon_poll_throttle)
 
-    from watchdog.observers.polling import PollingObserverVFS
+    from pytest_hot_reloading.watcher import watch
 
-    class NewPollingObserverVFS(PollingObserverVFS):
-        def __init__(self, stat, listdir, polling_interval=2) -> None:
-            def lagged_listdir(*args, **kwargs):
-                time.sleep(0.02 * poll_throttle)  # give CPU a break!
-                return listdir(*args, **kwargs)
+    file_watcher = watch(
+        pattern,
+        jurigged.registry,
+        use_os_events=config.option.daemon_use_os_events,
+        poll_throttle=float(config.option.daemon_poll_throttle),
+        signaler=signaler,
+    )
+    watched_rootdirs[config.rootpath] = pattern
 
-            super().__init__(stat, lagged_listdir, polling_interval=polling_interval * poll_throttle)
 
-    jurigged.live.PollingObserverVFS = NewPollingObserverVFS
+def watch_project(config: Config) -> None:
+    """
+    Watch the files of another project served by the daemon. The globs are relative
+    to the directory the project's tests were run from.
+    """
+    from jurigged import registry
 
-    poll: bool | float
+    if not hasattr(config.option, "daemon_watch_globs"):
+        # the plugin isn't loaded for the run, such as with -p no:<plugin>
+        return
+    if config.rootpath in watched_rootdirs:
+        return
+    pattern = _get_pattern_filters(config)
+    watched_rootdirs[config.rootpath] = pattern
+    unregister_projects[config.rootpath] = registry.auto_register(filter=pattern).uninstall
+    if file_watcher is not None:
+        # the files of a project that was evicted before, which were imported already
+        file_watcher.watch_again(pattern)
 
-    if config.option.daemon_use_os_events:
-        poll = False
-    else:
-        poll = 2  # seconds
 
-    jurigged.watch(
-        pattern=pattern,
-        poll=poll,
-    )
+def unwatch_project(rootdir: str) -> None:
+    """
+    Stop watching the files of a project the daemon evicted, unless a project that
+    is still watched uses them too. They are watched again if the project is run
+    again. The daemon's own project is always watched.
+    """
+    rootpath = Path(rootdir)
+    unregister = unregister_projects.pop(rootpath, None)
+    if unregister is None:
+        return
+    unregister()
+    pattern = watched_rootdirs.pop(rootpath)
+    others = list(watched_rootdirs.values())
+    if file_watcher is not None:
+        file_watcher.unwatch(lambda path: pattern(path) and not any(o(path) for o in others))
 
 
 def watch_file(path: Path | str) -> None:
@@ -361,6 +551,9 @@ def monkeypatch_fixture_marker(use_os_events: bool):
     class FixtureFunctionMarkerNew(FixtureFunctionMarkerOrig):  # type: ignore # noqa
         def __call__(self, func, *args, **kwargs):
             fixture_names.add(func.__name__)
+            code = getattr(func, "__code__", None)
+            if code is not None:
+                fixture_graph.define(code.co_filename, func.__name__, fixture_requests(func))
 
             return super().__call__(func, *args, **kwargs)
 
@@ -399,20 +592,23 @@ def _plugin_logic(config: Config) -> int:
     # if daemon is passed, then we are the daemon / server
     # if daemon is not passed, then we are the client
     daemon_port = int(config.option.daemon_port)  # --daemon-port
+    socket_path = None
+    if config.option.daemon_unix_socket:  # --daemon-unix-socket
+        socket_path = unix_socket_path(config.rootpath)
     if config.option.daemon:  # --daemon
         # pytest prints out "collecting ...". The leading \r prevents that
         print("\rStarting daemon...")
-        setup_jurigged(config)
-
-        from pytest_hot_reloading.daemon import PytestDaemon
-
-        daemon = PytestDaemon(daemon_port=daemon_port, signaler=signaler)
-
-        daemon.run_forever()
+        startup = StartupReporter(config.option.daemon_ready_fd)  # --daemon-ready-fd
+        try:
+            _run_daemon(config, daemon_port, socket_path, startup)
+        except BaseException:
+            startup.error(traceback.format_exc())
+            raise
         sys.exit(0)
     else:
         pytest_name = config.option.pytest_name  # --pytest-name
         client = PytestClient(
+            daemon_host=config.option.daemon_host,  # --daemon-host
             daemon_port=daemon_port,
             pytest_name=pytest_name,
             start_daemon_if_needed=config.option.daemon_start_if_needed,  # --daemon-start-if-needed
@@ -420,6 +616,14 @@ def _plugin_logic(config: Config) -> int:
             use_os_events=config.option.daemon_use_os_events,  # --daemon-use-os-events
             poll_throttle=config.option.daemon_poll_throttle,  # --daemon-poll-throttle
             additional_args=config.invocation_params.args,
+            stream_output=config.option.daemon_stream_output,  # --daemon-stream-output
+            # the title escape would end up in the output where it isn't a terminal
+            on_progress=show_progress_in_title if sys.stdout.isatty() else None,
+            socket_path=socket_path,
+            protocol=config.option.daemon_protocol,  # --daemon-protocol
+            fork_per_run=config.option.daemon_fork_per_run,  # --daemon-fork-per-run
+            secret=config.option.daemon_secret,  # --daemon-secret
+            path_map=PathMap.parse(config.option.daemon_path_map),  # --daemon-path-map
         )
 
         if config.option.stop_daemon:  # --stop-daemon
@@ -433,7 +637,42 @@ def _plugin_logic(config: Config) -> int:
         return status_code
 
 
-def _get_pattern_filters(config: Config) -> str | Callable[[str], bool]:
+def _run_daemon(
+    config: Config, daemon_port: int, socket_path: str | None, startup: StartupReporter
+) -> None:
+    startup.phase("watching")
+    setup_jurigged(config)
+
+    startup.phase("importing")
+    from pytest_hot_reloading.daemon import PytestDaemon
+
+    daemon = PytestDaemon(
+        daemon_host=config.option.daemon_host,  # --daemon-host
+        daemon_port=daemon_port,
+        signaler=signaler,
+        socket_path=socket_path,
+        fork_per_run=config.option.daemon_fork_per_run,  # --daemon-fork-per-run
+        memory_budget_mb=config.option.daemon_memory_budget,  # --daemon-memory-budget
+        cache_budget_mb=config.option.daemon_cache_budget,  # --daemon-cache-budget
+        cache_ttl=config.option.daemon_cache_ttl,  # --daemon-cache-ttl
+        secret=config.option.daemon_secret,  # --daemon-secret
+        warmup=parse_warmup(config.option.daemon_warmup),  # --daemon-warmup
+    )
+
+    daemon.run_forever(on_ready=startup.ready, on_phase=startup.phase)
+
+
+def parse_warmup(spec: str) -> list[list[str]]:
+    """
+    Parse the semicolon separated argument sets to warm up the daemon with
+    """
+    warmup = []
+    for arg_set in filter(None, (part.strip() for part in spec.split(";"))):
+        warmup.append([] if arg_set == "testpaths" else shlex.split(arg_set))
+    return warmup
+
+
+def _get_pattern_filters(config: Config) -> Callable[[str], bool]:
     """
     Jurigged takes in a pattern argument. The argument is either a glob string
     or a function that returns True if the path passed into it should be watched.
@@ -441,15 +680,16 @@ def _get_pattern_filters(config: Config) -> str | Callable[[str], bool]:
     This creates a function filter that will return True if the path matches.
 
     The logic takes in the --daemon-watch-globs and --daemon-ignore-watch-globs options
-    and creates a function that will return True if the path matches the watch globs.
+    and creates a function that will return True if the path matches the watch globs
+    and none of the ignore globs. The globs are compiled once and the answer for each
+    path is remembered.
 
-    The seen_paths set is used to prevent duplicate paths from being watched and also
-    acts as a short circuit for paths that have already been seen.
+    The paths are added to the seen_paths set, so the tests collected from them later
+    aren't watched again.
     """
     global seen_paths
 
-    import fnmatch
-    import re
+    from pytest_hot_reloading.path_matcher import PathMatcher
 
     def normalize(glob: str) -> str:
         if glob.startswith("~"):
@@ -460,28 +700,18 @@ def _get_pattern_filters(config: Config) -> str | Callable[[str], bool]:
             glob = os.path.join(glob, "*")
         return glob
 
-    watch_globs = config.option.daemon_watch_globs.split(":")
-    regex_matches = [re.compile(fnmatch.translate(normalize(glob))).match for glob in watch_globs]
-
+    watch_globs = [normalize(glob) for glob in config.option.daemon_watch_globs.split(":")]
     ignore_watch_globs = config.option.daemon_ignore_watch_globs
     if ignore_watch_globs:
-        ignore_globs = config.option.daemon_ignore_watch_globs.split(":")
-        ignore_regex_matches = [
-            re.compile(fnmatch.translate(normalize(glob))).match for glob in ignore_globs
-        ]
+        ignore_globs = [normalize(glob) for glob in ignore_watch_globs.split(":")]
     else:
-        ignore_regex_matches = []
+        ignore_globs = []
+    path_matcher = PathMatcher(watch_globs, ignore_globs)
 
     def matcher(filename: str) -> bool:
-        if filename in seen_paths:
-            return False
-        seen_paths.add(Path(filename))
-        if any(regex_match(filename) for regex_match in regex_matches):
-            if not any(
-                ignore_regex_match(filename) for ignore_regex_match in ignore_regex_matches
-            ):
-                return True
-        return False
+        if filename not in path_matcher:
+            seen_paths.add(Path(filename))
+        return path_matcher(filename)
 
     return matcher
 
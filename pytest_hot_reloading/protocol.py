@@ -0,0 +1,86 @@
+"""
+The framed protocol spoken between the client and the daemon.
+
+Every message is a fixed size header followed by a payload:
+
+    magic (3 bytes) | version (1 byte) | message type (1 byte) | payload length (4 bytes)
+
+Structured messages have a JSON payload. Output is sent as raw UTF-8 bytes so,
+unlike XML-RPC, it is not base64 encoded. A connection is kept open for as many
+messages as the client wants to send.
+"""
+
+import json
+import socket
+import struct
+from enum import IntEnum
+from typing import Any
+
+MAGIC = b"PHR"
+VERSION = 1
+HEADER = struct.Struct("!3sBBI")
+# error code sent when a run is relative to an environment baseline the daemon doesn't have
+BASELINE_MISMATCH = "baseline_mismatch"
+
+
+class MessageType(IntEnum):
+    # handshake, sent by both sides when the connection is opened
+    HELLO = 1
+    # client -> daemon
+    RUN = 2
+    STOP = 3
+    # daemon -> client
+    STDOUT = 4
+    STDERR = 5
+    PROGRESS = 6
+    RESULT = 7
+    ERROR = 8
+    # client -> daemon, answers the challenge of a daemon that requires a secret
+    AUTH = 9
+    # client -> daemon, interrupts the run in progress
+    CANCEL = 10
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class ConnectionClosedError(ProtocolError):
+    pass
+
+
+def is_framed(sock: socket.socket) -> bool:
+    """
+    Peek at a new connection to see if it speaks the framed protocol rather than XML-RPC
+    """
+    start = sock.recv(len(MAGIC), socket.MSG_PEEK | getattr(socket, "MSG_WAITALL", 0))
+    return start == MAGIC
+
+
+def send_message(sock: socket.socket, message_type: MessageType, payload: bytes = b"") -> None:
+    sock.sendall(HEADER.pack(MAGIC, VERSION, message_type, len(payload)) + payload)
+
+
+def send_json(sock: socket.socket, message_type: MessageType, data: Any) -> None:
+    send_message(sock, message_type, json.dumps(data).encode("utf-8"))
+
+
+def recv_message(sock: socket.socket) -> tuple[MessageType, bytes]:
+    magic, version, message_type, length = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    if magic != MAGIC:
+        raise ProtocolError("Received something that is not a pytest hot reloading message")
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}, expected {VERSION}")
+    return MessageType(message_type), _recv_exactly(sock, length)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionClosedError("The connection was closed")
+        received += count
+    return bytes(data)
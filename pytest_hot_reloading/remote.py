@@ -0,0 +1,120 @@
+"""
+Support for daemons that run somewhere else than the client, such as in a dev container
+while the editor and client run on the host.
+
+Paths differ between the two sides, so they're mapped using prefixes, and since
+the daemon is reachable over the network, clients must prove they know a shared secret.
+"""
+
+import hashlib
+import hmac
+import os
+import re
+
+LOOPBACK_HOSTS = {"localhost", "127.0.0.1", "::1"}
+
+
+def is_loopback(host: str) -> bool:
+    return host in LOOPBACK_HOSTS
+
+
+def new_challenge() -> str:
+    return os.urandom(16).hex()
+
+
+def sign(secret: str, challenge: str) -> str:
+    return hmac.new(secret.encode("utf-8"), challenge.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def verify(secret: str, challenge: str, signature: str) -> bool:
+    return hmac.compare_digest(sign(secret, challenge), signature)
+
+
+class PathMap:
+    """
+    Maps path prefixes on the client's machine to where the same files are on the daemon's.
+    """
+
+    def __init__(self, mappings: list[tuple[str, str]] | None = None) -> None:
+        # longest prefixes first, so nested mappings win over their parents
+        self._mappings = sorted(
+            ((client.rstrip("/"), daemon.rstrip("/")) for client, daemon in mappings or []),
+            key=lambda mapping: len(mapping[0]),
+            reverse=True,
+        )
+        self._to_client = {daemon: client for client, daemon in reversed(self._mappings)}
+        daemon_prefixes = sorted(self._to_client, key=len, reverse=True)
+        # the daemon's prefixes, only where a path starts and up to the end of a component
+        self._daemon_prefix = re.compile(
+            r"(?<![\w.~/-])(%s)(?![\w.~-])" % "|".join(map(re.escape, daemon_prefixes))
+        )
+
+    @classmethod
+    def parse(cls, spec: str) -> "PathMap":
+        """
+        Parse a colon separated list of client_prefix=daemon_prefix pairs
+        """
+        mappings = []
+        for pair in filter(None, spec.split(":")):
+            client, sep, daemon = pair.partition("=")
+            if not sep or not client or not daemon:
+                raise ValueError(f"Invalid path mapping {pair}, expected client_path=daemon_path")
+            mappings.append((client, daemon))
+        return cls(mappings)
+
+    def __bool__(self) -> bool:
+        return bool(self._mappings)
+
+    def to_daemon(self, path: str) -> str | None:
+        """
+        The path on the daemon's side, or None if the path is not under a mapped prefix
+        """
+        for client, daemon in self._mappings:
+            if path == client or path.startswith(client + "/"):
+                return daemon + path[len(client) :]
+        return None
+
+    def arg_to_daemon(self, arg: str) -> str:
+        """
+        Map an argument if it's an absolute path or node ID, otherwise leave it as is
+        """
+        return self.to_daemon(arg) or arg
+
+    def to_client(self, text: str) -> str:
+        """
+        Replace the daemon's paths in output with the client's
+        """
+        if not self._mappings:
+            return text
+        return self._daemon_prefix.sub(lambda match: self._to_client[match[1]], text)
+
+
+class OutputPathMapper:
+    """
+    Replaces the daemon's paths in output that arrives in chunks. The last word of a
+    chunk is held back when it could be the start of a path that the next chunk
+    finishes. The rest is mapped right away, such as pytest's progress dots.
+    """
+
+    def __init__(self, path_map: PathMap) -> None:
+        self._path_map = path_map
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        if not self._path_map:
+            return text
+        text = self._pending + text
+        # the last word starts after the last whitespace
+        start = max(text.rfind(c) for c in " \t\r\n") + 1
+        if "/" in text[start:]:
+            text, self._pending = text[:start], text[start:]
+        else:
+            self._pending = ""
+        return self._path_map.to_client(text)
+
+    def flush(self) -> str:
+        """
+        The output held back, once no more output is coming
+        """
+        text, self._pending = self._pending, ""
+        return self._path_map.to_client(text)
@@ -0,0 +1,341 @@
+"""
+The queue of runs requested from the daemon.
+
+Connections are served on their own threads, which only queue their runs and wait
+for them. The runs happen one at a time on the daemon's main thread. When it gets
+to the queue, the requests that only differ in which tests they select are merged
+into a single pytest session, so a burst of single test runs, such as an IDE
+re-running failed tests one by one, pays for the session setup once. Each request
+still gets its own status code, from the tests it selected.
+
+A request that is identical to one in flight joins it instead of running again,
+as long as the run hasn't started running tests. Past that point, the code under
+test may have changed since the run started.
+"""
+
+import socket
+import threading
+from typing import Callable, Sequence
+
+import pytest
+
+from pytest_hot_reloading.cancellation import ConnectionWatcher, RunCancellation
+from pytest_hot_reloading.selections import selects, split_selections
+
+
+class RunRequest:
+    """
+    A run requested by a client. Without send_output, the output is captured and
+    handed over when the run is done.
+    """
+
+    def __init__(
+        self,
+        cwd: str,
+        env: dict[str, str],
+        sys_path: list[str],
+        args: list[str],
+        send_output: Callable[[str, str], None] | None = None,
+        send_progress: Callable[[dict], None] | None = None,
+    ) -> None:
+        self.cwd = cwd
+        self.env = env
+        self.sys_path = sys_path
+        self.args = args
+        self.send_output = send_output
+        self.send_progress = send_progress
+        self.options, self.selections = split_selections(cwd, args)
+        self.batch: RunBatch | None = None
+        self.status_code: int | None = None
+        self.stdout = ""
+        self.stderr = ""
+        self._done = threading.Event()
+
+    @property
+    def streaming(self) -> bool:
+        return self.send_output is not None
+
+    @property
+    def key(self) -> tuple:
+        """
+        Requests with the same key can share a session. Requests without test
+        selections run the configured testpaths, so only identical ones are merged.
+        """
+        return (
+            self.cwd,
+            tuple(sorted(self.env.items())),
+            tuple(self.sys_path),
+            tuple(self.options),
+            bool(self.selections),
+            self.streaming,
+        )
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def is_same_run(self, other: "RunRequest") -> bool:
+        return self.key == other.key and self.selections == other.selections
+
+    def finish(self, status_code: int, stdout: str = "", stderr: str = "") -> None:
+        self.status_code = int(status_code)
+        self.stdout = stdout
+        self.stderr = stderr
+        self._done.set()
+
+    def fail(self, error: str) -> None:
+        if self.send_output is not None:
+            self.send_output("stderr", error)
+            self.finish(-1)
+        else:
+            self.finish(-1, stderr=error)
+
+    def wait(self) -> int:
+        self._done.wait()
+        assert self.status_code is not None
+        return self.status_code
+
+
+class RunOutcomes:
+    """
+    Pytest plugin that records which tests ran and failed, to tell apart the status
+    of each of the requests merged into a session
+    """
+
+    def __init__(self) -> None:
+        self.paths: dict[str, str] = {}
+        self.failed: set[str] = set()
+        self.finished: set[str] = set()
+        self.collect_only = False
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session: pytest.Session) -> None:
+        self.paths = {item.nodeid: str(item.path) for item in session.items}
+        self.collect_only = session.config.option.collectonly
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        if report.failed:
+            self.failed.add(report.nodeid)
+
+    def pytest_runtest_logfinish(self, nodeid: str) -> None:
+        self.finished.add(nodeid)
+
+    def fork_state(self) -> dict:
+        return {
+            "paths": self.paths,
+            "failed": sorted(self.failed),
+            "finished": sorted(self.finished),
+            "collect_only": self.collect_only,
+        }
+
+    def restore_fork_state(self, state: dict) -> None:
+        self.paths = state["paths"]
+        self.failed = set(state["failed"])
+        self.finished = set(state["finished"])
+        self.collect_only = state["collect_only"]
+
+    def status_code(self, request: RunRequest) -> int:
+        selected = [
+            nodeid
+            for nodeid, path in self.paths.items()
+            if any(
+                selects(selection, request.cwd, path, nodeid) for selection in request.selections
+            )
+        ]
+        if not selected:
+            return pytest.ExitCode.NO_TESTS_COLLECTED
+        if self.failed.intersection(selected):
+            return pytest.ExitCode.TESTS_FAILED
+        # the session stopped before running them, such as with -x after a failure
+        # in the tests of another request
+        if not self.collect_only and not self.finished.issuperset(selected):
+            return pytest.ExitCode.INTERRUPTED
+        return pytest.ExitCode.OK
+
+
+class RunBatch:
+    """
+    The requests that run in one session. Also a pytest plugin, to know when the
+    session starts running tests.
+    """
+
+    def __init__(self, requests: Sequence[RunRequest]) -> None:
+        first = requests[0]
+        self.cwd = first.cwd
+        self.env = first.env
+        self.sys_path = first.sys_path
+        self.streaming = first.streaming
+        self.requests = list(requests)
+        # the selections of the other requests go after the args of the first
+        self.args = list(first.args)
+        for request in requests[1:]:
+            self.args += [s for s in request.selections if s not in self.args]
+        self.cancellation = RunCancellation()
+        # identical requests share a status code, different selections need telling apart
+        merged = len({tuple(request.selections) for request in requests}) > 1
+        self.outcomes = RunOutcomes() if merged else None
+        self._joinable = True
+        # output sent so far, for the requests that join the run
+        self._transcript: list[tuple[str, object]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def plugins(self) -> list[object]:
+        return [self] if self.outcomes is None else [self, self.outcomes]
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session: pytest.Session) -> None:
+        self.stop_joining()
+
+    def stop_joining(self) -> None:
+        with self._lock:
+            self._joinable = False
+            self._transcript.clear()
+
+    def join(self, request: RunRequest) -> bool:
+        with self._lock:
+            if not self._joinable or self.cancellation.cancelled:
+                return False
+            for stream, data in self._transcript:
+                if stream == "progress":
+                    assert request.send_progress is not None
+                    request.send_progress(data)  # type: ignore
+                elif request.send_output is not None:
+                    request.send_output(stream, data)  # type: ignore
+            request.batch = self
+            self.requests.append(request)
+            return True
+
+    def send_output(self, stream: str, data: str) -> None:
+        with self._lock:
+            if self._joinable:
+                self._transcript.append((stream, data))
+            for request in self.requests:
+                if request.send_output is not None and not request.done:
+                    request.send_output(stream, data)
+
+    def send_progress(self, progress: dict) -> None:
+        with self._lock:
+            if self._joinable:
+                self._transcript.append(("progress", progress))
+            for request in self.requests:
+                if request.send_progress is not None and not request.done:
+                    request.send_progress(progress)
+
+    def cancel(self, request: RunRequest) -> None:
+        """
+        Cancel the request. The run is only interrupted once all of its requests are
+        cancelled, until then the other requests keep it going.
+        """
+        with self._lock:
+            if request.done:
+                return
+            if any(not other.done and other is not request for other in self.requests):
+                request.finish(pytest.ExitCode.INTERRUPTED)
+                return
+        self.cancellation.cancel()
+
+    def finish(self, status_code: int, stdout: str = "", stderr: str = "") -> None:
+        with self._lock:
+            for request in self.requests:
+                if not request.done:
+                    request.finish(self._status_code_of(request, status_code), stdout, stderr)
+
+    def fail(self, error: str) -> None:
+        with self._lock:
+            for request in self.requests:
+                if not request.done:
+                    request.fail(error)
+
+    def _status_code_of(self, request: RunRequest, status_code: int) -> int:
+        # errors, interrupts and usage errors are the same for every request
+        if self.outcomes is None or status_code not in (
+            pytest.ExitCode.OK,
+            pytest.ExitCode.TESTS_FAILED,
+            pytest.ExitCode.NO_TESTS_COLLECTED,
+        ):
+            return status_code
+        return self.outcomes.status_code(request)
+
+
+class RunQueue:
+    """
+    Requests are queued from the connection threads and run by the main thread
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._pending: list[RunRequest] = []
+        self._current: RunBatch | None = None
+        self._closed = False
+
+    def run(
+        self, request: RunRequest, sock: socket.socket | None = None, framed: bool = True
+    ) -> int:
+        """
+        Queue the request and wait for it to run. The run is cancelled when the client
+        on sock hangs up or asks to cancel.
+        """
+        self.submit(request)
+        if sock is None:
+            return request.wait()
+        with ConnectionWatcher(sock, lambda: self.cancel(request), framed):
+            return request.wait()
+
+    def submit(self, request: RunRequest) -> None:
+        with self._condition:
+            if self._closed:
+                request.fail("The daemon is stopping\n")
+                return
+            current = self._current
+            if (
+                current is not None
+                and any(request.is_same_run(other) for other in current.requests)
+                and current.join(request)
+            ):
+                return
+            self._pending.append(request)
+            self._condition.notify()
+
+    def next_batch(self) -> RunBatch | None:
+        """
+        Wait for the next requests to run. Returns None once the queue is closed.
+        """
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                return None
+            key = self._pending[0].key
+            requests = [request for request in self._pending if request.key == key]
+            self._pending = [request for request in self._pending if request.key != key]
+            self._current = RunBatch(requests)
+            for request in requests:
+                request.batch = self._current
+            return self._current
+
+    def batch_done(self, batch: RunBatch) -> None:
+        with self._condition:
+            if self._current is batch:
+                self._current = None
+
+    def cancel(self, request: RunRequest) -> None:
+        with self._condition:
+            if request in self._pending:
+                self._pending.remove(request)
+                request.finish(pytest.ExitCode.INTERRUPTED)
+                return
+            batch = request.batch
+        if batch is not None:
+            batch.cancel(request)
+
+    def close(self) -> None:
+        """
+        Stop handing out runs. The requests that haven't started fail.
+        """
+        with self._condition:
+            self._closed = True
+            for request in self._pending:
+                request.fail("The daemon is stopping\n")
+            self._pending.clear()
+            self._condition.notify_all()
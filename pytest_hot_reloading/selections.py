@@ -0,0 +1,77 @@
+"""
+Test selections, the paths and node IDs given to pytest, such as tests/api or
+tests/test_a.py::TestA::test_b[1].
+"""
+
+import os
+from typing import Sequence
+
+# options whose value may be a path, which isn't a test selection
+PATH_VALUE_OPTIONS = frozenset(
+    {
+        "--basetemp",
+        "-c",
+        "--config-file",
+        "--confcutdir",
+        "--cov",
+        "--cov-config",
+        "--deselect",
+        "--ignore",
+        "--ignore-glob",
+        "--junitxml",
+        "--junit-xml",
+        "--log-file",
+        "-p",
+        "--rootdir",
+    }
+)
+
+
+def split_selections(cwd: str, args: Sequence[str]) -> tuple[list[str], list[str]]:
+    """
+    Split the args into the options and the test selections, such as
+    tests/test_a.py::test_b. Only existing paths count as test selections.
+    """
+    options: list[str] = []
+    selections: list[str] = []
+    for i, arg in enumerate(args):
+        if (
+            arg.startswith("-")
+            or (i > 0 and args[i - 1] in PATH_VALUE_OPTIONS)
+            or not os.path.exists(os.path.join(cwd, arg.split("::")[0]))
+        ):
+            options.append(arg)
+        else:
+            selections.append(arg)
+    return options, selections
+
+
+def absolute_selection(cwd: str, selection: str) -> str:
+    path, sep, names = selection.partition("::")
+    return os.path.abspath(os.path.join(cwd, path)) + sep + names
+
+
+def covers(broad: str, narrow: str) -> bool:
+    """
+    Whether the broad selection selects everything the narrow one does. Both are
+    absolute selections.
+    """
+    broad_path, _, broad_names = broad.partition("::")
+    narrow_path, _, narrow_names = narrow.partition("::")
+    if not broad_names:
+        return narrow_path == broad_path or narrow_path.startswith(
+            broad_path.rstrip(os.sep) + os.sep
+        )
+    # a test function selects each of its parametrizations
+    return narrow_path == broad_path and (
+        narrow_names == broad_names
+        or narrow_names.startswith((f"{broad_names}::", f"{broad_names}["))
+    )
+
+
+def selects(selection: str, cwd: str, path: str, nodeid: str) -> bool:
+    """
+    Whether the test selection, relative to cwd, selects the test at path with nodeid
+    """
+    names = nodeid.partition("::")[2]
+    return covers(absolute_selection(cwd, selection), f"{path}::{names}" if names else path)
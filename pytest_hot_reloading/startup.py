@@ -0,0 +1,101 @@
+"""
+Readiness reporting between a starting daemon and the client that spawned it.
+
+The client passes the write end of a pipe to the daemon, which reports each startup
+phase as a line of JSON and closes the pipe once it is serving. The client knows
+the moment the daemon is ready, or why it failed, without polling the connection.
+"""
+
+import json
+import os
+import select
+import subprocess
+import time
+
+# how long a daemon may take to start, no matter how slow the project is to import
+STARTUP_TIMEOUT = 300.0
+
+
+class DaemonStartupError(Exception):
+    pass
+
+
+class StartupReporter:
+    """
+    Used by the daemon to report its startup progress. Does nothing if the daemon
+    wasn't started by a client.
+    """
+
+    def __init__(self, fd: int | None) -> None:
+        self._pipe = os.fdopen(fd, "w") if fd is not None else None
+
+    def phase(self, name: str) -> None:
+        self._send({"phase": name})
+
+    def ready(self) -> None:
+        self.phase("serving")
+        self._close()
+
+    def error(self, message: str) -> None:
+        self._send({"error": message})
+        self._close()
+
+    def _send(self, event: dict) -> None:
+        if self._pipe is None:
+            return
+        try:
+            self._pipe.write(json.dumps(event) + "\n")
+            self._pipe.flush()
+        except OSError:
+            # the client gave up waiting
+            self._close()
+
+    def _close(self) -> None:
+        if self._pipe is not None:
+            try:
+                self._pipe.close()
+            except OSError:
+                pass
+            self._pipe = None
+
+
+def wait_for_startup(
+    read_fd: int, process: subprocess.Popen, timeout: float = STARTUP_TIMEOUT
+) -> float:
+    """
+    Wait until the daemon reports it is serving, printing each phase as it happens.
+    Returns how long the daemon took to be ready.
+    """
+    start = time.monotonic()
+    phase = "loading"
+    with os.fdopen(read_fd, "rb") as pipe:
+        while True:
+            elapsed = time.monotonic() - start
+            if elapsed >= timeout:
+                raise DaemonStartupError(
+                    f"Daemon was still {phase} after {timeout:.0f} seconds, giving up"
+                )
+            readable, _, _ = select.select([pipe], [], [], timeout - elapsed)
+            if not readable:
+                continue
+            line = pipe.readline()
+            elapsed = time.monotonic() - start
+            if not line:
+                try:
+                    exit_code = process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    exit_code = None
+                raise DaemonStartupError(
+                    f"Daemon exited while {phase} after {elapsed:.3f} seconds "
+                    f"with exit code {exit_code}"
+                )
+            event = json.loads(line)
+            if "error" in event:
+                raise DaemonStartupError(
+                    f"Daemon failed to start while {phase}:\n{event['error']}"
+                )
+            phase = event["phase"]
+            if phase == "serving":
+                print(f"Daemon ready in {elapsed:.3f} seconds")
+                return elapsed
+            print(f"Daemon {phase} ({elapsed:.3f} seconds)")
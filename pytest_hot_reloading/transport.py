@@ -0,0 +1,39 @@
+"""
+Helpers for reaching the daemon, either over TCP or over a unix domain socket
+"""
+
+import hashlib
+import os
+import socket
+import tempfile
+from pathlib import Path
+
+
+def unix_socket_path(rootdir: Path | str) -> str:
+    """
+    The unix domain socket path for a project.
+
+    The path is derived from the project root so that every project gets
+    its own daemon without having to pick a port. Socket paths have a short
+    length limit, so the root is hashed instead of being used directly.
+    """
+    digest = hashlib.sha1(str(Path(rootdir).resolve()).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f".pytest_hot_reloading_{digest}.sock")
+
+
+def connect(host: str, port: int, socket_path: str | None = None) -> socket.socket:
+    """
+    Open a connection to the daemon. The unix domain socket is used if a path is given.
+    """
+    if socket_path:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # requests are small, don't hold them back waiting for more data
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        sock.connect(socket_path or (host, port))
+    except OSError:
+        sock.close()
+        raise
+    return sock
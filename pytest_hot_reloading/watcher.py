@@ -0,0 +1,512 @@
+"""
+Watching the files that jurigged reloads.
+
+jurigged's own watcher schedules a handler for each file and reloads every file on a
+timer thread of its own. One save can produce a burst of events, for example when an
+editor writes a temporary file and swaps it in, or when a formatter rewrites the file
+after it is saved. Reloads of different files can also run at the same time.
+
+This watcher uses OS events, such as inotify on Linux, and falls back to polling where
+those can't be used. Events are batched. A file is reloaded once it has had no events
+for the debounce time. The files that are due are reloaded together, one after the
+other, on a single thread. With OS events, nothing runs while no file changes.
+
+Polling scans the directories on a single thread too, within a CPU budget, so a large
+tree doesn't take minutes to sweep. Directories that changed recently are scanned
+often, the others take turns with what is left of the budget.
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+from jurigged.live import WatchOperation, default_logger  # type: ignore
+from jurigged.utils import glob_filter  # type: ignore
+from watchdog.events import (
+    EVENT_TYPE_OPENED,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileSystemEvent,
+    FileSystemEventHandler,
+)
+from watchdog.observers import Observer
+from watchdog.observers.api import BaseObserver
+
+from pytest_hot_reloading.jurigged_daemon_signalers import JuriggedDaemonSignaler
+
+# how long a file must be quiet before it is reloaded, in seconds
+DEBOUNCE = 0.05
+
+# how soon polling sees a change to a directory that changed recently, in seconds,
+# before the throttle is applied
+POLL_LATENCY = 1.0
+
+# the share of a CPU polling may use, before the throttle is applied
+POLL_BUDGET = 0.05
+
+# how long a directory is polled as often as the latency asks for after it changed,
+# in seconds
+HOT_FOR = 300.0
+
+# how many of the latest changes the detection latency is measured over
+LATENCY_SAMPLES = 1000
+
+
+class _Directory:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.handlers: list[FileSystemEventHandler] = []
+        # the inode, modification time and size of each file
+        self.files: dict[str, tuple[int, int, int]] = {}
+        self.changed_at = -math.inf
+        self.scanned_at = -math.inf
+
+
+class AdaptivePollingObserver(threading.Thread):
+    """
+    Polls the file system on a single thread, within a CPU budget. On each tick the
+    directories that changed recently are scanned, then as many of the others as the
+    budget allows, taking turns. Changes to recently changed directories are seen within
+    the latency, changes elsewhere within the time a sweep over all directories takes.
+    """
+
+    def __init__(
+        self,
+        latency: float = POLL_LATENCY,
+        budget: float = POLL_BUDGET,
+        hot_for: float = HOT_FOR,
+    ) -> None:
+        super().__init__(name="adaptive-poller", daemon=True)
+        self.latency = latency
+        self.budget = budget
+        self.hot_for = hot_for
+        self._directories: dict[str, _Directory] = {}
+        # every directory, in the order they take turns
+        self._turns: deque[_Directory] = deque()
+        self._hot: set[_Directory] = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sweep_started = time.monotonic()
+        self._swept: set[str] = set()
+        self.sweep_time: float | None = None
+        self.changes_seen = 0
+        self.detection_latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    @classmethod
+    def throttled(cls, poll_throttle: float = 1.0) -> "AdaptivePollingObserver":
+        return cls(latency=POLL_LATENCY * poll_throttle, budget=POLL_BUDGET / poll_throttle)
+
+    def schedule(self, handler: FileSystemEventHandler, path: str) -> str:
+        with self._lock:
+            directory = self._directories.get(path)
+            if directory is None:
+                directory = self._directories[path] = _Directory(path)
+                self._turns.append(directory)
+                newest = self._scan(directory, dispatch=False)
+                # a directory with files edited shortly before the daemon started
+                # is likely to be edited again
+                age = time.time() - newest
+                if age < self.hot_for:
+                    directory.changed_at = time.monotonic() - age
+                    self._hot.add(directory)
+            directory.handlers.append(handler)
+        return path
+
+    def unschedule(self, path: str) -> None:
+        with self._lock:
+            directory = self._directories.pop(path)
+            self._turns.remove(directory)
+            self._hot.discard(directory)
+            self._swept.discard(path)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def join(self, timeout: float | None = None) -> None:
+        if self.is_alive():
+            super().join(timeout)
+
+    def stats(self) -> dict:
+        """
+        The measured cost of polling
+        """
+        latencies = self.detection_latencies
+        stats = {
+            "directories": len(self._directories),
+            "hot_directories": len(self._hot),
+            "target_latency": self.latency,
+            "budget": self.budget,
+            "changes_seen": self.changes_seen,
+        }
+        # what hasn't been measured yet is left out, XML-RPC has no None
+        if self.sweep_time is not None:
+            stats["sweep_time"] = self.sweep_time
+        if latencies:
+            stats["mean_detection_latency"] = sum(latencies) / len(latencies)
+            stats["max_detection_latency"] = max(latencies)
+        return stats
+
+    def run(self) -> None:
+        self._sweep_started = time.monotonic()
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            self.tick()
+            self._stopped.wait(max(0.0, started + self.latency - time.monotonic()))
+
+    def tick(self) -> None:
+        """
+        Scan the directories that are due, within the budget of one tick
+        """
+        started = time.monotonic()
+        deadline = time.perf_counter() + self.budget * self.latency
+        with self._lock:
+            # the hot directories that waited the longest first
+            hot = sorted(self._hot, key=lambda directory: directory.scanned_at)
+            turns = len(self._turns)
+        scanned = 0
+        for directory in hot:
+            if started - directory.changed_at > self.hot_for:
+                with self._lock:
+                    self._hot.discard(directory)
+                continue
+            if scanned and time.perf_counter() >= deadline:
+                break
+            self._scan(directory)
+            scanned += 1
+        # the others take turns with what is left, but always make some progress
+        for _ in range(turns):
+            if scanned and time.perf_counter() >= deadline:
+                break
+            with self._lock:
+                directory = self._turns[0]
+                self._turns.rotate(-1)
+            self._scan(directory)
+            scanned += 1
+            self._swept.add(directory.path)
+            if len(self._swept) >= len(self._directories):
+                now = time.monotonic()
+                first = self.sweep_time is None
+                self.sweep_time = now - self._sweep_started
+                self._sweep_started = now
+                self._swept.clear()
+                if first:
+                    _log(
+                        f"Pytest Daemon: Polling {len(self._directories)} directories,"
+                        f" a sweep takes {self.sweep_time:.2f} seconds"
+                    )
+
+    def _scan(self, directory: _Directory, dispatch: bool = True) -> float:
+        """
+        Compare the files of the directory to the last scan. Returns the newest
+        modification time.
+        """
+        files: dict[str, tuple[int, int, int]] = {}
+        try:
+            with os.scandir(directory.path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            files[entry.path] = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        # removed while it was listed
+                        pass
+        except OSError:
+            pass
+        directory.scanned_at = time.monotonic()
+        previous, directory.files = directory.files, files
+        newest = max((mtime for _, mtime, _ in files.values()), default=0) / 1e9
+        if not dispatch or previous == files:
+            return newest
+        events: list[FileSystemEvent] = [
+            FileDeletedEvent(path) for path in previous.keys() - files.keys()
+        ]
+        for path, state in files.items():
+            if path not in previous:
+                events.append(FileCreatedEvent(path))
+            elif previous[path] != state:
+                events.append(FileModifiedEvent(path))
+        directory.changed_at = directory.scanned_at
+        with self._lock:
+            self._hot.add(directory)
+        written = [files[e.src_path][1] for e in events if e.src_path in files]
+        if written:
+            # how long ago the file was written is how long it took to see it
+            self._seen(time.time() - max(written) / 1e9)
+        for event in events:
+            for handler in directory.handlers:
+                handler.dispatch(event)
+        return newest
+
+    def _seen(self, latency: float) -> None:
+        self.changes_seen += 1
+        self.detection_latencies.append(latency)
+        message = f"Pytest Daemon: Polling saw a change after {latency:.2f} seconds"
+        if self.sweep_time is not None:
+            message += (
+                f", a sweep of {len(self._directories)} directories takes"
+                f" {self.sweep_time:.2f} seconds"
+            )
+        _log(message)
+
+
+class ReloadBatcher:
+    """
+    Collects the files that changed and hands them to reload in batches, once each
+    has been quiet for the debounce time
+    """
+
+    def __init__(self, reload: Callable[[list[str]], None], debounce: float = DEBOUNCE) -> None:
+        self._reload = reload
+        self._debounce = debounce
+        # the time of the last event of each changed file
+        self._pending: dict[str, float] = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="reload-batcher", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def join(self) -> None:
+        self._thread.join()
+
+    def add(self, filename: str) -> None:
+        with self._condition:
+            self._pending[filename] = time.monotonic()
+            self._condition.notify()
+
+    def _next_batch(self) -> list[str] | None:
+        with self._condition:
+            while not self._stopped:
+                if not self._pending:
+                    self._condition.wait()
+                    continue
+                now = time.monotonic()
+                due = [f for f, last in self._pending.items() if now - last >= self._debounce]
+                if due:
+                    for filename in due:
+                        del self._pending[filename]
+                    return sorted(due)
+                # until the file that has been quiet the longest is due
+                self._condition.wait(min(self._pending.values()) + self._debounce - now)
+            return None
+
+    def _run(self) -> None:
+        while (batch := self._next_batch()) is not None:
+            self._reload(batch)
+
+
+# "closed_no_write" is only sent by watchdog 5 and later
+_READ_EVENTS = (EVENT_TYPE_OPENED, "closed_no_write")
+
+
+class _DirectoryHandler(FileSystemEventHandler):
+    def __init__(self, watcher: "BatchingWatcher") -> None:
+        self._watcher = watcher
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        # reading a file doesn't change it
+        if event.is_directory or event.event_type in _READ_EVENTS:
+            return
+        # the destination of a move is how saving through a temporary file looks
+        for path in (event.src_path, getattr(event, "dest_path", "")):
+            if path:
+                self._watcher.changed(os.fsdecode(path))
+
+
+class BatchingWatcher:
+    """
+    Watches the files jurigged prepares and reloads them in batches. A replacement
+    for jurigged's Watcher, with the same start, stop and join.
+    """
+
+    def __init__(
+        self,
+        registry,
+        use_os_events: bool = True,
+        poll_throttle: float = 1.0,
+        debounce: float = DEBOUNCE,
+        signaler: JuriggedDaemonSignaler | None = None,
+    ) -> None:
+        self.registry = registry
+        # told about the changes until they are reloaded, so runs can wait for them
+        self.signaler = signaler or JuriggedDaemonSignaler()
+        self._poll_throttle = poll_throttle
+        # the normalized path of each watched file, to the name jurigged knows it by
+        self._files: dict[str, str] = {}
+        # the state of each file when it was last reloaded
+        self._stats: dict[str, tuple[int, int]] = {}
+        self._directories: set[str] = set()
+        # what the observer returned when each directory was scheduled, to unschedule it
+        self._watches: dict[str, object] = {}
+        # the files that are no longer watched, until they are watched again
+        self._unwatched: dict[str, str] = {}
+        self._handler = _DirectoryHandler(self)
+        self._lock = threading.Lock()
+        self._started = False
+        self.observer: BaseObserver | AdaptivePollingObserver = (
+            Observer() if use_os_events else self._polling_observer()
+        )
+        self.batcher = ReloadBatcher(self._reload, debounce)
+        registry.precache_activity.register(self.on_prepare)
+
+    @property
+    def polling(self) -> bool:
+        return isinstance(self.observer, AdaptivePollingObserver)
+
+    def on_prepare(self, module_name: str, filename: str) -> None:
+        normalized = os.path.normpath(filename)
+        with self._lock:
+            if normalized in self._files:
+                return
+            self._files[normalized] = filename
+            self._stats[normalized] = _stat(normalized)
+            # the directory is watched, since editors that save through a temporary
+            # file replace the file itself
+            directory = os.path.dirname(normalized)
+            if directory not in self._directories:
+                self._directories.add(directory)
+                self._schedule(directory)
+        self.registry.log(WatchOperation(filename))
+
+    def unwatch(self, matches: Callable[[str], bool]) -> None:
+        """
+        Stop watching the files that match, such as those of a project the daemon
+        evicted. The directories that have no other watched files are no longer
+        watched either.
+        """
+        with self._lock:
+            for normalized, filename in list(self._files.items()):
+                if matches(filename):
+                    self._unwatched[normalized] = self._files.pop(normalized)
+            in_use = {os.path.dirname(normalized) for normalized in self._files}
+            for directory in self._directories - in_use:
+                self._directories.discard(directory)
+                self.observer.unschedule(self._watches.pop(directory))  # type: ignore
+
+    def watch_again(self, matches: Callable[[str], bool]) -> None:
+        """
+        Watch the files that match again, after unwatch. The ones that changed in the
+        meantime are reloaded.
+        """
+        changed: list[str] = []
+        with self._lock:
+            for normalized, filename in list(self._unwatched.items()):
+                if not matches(filename):
+                    continue
+                self._files[normalized] = self._unwatched.pop(normalized)
+                directory = os.path.dirname(normalized)
+                if directory not in self._directories:
+                    self._directories.add(directory)
+                    self._schedule(directory)
+                if _stat(normalized) != self._stats.get(normalized):
+                    changed.append(normalized)
+        for normalized in changed:
+            self.changed(normalized)
+
+    def changed(self, path: str) -> None:
+        normalized = os.path.normpath(path)
+        if normalized in self._files:
+            self.signaler.file_changed(normalized)
+            self.batcher.add(normalized)
+
+    def start(self) -> None:
+        with self._lock:
+            self._started = True
+            try:
+                self.observer.start()
+            except OSError as exc:
+                self._fall_back_to_polling(exc)
+        self.batcher.start()
+
+    def stop(self) -> None:
+        self.observer.stop()
+        self.batcher.stop()
+
+    def join(self) -> None:
+        self.observer.join()
+        self.batcher.join()
+
+    def _schedule(self, directory: str) -> None:
+        try:
+            self._watches[directory] = self.observer.schedule(self._handler, directory)
+        except OSError as exc:
+            # such as running out of inotify watches
+            self._fall_back_to_polling(exc)
+
+    def _fall_back_to_polling(self, exc: OSError) -> None:
+        if self.polling:
+            raise exc
+        _log(f"Pytest Daemon: Polling for file changes, OS events can't be used: {exc}")
+        if self._started:
+            self.observer.stop()
+        self.observer = self._polling_observer()
+        for directory in self._directories:
+            self._watches[directory] = self.observer.schedule(self._handler, directory)
+        if self._started:
+            self.observer.start()
+
+    def _polling_observer(self) -> AdaptivePollingObserver:
+        return AdaptivePollingObserver.throttled(self._poll_throttle)
+
+    def _reload(self, batch: list[str]) -> None:
+        for normalized in batch:
+            # the changes seen so far were written before the file is read below
+            changes = self.signaler.reloading(normalized)
+            try:
+                self._reload_file(normalized)
+            finally:
+                self.signaler.reloaded(normalized, changes)
+
+    def _reload_file(self, normalized: str) -> None:
+        stat = _stat(normalized)
+        # an event can come without the file changing, such as a second one for
+        # the same write
+        if stat == self._stats.get(normalized):
+            return
+        self._stats[normalized] = stat
+        try:
+            self.registry.get(self._files[normalized]).refresh()
+        except Exception as exc:
+            self.registry.log(exc)
+
+
+def _log(message: str) -> None:
+    # the watcher runs alongside the tests, whose output may be redirected to a client
+    print(message, file=sys.__stdout__, flush=True)
+
+
+def _stat(path: str) -> tuple[int, int]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (0, 0)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def watch(
+    pattern,
+    registry,
+    use_os_events: bool = True,
+    poll_throttle: float = 1.0,
+    signaler: JuriggedDaemonSignaler | None = None,
+):
+    """
+    Like jurigged.watch, with the BatchingWatcher
+    """
+    registry.auto_register(filter=glob_filter(pattern) if isinstance(pattern, str) else pattern)
+    registry.set_logger(default_logger)
+    watcher = BatchingWatcher(registry, use_os_events, poll_throttle, signaler=signaler)
+    watcher.start()
+    return watcher
@@ -0,0 +1,194 @@
+"""
+Parallel test execution inside the daemon.
+
+The daemon forks workers after collection, so every worker starts out with the
+modules already imported and the tests already collected. Workers send their
+test reports back to the daemon, which replays them through its own hooks. The
+client sees a single run, the same as if the tests had run serially.
+"""
+
+import json
+import os
+import selectors
+import signal
+import sys
+from typing import IO, Sequence
+
+import pytest
+
+
+def distribute(items: Sequence[pytest.Item], workers: int) -> list[list[pytest.Item]]:
+    """
+    Split the items between the workers. Tests from the same module stay on the same
+    worker so that module and class scoped fixtures are only set up once.
+    """
+    modules: dict[str, list[pytest.Item]] = {}
+    for item in items:
+        modules.setdefault(item.nodeid.split("::")[0], []).append(item)
+    chunks: list[list[pytest.Item]] = [[] for _ in range(workers)]
+    for module_items in sorted(modules.values(), key=len, reverse=True):
+        min(chunks, key=len).extend(module_items)
+    return [chunk for chunk in chunks if chunk]
+
+
+class WorkerReporter:
+    """
+    Pytest plugin that runs in a worker and sends its reports to the daemon
+    """
+
+    def __init__(self, config: pytest.Config, pipe: IO[str]) -> None:
+        self._config = config
+        self._pipe = pipe
+
+    def _send(self, event: dict) -> None:
+        self._pipe.write(json.dumps(event) + "\n")
+        self._pipe.flush()
+
+    def pytest_runtest_logstart(self, nodeid: str, location: tuple) -> None:
+        self._send({"event": "logstart", "nodeid": nodeid, "location": location})
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        config = self._config
+        data = config.hook.pytest_report_to_serializable(config=config, report=report)
+        self._send({"event": "logreport", "report": data})
+
+    def pytest_runtest_logfinish(self, nodeid: str, location: tuple) -> None:
+        self._send({"event": "logfinish", "nodeid": nodeid, "location": location})
+
+
+class ForkedWorkers:
+    """
+    Pytest plugin that runs the tests in forked workers when --daemon-workers is
+    more than 1. Otherwise, the tests run as usual.
+
+    Plugins that talk to the client are only used by the daemon. Workers don't
+    have them, or the terminal reporter, since the daemon replays the reports.
+    """
+
+    def __init__(self, daemon_only_plugins: Sequence[object] = ()) -> None:
+        self._daemon_only_plugins = daemon_only_plugins
+
+    def pytest_runtestloop(self, session: pytest.Session) -> bool | None:
+        workers = getattr(session.config.option, "daemon_workers", 0)
+        if workers <= 1 or len(session.items) <= 1 or not hasattr(os, "fork"):
+            return None
+        if session.testsfailed and not session.config.option.continue_on_collection_errors:
+            # let the default run loop report the collection errors
+            return None
+        if session.config.option.collectonly:
+            return True
+
+        reporter = session.config.pluginmanager.get_plugin("terminalreporter")
+        if reporter is not None:
+            # results from the workers are interleaved, so don't group them by file
+            reporter.showfspath = False
+
+        pids: list[int] = []
+        selector = selectors.DefaultSelector()
+        for chunk in distribute(session.items, workers):
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                selector.close()
+                self._run_worker(session, chunk, write_fd)
+            os.close(write_fd)
+            pids.append(pid)
+            selector.register(read_fd, selectors.EVENT_READ, bytearray())
+
+        stopped = True
+        try:
+            self._replay_reports(session, selector)
+            stopped = bool(session.shouldfail or session.shouldstop)
+        finally:
+            for key in list(selector.get_map().values()):
+                os.close(key.fd)
+            selector.close()
+            failed_workers = self._wait_for_workers(pids, stop=stopped)
+        if failed_workers:
+            raise session.Failed(f"{failed_workers} daemon worker(s) exited unexpectedly")
+        if session.shouldfail:
+            raise session.Failed(session.shouldfail)
+        if session.shouldstop:
+            raise session.Interrupted(session.shouldstop)
+        return True
+
+    def _run_worker(
+        self, session: pytest.Session, items: list[pytest.Item], pipe_fd: int
+    ) -> None:
+        """
+        Run the items in the worker and exit. This never returns.
+        """
+        import _pytest.main
+
+        status = 0
+        # the worker is interrupted when the run stops early, so it tears down its fixtures
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        try:
+            config = session.config
+            # nothing in the worker may write to the client
+            sys.stdout = sys.stderr = open(os.devnull, "w")
+            for plugin in self._daemon_only_plugins:
+                config.pluginmanager.unregister(plugin)
+            if config.pluginmanager.has_plugin("terminalreporter"):
+                config.pluginmanager.unregister(name="terminalreporter")
+            config.pluginmanager.register(WorkerReporter(config, os.fdopen(pipe_fd, "w")))
+
+            session.items = items
+            _pytest.main.pytest_runtestloop(session)
+        except (session.Failed, session.Interrupted):
+            pass
+        except KeyboardInterrupt:
+            try:
+                session._setupstate.teardown_exact(None)
+            except BaseException:
+                status = 1
+        except BaseException:
+            status = 1
+        # skip the daemon's cleanup, it belongs to the parent
+        os._exit(status)
+
+    def _replay_reports(self, session: pytest.Session, selector: selectors.BaseSelector) -> None:
+        config = session.config
+        while selector.get_map():
+            for key, _ in selector.select():
+                data = os.read(key.fd, 65536)
+                if not data:
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+                    continue
+                buffer: bytearray = key.data
+                buffer += data
+                *lines, rest = buffer.split(b"\n")
+                buffer[:] = rest
+                for line in lines:
+                    event = json.loads(line)
+                    if event["event"] == "logstart":
+                        config.hook.pytest_runtest_logstart(
+                            nodeid=event["nodeid"], location=tuple(event["location"])
+                        )
+                    elif event["event"] == "logreport":
+                        report = config.hook.pytest_report_from_serializable(
+                            config=config, data=event["report"]
+                        )
+                        config.hook.pytest_runtest_logreport(report=report)
+                    elif event["event"] == "logfinish":
+                        config.hook.pytest_runtest_logfinish(
+                            nodeid=event["nodeid"], location=tuple(event["location"])
+                        )
+            if session.shouldfail or session.shouldstop:
+                return
+
+    def _wait_for_workers(self, pids: list[int], stop: bool) -> int:
+        """
+        Reap the workers, stopping them first if the run was cut short.
+        Returns how many of them failed.
+        """
+        failed = 0
+        for pid in pids:
+            if stop:
+                os.kill(pid, signal.SIGINT)
+            _, status = os.waitpid(pid, 0)
+            if not stop and os.waitstatus_to_exitcode(status) != 0:
+                failed += 1
+        return failed
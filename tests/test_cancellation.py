@@ -0,0 +1,71 @@
+import io
+import signal
+import socket
+import threading
+import time
+
+import pytest
+
+from pytest_hot_reloading.cancellation import ConnectionWatcher, RunCancellation
+from pytest_hot_reloading.daemon import PytestDaemon
+from pytest_hot_reloading.jurigged_daemon_signalers import JuriggedDaemonSignaler
+from pytest_hot_reloading.protocol import MessageType, send_message
+
+
+def _later(action) -> None:
+    threading.Timer(0.2, action).start()
+
+
+class SlowDaemon(PytestDaemon):
+    def _run_pytest_in_process(self, cwd, env, sys_path, args, stdout, stderr, plugins=None):
+        time.sleep(10)
+        return 0
+
+
+class TestRunCancellation:
+    def test_cancel_message_interrupts_the_run(self) -> None:
+        client_sock, daemon_sock = socket.socketpair()
+        _later(lambda: send_message(client_sock, MessageType.CANCEL))
+        start = time.monotonic()
+
+        with pytest.raises(KeyboardInterrupt):
+            with RunCancellation() as cancellation:
+                with ConnectionWatcher(daemon_sock, cancellation.cancel):
+                    time.sleep(10)
+
+        assert cancellation.cancelled
+        assert time.monotonic() - start < 5
+        client_sock.close()
+        daemon_sock.close()
+
+    def test_client_hanging_up_interrupts_the_run(self) -> None:
+        client_sock, daemon_sock = socket.socketpair()
+        _later(client_sock.close)
+
+        with pytest.raises(KeyboardInterrupt):
+            with RunCancellation() as cancellation:
+                with ConnectionWatcher(daemon_sock, cancellation.cancel, framed=False):
+                    time.sleep(10)
+
+        daemon_sock.close()
+
+    def test_cancelling_after_the_run_does_nothing(self) -> None:
+        handler = signal.getsignal(signal.SIGINT)
+
+        with RunCancellation() as cancellation:
+            pass
+        cancellation.cancel()
+
+        assert not cancellation.cancelled
+        assert signal.getsignal(signal.SIGINT) == handler
+
+    def test_daemon_returns_interrupted(self) -> None:
+        daemon = SlowDaemon(JuriggedDaemonSignaler())
+        cancellation = RunCancellation()
+        _later(cancellation.cancel)
+
+        status_code = daemon._run_pytest(
+            "", {}, [], [], io.StringIO(), io.StringIO(), cancellation=cancellation
+        )
+
+        assert status_code == pytest.ExitCode.INTERRUPTED
@@ -1,13 +1,29 @@
+import http.client
+import io
+import json
 import os
 import re
 import socket
+import sys
 import xmlrpc.client
 from pathlib import Path
 
 import pytest
 from megamock import Mega, MegaMock, MegaPatch
 
-from pytest_hot_reloading.client import PytestClient
+from pytest_hot_reloading.client import PytestClient, show_progress_in_title
+from pytest_hot_reloading.environment import baseline_path, fingerprint, write_baseline
+
+# defines subclasses of the http.client classes, which must happen before they're patched
+from pytest_hot_reloading.http_transport import UnixStreamHTTPConnection  # noqa: F401
+from pytest_hot_reloading.protocol import (
+    VERSION,
+    MessageType,
+    recv_message,
+    send_json,
+    send_message,
+)
+from pytest_hot_reloading.remote import PathMap, sign
 
 
 class TestPytestClient:
@@ -18,7 +34,29 @@ class TestPytestClient:
         ).megainstance
 
     def test_run(self, capsys: pytest.CaptureFixture) -> None:
-        MegaPatch.it(PytestClient._start_daemon_if_needed)
+        MegaPatch.it(PytestClient.is_daemon_running, return_value=True)
+        client_sock, daemon_sock = socket.socketpair()
+        # the daemon's replies are queued up front
+        send_json(daemon_sock, MessageType.HELLO, {"version": VERSION, "pid": 1})
+        send_message(daemon_sock, MessageType.STDOUT, b"stdout")
+        send_message(daemon_sock, MessageType.STDERR, b"stderr")
+        send_json(daemon_sock, MessageType.RESULT, {"status_code": 1})
+        client = PytestClient()
+        client._socket = client_sock
+        args = ["foo", "bar"]
+
+        status_code = client.run(Path(os.getcwd()), args)
+
+        out, err = capsys.readouterr()
+
+        assert re.match(r"Daemon took \S+ seconds to reply\nstdout\n", out)
+        assert err == "stderr\n"
+        assert status_code == 1
+        daemon_sock.close()
+        client.abort()
+
+    def test_run_xmlrpc(self, capsys: pytest.CaptureFixture) -> None:
+        MegaPatch.it(PytestClient.is_daemon_running, return_value=True)
         self._server_proxy_mock.run_pytest = MegaMock(
             return_value={
                 "stdout": xmlrpc.client.Binary("stdout".encode("utf-8")),
@@ -26,7 +64,7 @@ class TestPytestClient:
                 "status_code": 1,
             }
         )
-        client = PytestClient()
+        client = PytestClient(protocol="xmlrpc")
         args = ["foo", "bar"]
 
         status_code = client.run(Path(os.getcwd()), args)
@@ -37,9 +75,122 @@ class TestPytestClient:
         assert err == "stderr\n"
         assert status_code == 1
 
+    def test_run_streaming(self, capsys: pytest.CaptureFixture) -> None:
+        MegaPatch.it(PytestClient.is_daemon_running, return_value=True)
+        events = [
+            {"stream": "stdout", "data": "std"},
+            {"progress": {"completed": 1, "total": 1, "nodeid": "test_foo"}},
+            {"stream": "stdout", "data": "out\n"},
+            {"stream": "stderr", "data": "stderr\n"},
+            {"status_code": 1},
+        ]
+        connection = MegaPatch.it(http.client.HTTPConnection, spec_set=False).megainstance
+        response = io.BytesIO(b"".join(json.dumps(e).encode() + b"\n" for e in events))
+        response.status = 200  # type: ignore
+        connection.getresponse = MegaMock(return_value=response)
+        progress: list[dict] = []
+        client = PytestClient(stream_output=True, on_progress=progress.append, protocol="xmlrpc")
+
+        status_code = client.run(Path(os.getcwd()), ["foo"])
+
+        out, err = capsys.readouterr()
+
+        assert re.match(r"stdout\nDaemon took \S+ seconds to finish\n", out)
+        assert err == "stderr\n"
+        assert progress == [{"completed": 1, "total": 1, "nodeid": "test_foo"}]
+        assert status_code == 1
+
+    def test_run_framed(self, capsys: pytest.CaptureFixture) -> None:
+        MegaPatch.it(PytestClient.is_daemon_running, return_value=True)
+        client_sock, daemon_sock = socket.socketpair()
+        # the daemon's replies are queued up front
+        send_json(daemon_sock, MessageType.HELLO, {"version": VERSION, "pid": 1})
+        send_message(daemon_sock, MessageType.STDOUT, b"std")
+        send_json(daemon_sock, MessageType.PROGRESS, {"completed": 1, "total": 1})
+        send_message(daemon_sock, MessageType.STDOUT, b"out")
+        send_message(daemon_sock, MessageType.STDERR, b"stderr")
+        send_json(daemon_sock, MessageType.RESULT, {"status_code": 1})
+        progress: list[dict] = []
+        client = PytestClient(on_progress=progress.append)
+        client._socket = client_sock
+
+        status_code = client.run(Path(os.getcwd()), ["foo"])
+
+        out, err = capsys.readouterr()
+
+        assert re.match(r"Daemon took \S+ seconds to reply\nstdout\n", out)
+        assert err == "stderr\n"
+        assert progress == [{"completed": 1, "total": 1}]
+        assert status_code == 1
+        assert recv_message(daemon_sock)[0] == MessageType.HELLO
+        message_type, payload = recv_message(daemon_sock)
+        assert message_type == MessageType.RUN
+        assert json.loads(payload)["args"] == ["foo"]
+        daemon_sock.close()
+        client.abort()
+
+    def test_run_request_sends_changes_to_the_baseline(self, tmp_path: Path) -> None:
+        socket_path = str(tmp_path / "daemon.sock")
+        env = os.environ.copy()
+        env["PHR_DAEMON_ONLY"] = "1"
+        env.pop("PATH", None)
+        write_baseline(baseline_path(0, socket_path), env, sys.path)
+        client = PytestClient(socket_path=socket_path)
+
+        request = client._run_request(Path(os.getcwd()), ["foo"])
+
+        assert request["env_base"] == fingerprint(env, sys.path)
+        assert request["env_set"] == {"PATH": os.environ["PATH"]}
+        assert request["env_unset"] == ["PHR_DAEMON_ONLY"]
+        assert request["sys_path"] is None
+
+    def test_run_request_without_baseline_sends_everything(self, tmp_path: Path) -> None:
+        client = PytestClient(socket_path=str(tmp_path / "daemon.sock"))
+
+        request = client._run_request(Path(os.getcwd()), ["foo"])
+
+        assert request["env_base"] is None
+        assert request["env_set"] == os.environ
+        assert request["sys_path"] == sys.path
+
+    def test_remote_run_request_maps_paths_and_keeps_the_daemon_environment(self) -> None:
+        client = PytestClient(
+            daemon_host="devcontainer",
+            path_map=PathMap.parse("/home/me/project=/workspace"),
+        )
+
+        request = client._run_request(
+            Path("/home/me/project/pkg"), ["/home/me/project/tests/test_a.py::test_a", "-x"]
+        )
+
+        assert request["cwd"] == "/workspace/pkg"
+        assert request["args"] == ["/workspace/tests/test_a.py::test_a", "-x"]
+        assert request["env_set"] is None
+        assert request["sys_path"] is None
+
+    def test_run_framed_answers_the_daemon_challenge(self) -> None:
+        MegaPatch.it(PytestClient.is_daemon_running, return_value=True)
+        client_sock, daemon_sock = socket.socketpair()
+        send_json(daemon_sock, MessageType.HELLO, {"version": VERSION, "challenge": "abc"})
+        send_message(daemon_sock, MessageType.STDOUT, b"/workspace/tests/test_a.py")
+        send_json(daemon_sock, MessageType.RESULT, {"status_code": 0})
+        client = PytestClient(
+            stream_output=True, secret="s3cret", path_map=PathMap.parse("/project=/workspace")
+        )
+        client._socket = client_sock
+
+        client.run(Path("/project"), [])
+
+        assert recv_message(daemon_sock)[0] == MessageType.HELLO
+        message_type, payload = recv_message(daemon_sock)
+        assert message_type == MessageType.AUTH
+        assert json.loads(payload)["signature"] == sign("s3cret", "abc")
+        daemon_sock.close()
+        client.abort()
+
     def test_when_sever_not_avaiable_then_raises_error(self) -> None:
         client = PytestClient(start_daemon_if_needed=False)
-        MegaPatch.it(PytestClient._daemon_running, return_value=False)
+        MegaPatch.it(PytestClient.is_daemon_running, return_value=False)
 
         with pytest.raises(Exception) as exc:
             client.run(Path(), ["args"])
@@ -60,3 +211,9 @@ class TestPytestClient:
 
     def test_aborting_the_socket_without_starting_should_not_error(self) -> None:
         PytestClient().abort()
+
+
+def test_progress_is_shown_in_the_terminal_title(capsys: pytest.CaptureFixture) -> None:
+    show_progress_in_title({"completed": 3, "total": 10, "nodeid": "test_foo"})
+
+    assert capsys.readouterr().out == "\x1b]2;pytest 3/10\x07"
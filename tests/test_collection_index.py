@@ -0,0 +1,74 @@
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from pytest_hot_reloading.collection_index import CollectionIndex, CollectionRecorder
+
+
+class FakeCache(dict):
+    def set(self, key: str, value: object) -> None:
+        self[key] = value
+
+
+@pytest.fixture
+def project(tmp_path: Path) -> Path:
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_a.py").touch()
+    (tmp_path / "pytest.ini").touch()
+    return tmp_path
+
+
+@pytest.fixture
+def config(project: Path) -> SimpleNamespace:
+    return SimpleNamespace(cache=FakeCache(), inipath=project / "pytest.ini")
+
+
+@pytest.fixture
+def recorder(project: Path) -> CollectionRecorder:
+    recorder = CollectionRecorder()
+    recorder.directories = [str(project / "tests")]
+    recorder.modules = [str(project / "tests" / "test_a.py")]
+    return recorder
+
+
+class TestCollectionIndex:
+    def test_recorded_modules_are_used_while_nothing_changed(
+        self, project: Path, config: SimpleNamespace, recorder: CollectionRecorder
+    ) -> None:
+        index = CollectionIndex(config, "digest")  # type: ignore
+        index.record([str(project / "tests")], ["-q"], recorder)
+
+        restarted = CollectionIndex(config, "digest")  # type: ignore
+
+        assert restarted.modules([str(project / "tests")], ["-q"]) == recorder.modules
+        assert restarted.modules([str(project / "tests")], ["-v"]) is None
+        other_venv = CollectionIndex(config, "other venv")  # type: ignore
+        assert other_venv.modules([str(project / "tests")], ["-q"]) is None
+
+    @pytest.mark.parametrize("changed", ["tests/test_b.py", "tests/conftest.py", "pytest.ini"])
+    def test_adding_modules_or_changing_the_configuration_invalidates(
+        self, project: Path, config: SimpleNamespace, recorder: CollectionRecorder, changed: str
+    ) -> None:
+        index = CollectionIndex(config, "digest")  # type: ignore
+        index.record([str(project / "tests")], [], recorder)
+
+        path = project / changed
+        path.touch()
+        # mtimes can be coarse, make sure this one differs
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        os.utime(path.parent, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        assert index.modules([str(project / "tests")], []) is None
+
+    def test_test_selections_are_not_indexed(
+        self, project: Path, config: SimpleNamespace, recorder: CollectionRecorder
+    ) -> None:
+        index = CollectionIndex(config, "digest")  # type: ignore
+        selection = f"{project / 'tests' / 'test_a.py'}::test_one"
+        index.record([selection], [], recorder)
+
+        assert not config.cache
+        assert index.modules([selection], []) is None
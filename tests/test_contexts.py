@@ -0,0 +1,253 @@
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import cast
+
+import pytest
+from megamock import MegaPatch
+
+from pytest_hot_reloading import contexts
+from pytest_hot_reloading.contexts import (
+    CachedCollection,
+    CollectionCache,
+    ContextRegistry,
+    ModuleCache,
+    RunContext,
+    context_key,
+    estimate_size,
+)
+from pytest_hot_reloading.jurigged_daemon_signalers import (
+    CacheInvalidation,
+    JuriggedDaemonSignaler,
+)
+
+
+def _item(path: str, fixtures: list[str], name: str = "test") -> pytest.Item:
+    item = SimpleNamespace(
+        path=Path(path),
+        nodeid=f"{Path(path).name}::{name}",
+        _fixtureinfo=SimpleNamespace(names_closure=fixtures),
+    )
+    return cast(pytest.Item, item)
+
+
+def test_contexts_are_keyed_by_rootdir_and_sys_path() -> None:
+    registry = ContextRegistry()
+
+    project_a = registry.get(context_key("/repo/a", ["/repo/a"]))
+    project_b = registry.get(context_key("/repo/b", ["/repo/b"]))
+    other_venv = registry.get(context_key("/repo/a", ["/repo/a", "/venv2"]))
+
+    assert registry.get(context_key("/repo/a", ["/repo/a"])) is project_a
+    assert len({id(project_a), id(project_b), id(other_venv)}) == 3
+
+
+def test_new_context_callback_is_called_once() -> None:
+    registry = ContextRegistry()
+    new_contexts: list[RunContext] = []
+
+    registry.get(context_key("/repo/a", []), on_new=new_contexts.append)
+    registry.get(context_key("/repo/a", []), on_new=new_contexts.append)
+
+    assert len(new_contexts) == 1
+
+
+def test_clear_caches() -> None:
+    registry = ContextRegistry()
+    context = registry.get(context_key("/repo/a", []))
+    context.session_item_cache[("tests",)] = CachedCollection(())
+
+    registry.clear_caches()
+
+    assert not context.session_item_cache
+
+
+def test_invalidation_marks_changed_modules_and_users_of_changed_fixtures() -> None:
+    registry = ContextRegistry()
+    context = registry.get(context_key("/repo/a", []))
+    cached = CachedCollection(
+        (
+            _item("/repo/a/test_a.py", ["request"]),
+            _item("/repo/a/test_b.py", ["db", "request"]),
+            _item("/repo/a/test_c.py", ["request"]),
+            _item("/repo/a/test_d.py", []),
+        )
+    )
+    context.session_item_cache[("tests",)] = cached
+
+    registry.invalidate(
+        CacheInvalidation(False, frozenset({"/repo/a/test_a.py"}), frozenset({"db"}))
+    )
+
+    assert cached.stale_paths == {"/repo/a/test_a.py", "/repo/a/test_b.py"}
+    registry.invalidate(CacheInvalidation(True, frozenset(), frozenset()))
+    assert not context.session_item_cache
+
+
+def test_users_of_fixtures_that_request_others_have_stale_closures() -> None:
+    context = ContextRegistry().get(context_key("/repo/a", []))
+    cached = CachedCollection(
+        (_item("/repo/a/test_a.py", ["db", "request"]), _item("/repo/a/test_b.py", ["request"])),
+        ["/repo/a"],
+    )
+    context.session_item_cache[("tests",)] = cached
+
+    context.invalidate(frozenset(), frozenset(), frozenset({"db", "cache"}))
+
+    assert cached.stale_closures == {"db"}
+    assert not cached.stale_paths
+    assert not cached.covers(["/repo/a/test_b.py"], [])
+
+
+def test_narrower_selections_use_a_cached_broader_collection() -> None:
+    context = ContextRegistry().get(context_key("/repo", []))
+    items = (
+        _item("/repo/tests/api/test_x.py", [], "test_y[1]"),
+        _item("/repo/tests/api/test_x.py", [], "test_y[2]"),
+        _item("/repo/tests/api/test_x.py", [], "test_z"),
+        _item("/repo/tests/test_root.py", [], "test_root"),
+    )
+    context.session_item_cache[("tests",)] = CachedCollection(items, ["/repo/tests"], ["-q"])
+
+    selected = context.select_cached(
+        ["/repo/tests/test_root.py", "/repo/tests/api/test_x.py::test_y"], ["-q"]
+    )
+
+    assert selected == [items[3], items[0], items[1]]
+    assert context.select_cached(["/repo/tests/api"], ["-v"]) is None
+    assert context.select_cached(["/repo/tests/api/test_other.py"], ["-q"]) is None
+    assert context.select_cached(["/repo"], ["-q"]) is None
+
+
+def test_signaler_collects_the_changes_until_received() -> None:
+    signaler = JuriggedDaemonSignaler()
+    signaler.signal_changed(path="/repo/a/test_a.py")
+    signaler.signal_changed(fixture="db")
+    signaler.signal_changed(closure="user")
+
+    assert signaler.receive_invalidation() == CacheInvalidation(
+        False, frozenset({"/repo/a/test_a.py"}), frozenset({"db"}), frozenset({"user"})
+    )
+    assert signaler.receive_invalidation() is None
+
+
+def test_signaler_does_not_wait_when_nothing_is_being_reloaded() -> None:
+    signaler = JuriggedDaemonSignaler()
+    signaler.file_changed("/repo/conftest.py")
+    signaler.reloaded("/repo/conftest.py", signaler.reloading("/repo/conftest.py"))
+
+    start = time.monotonic()
+    assert signaler.receive_invalidation(timeout=5) is None
+    assert time.monotonic() - start < 1
+
+
+def test_signaler_waits_until_the_changed_files_are_reloaded() -> None:
+    signaler = JuriggedDaemonSignaler()
+    signaler.file_changed("/repo/conftest.py")
+
+    def reload() -> None:
+        time.sleep(0.1)
+        changes = signaler.reloading("/repo/conftest.py")
+        signaler.signal_changed(fixture="db")
+        signaler.reloaded("/repo/conftest.py", changes)
+
+    thread = threading.Thread(target=reload)
+    thread.start()
+    try:
+        invalidation = signaler.receive_invalidation(timeout=5)
+    finally:
+        thread.join()
+
+    assert invalidation == CacheInvalidation(False, frozenset(), frozenset({"db"}))
+
+
+def test_signaler_keeps_waiting_for_changes_seen_during_a_reload(
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    signaler = JuriggedDaemonSignaler()
+    signaler.file_changed("/repo/conftest.py")
+    changes = signaler.reloading("/repo/conftest.py")
+    # written after the reload read the file
+    signaler.file_changed("/repo/conftest.py")
+    signaler.reloaded("/repo/conftest.py", changes)
+
+    signaler.receive_invalidation(timeout=0)
+
+    assert "before the reload of /repo/conftest.py finished" in capsys.readouterr().out
+
+
+def test_least_recently_used_contexts_are_evicted_over_budget() -> None:
+    registry = ContextRegistry(memory_budget_mb=150)
+    oldest = registry.get(context_key("/repo/a", []))
+    older = registry.get(context_key("/repo/b", []))
+    current = registry.get(context_key("/repo/c", []))
+    for context, size_mb in ((oldest, 100), (older, 60), (current, 50)):
+        context.session_item_cache.size = size_mb * 1024 * 1024
+
+    evicted = registry.evict_idle(keep=current)
+
+    # the rest fits in the budget
+    assert evicted == [oldest.key]
+    assert not registry.serves("/repo/a")
+    assert registry.serves("/repo/b")
+    assert registry.evict_idle(keep=current) == []
+
+
+def test_nothing_is_evicted_without_a_budget() -> None:
+    registry = ContextRegistry()
+    registry.get(context_key("/repo/a", []))
+    current = registry.get(context_key("/repo/b", []))
+
+    assert registry.evict_idle(keep=current) == []
+
+
+def test_collection_cache_evicts_least_recently_used_over_budget() -> None:
+    small = CachedCollection((_item("/repo/test_a.py", []),))
+    size = estimate_size(small.items)
+    cache = CollectionCache(budget_bytes=size * 5 // 2)
+    cache[("a",)] = small
+    cache[("b",)] = CachedCollection((_item("/repo/test_b.py", []),))
+    cache.get(("a",))
+
+    cache[("c",)] = CachedCollection((_item("/repo/test_c.py", []),))
+
+    assert ("b",) not in cache
+    assert cache.get(("a",)) is small
+    assert cache.get(("b",)) is None
+    assert cache.stats()["evictions"] == 1
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_collection_cache_keeps_the_newest_collection_over_budget() -> None:
+    cache = CollectionCache(budget_bytes=1)
+    cache[("a",)] = CachedCollection((_item("/repo/test_a.py", []),))
+    cache[("b",)] = CachedCollection((_item("/repo/test_b.py", []),))
+
+    assert [key for key, _ in cache.items()] == [("b",)]
+
+
+def test_collection_cache_expires_unused_collections() -> None:
+    MegaPatch.it(contexts.time.monotonic).mock.side_effect = [0, 5, 5, 12, 12, 16]
+    cache = CollectionCache(ttl=10)
+    cache[("a",)] = CachedCollection(())  # at 0
+    cache[("b",)] = CachedCollection(())  # at 5
+
+    assert cache.get(("a",)) is not None  # at 5, then used at 12
+    assert len(cache) == 2  # at 12
+    assert len(cache) == 1  # at 16, b expired
+
+    assert cache.expirations == 1
+
+
+def test_module_cache_drops_changed_modules_and_users_of_changed_fixtures() -> None:
+    cache = ModuleCache()
+    cache.store("/repo/a/test_a.py", [_item("/repo/a/test_a.py", [])])
+    cache.store("/repo/a/test_b.py", [_item("/repo/a/test_b.py", ["db"])])
+    cache.store("/repo/a/test_c.py", [_item("/repo/a/test_c.py", ["request"])])
+
+    cache.invalidate({"/repo/a/test_a.py"}, {"db"})
+
+    assert cache.get("/repo/a/test_a.py") is None
+    assert cache.get("/repo/a/test_b.py") is None
+    assert cache.get("/repo/a/test_c.py") is not None
@@ -0,0 +1,241 @@
+import gc
+import io
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from pytest_hot_reloading.contexts import ContextRegistry, context_key
+from pytest_hot_reloading.daemon import (
+    PytestDaemon,
+    _collection_position,
+    _manage_prior_session_garbage,
+)
+from pytest_hot_reloading.jurigged_daemon_signalers import (
+    RELOAD_TIMEOUT,
+    JuriggedDaemonSignaler,
+)
+from pytest_hot_reloading.protocol import (
+    ConnectionClosedError,
+    MessageType,
+    recv_message,
+    send_json,
+    send_message,
+)
+
+runs_in_this_process = 0
+
+
+class LeakyDaemon(PytestDaemon):
+    def _run_pytest_in_process(self, cwd, env, sys_path, args, stdout, stderr, plugins=None):
+        global runs_in_this_process
+        runs_in_this_process += 1
+        if args == ["boom"]:
+            raise ValueError("boom")
+        stdout.write(f"runs {runs_in_this_process}")
+        return 3
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="fork is not available")
+class TestForkPerRun:
+    def test_run_does_not_leak_into_the_daemon(self) -> None:
+        daemon = LeakyDaemon(JuriggedDaemonSignaler(), fork_per_run=True)
+
+        for _ in range(2):
+            stdout = io.StringIO()
+            status_code = daemon._run_pytest("", {}, [], [], stdout, io.StringIO())
+
+            assert status_code == 3
+            assert stdout.getvalue() == "runs 1"
+        assert runs_in_this_process == 0
+
+    def test_errors_are_raised_in_the_daemon(self) -> None:
+        daemon = LeakyDaemon(JuriggedDaemonSignaler(), fork_per_run=True)
+
+        with pytest.raises(Exception, match="ValueError: boom"):
+            daemon._run_pytest("", {}, [], ["boom"], io.StringIO(), io.StringIO())
+
+
+NESTED_TEST = """
+import pytest
+
+
+def test_runs_pytest_itself(tmp_path):
+    (tmp_path / "test_inner.py").write_text("def test_inner():\\n    pass\\n")
+    args = [str(tmp_path), "-q", "-p", "no:cacheprovider", "-p", "no:django"]
+    assert pytest.main(args) == pytest.ExitCode.OK
+"""
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="fork is not available")
+def test_nested_pytest_runs_get_pytest_own_main(tmp_path: Path) -> None:
+    (tmp_path / "pytest.ini").write_text("[pytest]\n")
+    (tmp_path / "test_nested.py").write_text(NESTED_TEST)
+    # the run is forked, so the daemon's patches stay out of this session
+    daemon = PytestDaemon(JuriggedDaemonSignaler(), fork_per_run=True)
+    # this project isn't a Django project
+    args = [str(tmp_path), "-p", "pytest_hot_reloading.plugin", "-p", "no:cacheprovider"]
+    args += ["-p", "no:django"]
+    stdout = io.StringIO()
+
+    status_code = daemon._run_pytest(
+        str(tmp_path), dict(os.environ), sys.path, args, stdout, io.StringIO()
+    )
+
+    assert status_code == pytest.ExitCode.OK, stdout.getvalue()
+
+
+class ParentOnlySignaler(JuriggedDaemonSignaler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.pid = os.getpid()
+        self.received = 0
+
+    def receive_invalidation(self, timeout: float = RELOAD_TIMEOUT):
+        assert os.getpid() == self.pid, "the fork waited for the reloads"
+        self.received += 1
+        return super().receive_invalidation(timeout)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="fork is not available")
+def test_only_the_daemon_waits_for_the_reloads(tmp_path: Path) -> None:
+    (tmp_path / "pytest.ini").write_text("[pytest]\n")
+    (tmp_path / "test_a.py").write_text("def test_a():\n    pass\n")
+    signaler = ParentOnlySignaler()
+    daemon = PytestDaemon(signaler, fork_per_run=True)
+    args = [str(tmp_path), "-p", "no:cacheprovider", "-p", "no:django"]
+
+    status_code = daemon._run_pytest(
+        str(tmp_path), dict(os.environ), sys.path, args, io.StringIO(), io.StringIO()
+    )
+
+    assert status_code == pytest.ExitCode.OK
+    assert signaler.received == 1
+
+
+class WarmUpDaemon(PytestDaemon):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.runs: list[list[str]] = []
+
+    def _run_pytest_in_process(self, cwd, env, sys_path, args, stdout, stderr, plugins=None):
+        self.runs.append(args)
+        if "broken" in args:
+            raise ValueError("broken")
+        return pytest.ExitCode.OK
+
+
+class TestWarmUp:
+    def test_collects_each_argument_set_in_the_daemon(self, capsys) -> None:
+        daemon = WarmUpDaemon(
+            JuriggedDaemonSignaler(),
+            fork_per_run=True,
+            warmup=[[], ["broken"], ["tests", "-m", "slow"]],
+        )
+
+        phases: list[str] = []
+
+        daemon._warm_up(on_phase=phases.append)
+
+        assert phases == [
+            "warming up testpaths",
+            "warming up broken",
+            "warming up tests -m slow",
+        ]
+        assert daemon.runs == [
+            ["--collect-only", "-q"],
+            ["--collect-only", "-q", "broken"],
+            ["--collect-only", "-q", "tests", "-m", "slow"],
+        ]
+        out = capsys.readouterr().out
+        assert "Warm-up of broken failed" in out
+        assert "Warmed up tests -m slow in" in out
+
+
+def test_each_daemon_has_its_own_budgets() -> None:
+    daemon = PytestDaemon(JuriggedDaemonSignaler(), cache_budget_mb=5, cache_ttl=60)
+    PytestDaemon(JuriggedDaemonSignaler())
+
+    assert daemon._contexts.cache_budget_mb == 5
+    assert daemon._contexts.cache_ttl == 60
+
+
+def test_new_modules_take_their_place_in_the_collection() -> None:
+    paths = ["test_a.py", "test_a.py", "test_c.py", "unit/test_x.py"]
+    items = [SimpleNamespace(path=Path("/repo/tests", path)) for path in paths]
+
+    assert _collection_position(items, "/repo/tests/test_b.py") == 2  # type: ignore
+    assert _collection_position(items, "/repo/tests/unit/test_y.py") == 4  # type: ignore
+    assert _collection_position(items, "/repo/conftest_tests/test_z.py") == 0  # type: ignore
+
+
+class FakeSession:
+    pass
+
+
+class TestPriorSessions:
+    def test_prior_sessions_point_at_the_latest_session(self) -> None:
+        context = ContextRegistry().get(context_key("/repo", []))
+        prior, latest = FakeSession(), FakeSession()
+        context.prior_sessions.add(prior)  # type: ignore
+
+        _manage_prior_session_garbage(context, latest)  # type: ignore
+
+        assert prior.__dict__ is latest.__dict__
+
+    def test_unreferenced_sessions_are_freed(self) -> None:
+        registry = ContextRegistry()
+        context = registry.get(context_key("/repo", []))
+        kept = FakeSession()
+        context.prior_sessions.add(kept)  # type: ignore
+        context.prior_sessions.add(FakeSession())  # type: ignore
+        gc.collect()
+
+        _manage_prior_session_garbage(context, FakeSession())  # type: ignore
+
+        assert list(context.prior_sessions) == [kept]
+        stats = registry.cache_stats()[0]
+        assert stats["prior_session_count"] == 1
+        assert stats["prior_sessions_mb"] > 0
+
+
+class TestHello:
+    def _hello(self, python_version: list[int]) -> MessageType:
+        client_sock, daemon_sock = socket.socketpair()
+        hello = {"python": "a build of another day", "python_version": python_version}
+        send_json(client_sock, MessageType.HELLO, hello)
+        client_sock.shutdown(socket.SHUT_WR)
+
+        PytestDaemon(JuriggedDaemonSignaler()).handle_framed_connection(daemon_sock)
+
+        message_type, payload = recv_message(client_sock)
+        client_sock.close()
+        daemon_sock.close()
+        if message_type == MessageType.ERROR:
+            assert "Use a separate daemon" in json.loads(payload)["error"]
+        return message_type
+
+    def test_another_build_of_the_same_python_is_welcome(self) -> None:
+        assert self._hello(list(sys.version_info[:2])) == MessageType.HELLO
+
+    def test_another_python_version_is_turned_away(self) -> None:
+        assert self._hello([sys.version_info[0], sys.version_info[1] + 1]) == MessageType.ERROR
+
+
+def test_a_cancel_that_arrives_after_its_run_gets_no_reply() -> None:
+    client_sock, daemon_sock = socket.socketpair()
+    send_json(client_sock, MessageType.HELLO, {"python_version": list(sys.version_info[:2])})
+    send_message(client_sock, MessageType.CANCEL)
+    client_sock.shutdown(socket.SHUT_WR)
+
+    PytestDaemon(JuriggedDaemonSignaler()).handle_framed_connection(daemon_sock)
+    daemon_sock.close()
+
+    assert recv_message(client_sock)[0] == MessageType.HELLO
+    with pytest.raises(ConnectionClosedError):
+        recv_message(client_sock)
+    client_sock.close()
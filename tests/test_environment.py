@@ -0,0 +1,61 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from pytest_hot_reloading.environment import (
+    client_environment,
+    diff_env,
+    fingerprint,
+    read_baseline,
+    write_baseline,
+)
+
+
+def test_diff_env() -> None:
+    env_set, env_unset = diff_env({"A": "1", "B": "2", "C": "3"}, {"A": "1", "B": "x", "D": "4"})
+
+    assert env_set == {"B": "x", "D": "4"}
+    assert env_unset == ["C"]
+
+
+def test_fingerprint_ignores_key_order() -> None:
+    assert fingerprint({"A": "1", "B": "2"}, ["x"]) == fingerprint({"B": "2", "A": "1"}, ["x"])
+    assert fingerprint({"A": "1"}, ["x"]) != fingerprint({"A": "1"}, ["y"])
+
+
+def test_baseline_round_trip(tmp_path: Path) -> None:
+    path = tmp_path / "baseline.json"
+    write_baseline(path, {"A": "1"}, ["x"])
+
+    assert read_baseline(path) == {
+        "fingerprint": fingerprint({"A": "1"}, ["x"]),
+        "env": {"A": "1"},
+        "sys_path": ["x"],
+    }
+    assert path.stat().st_mode & 0o777 == 0o600
+
+
+def test_missing_baseline(tmp_path: Path) -> None:
+    assert read_baseline(tmp_path / "missing.json") is None
+
+
+def test_client_environment_is_restored_exactly(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("PHR_KEPT", "daemon")
+    monkeypatch.setenv("PHR_REMOVED", "daemon")
+    env_before = os.environ.copy()
+    sys_path_before = sys.path
+    client_env = {**env_before, "PHR_KEPT": "client", "PHR_ADDED": "client"}
+    del client_env["PHR_REMOVED"]
+
+    with client_environment(client_env, ["client"]):
+        assert os.environ["PHR_KEPT"] == "client"
+        assert os.environ["PHR_ADDED"] == "client"
+        assert "PHR_REMOVED" not in os.environ
+        assert sys.path == ["client"]
+        # a test leaking a variable
+        os.environ["PHR_LEAKED"] = "test"
+
+    assert os.environ == env_before
+    assert sys.path is sys_path_before
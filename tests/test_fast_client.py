@@ -0,0 +1,48 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from megamock import Mega, MegaPatch
+
+from pytest_hot_reloading import fast_client
+from pytest_hot_reloading.client import PytestClient
+from pytest_hot_reloading.transport import unix_socket_path
+
+
+class TestFastClient:
+    @pytest.fixture(autouse=True)
+    def setup(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        # main() points sys.path[0] at the working directory
+        monkeypatch.setattr(sys, "path", list(sys.path))
+
+    def test_finds_the_socket_of_a_parent_directory(self, tmp_path: Path) -> None:
+        socket_path = unix_socket_path(tmp_path)
+        Path(socket_path).touch()
+        try:
+            assert fast_client.find_socket(tmp_path / "tests" / "unit") == socket_path
+        finally:
+            os.unlink(socket_path)
+
+    def test_runs_on_the_daemon(self) -> None:
+        MegaPatch.it(PytestClient.is_daemon_running, return_value=True)
+        MegaPatch.it(PytestClient.run, return_value=1)
+
+        assert fast_client.main(["-x", "tests"]) == 1
+        assert sys.path[0] == os.getcwd()
+
+    def test_falls_back_to_pytest_without_a_daemon(self) -> None:
+        MegaPatch.it(PytestClient.is_daemon_running, return_value=False)
+        run_pytest = MegaPatch.it(fast_client.run_pytest, return_value=0)
+
+        assert fast_client.main(["tests"]) == 0
+        assert Mega(run_pytest.mock).called_once_with(["tests"], disable_daemon=True)
+
+    def test_options_that_need_pytest_go_to_pytest(self) -> None:
+        daemon_running = MegaPatch.it(PytestClient.is_daemon_running, return_value=True)
+        run_pytest = MegaPatch.it(fast_client.run_pytest, return_value=0)
+
+        fast_client.main(["--version"])
+
+        assert Mega(run_pytest.mock).called_once_with(["--version"], disable_daemon=False)
+        assert Mega(daemon_running.mock).not_called()
@@ -0,0 +1,37 @@
+import ast
+
+from pytest_hot_reloading.fixture_graph import FixtureGraph, fixture_requests, node_requests
+
+
+def test_define_returns_what_the_fixture_requested_before() -> None:
+    graph = FixtureGraph()
+
+    assert graph.define("/repo/conftest.py", "user", ["db"]) is None
+    assert graph.define("/repo/conftest.py", "user", ["db"]) == {"db"}
+    assert graph.define("/repo/conftest.py", "user", ["db", "tmp_path"]) == {"db"}
+    assert graph.requests("user") == {"db", "tmp_path"}
+
+
+def test_fixtures_are_tracked_across_files() -> None:
+    graph = FixtureGraph()
+    graph.define("/repo/conftest.py", "db", [])
+    graph.define("/repo/conftest.py", "user", ["db"])
+    graph.define("/repo/api/conftest.py", "user", ["settings"])
+    graph.define("/repo/api/conftest.py", "settings", [])
+
+    assert graph.requests("user") == {"db", "settings"}
+
+    graph.remove("/repo/conftest.py", "user")
+
+    assert graph.as_dict() == {"db": [], "settings": [], "user": ["settings"]}
+
+
+def test_requests_leave_out_parameters_with_defaults() -> None:
+    source = "def fixture(db, /, user, count=1, *args, client, flag=False, **kwargs):\n    pass\n"
+    namespace: dict = {}
+    exec(source, namespace)
+
+    node = ast.parse(source).body[0]
+
+    assert fixture_requests(namespace["fixture"]) == ["db", "user", "client"]
+    assert node_requests(node) == ["db", "user", "client"]  # type: ignore
@@ -0,0 +1,132 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from pytest_hot_reloading.items import clone_item, refresh_fixture_closure
+
+MODULE = """
+import pytest
+
+
+class TestMethods:
+    def test_method(self):
+        pass
+
+
+@pytest.mark.parametrize("n", [1])
+def test_function(n, request):
+    pass
+"""
+
+
+FIXTURES_MODULE = """
+import pytest
+
+
+@pytest.fixture
+def db():
+    return "db"
+
+
+@pytest.fixture
+def user():
+    return "user"
+
+
+def test_user(user):
+    pass
+"""
+
+
+class ItemCollector:
+    def __init__(self) -> None:
+        self.items: list[pytest.Item] = []
+
+    def pytest_collection_finish(self, session: pytest.Session) -> None:
+        self.items = list(session.items)
+
+
+def collect(project: Path) -> list[pytest.Item]:
+    collector = ItemCollector()
+    status_code = pytest.main(
+        [str(project), "--co", "-q", "-p", "no:cacheprovider"], plugins=[collector]
+    )
+    assert status_code == pytest.ExitCode.OK
+    return collector.items
+
+
+@pytest.fixture(scope="module")
+def items(tmp_path_factory: pytest.TempPathFactory) -> list[pytest.Item]:
+    # collected once, the test module can only be imported from one place
+    project = tmp_path_factory.mktemp("project")
+    (project / "pytest.ini").write_text("[pytest]\n")
+    (project / "test_cloned.py").write_text(MODULE)
+    return collect(project)
+
+
+def test_fixture_closure_is_computed_again(tmp_path: Path) -> None:
+    (tmp_path / "pytest.ini").write_text("[pytest]\n")
+    (tmp_path / "test_closures.py").write_text(FIXTURES_MODULE)
+    # a template, as the daemon caches it
+    item = clone_item(collect(tmp_path)[0])
+    user = item._fixtureinfo.name2fixturedefs["user"][-1].func  # type: ignore
+
+    # as jurigged reloads it
+    def requests_db(db):
+        return "user"
+
+    def requests_missing(missing):
+        return "user"
+
+    assert "db" not in item.fixturenames  # type: ignore
+    user.__code__ = requests_db.__code__
+    assert refresh_fixture_closure(item, {"user"})
+    assert "db" in item.fixturenames  # type: ignore
+    assert "db" in item._fixtureinfo.name2fixturedefs  # type: ignore
+
+    user.__code__ = requests_missing.__code__
+    assert not refresh_fixture_closure(item, {"user"})
+
+
+class TestCloneItem:
+    def test_clone_shares_what_collection_computed(self, items: list[pytest.Item]) -> None:
+        item = items[1]
+        assert isinstance(item, pytest.Function)
+
+        clone = clone_item(item)
+
+        assert clone.nodeid == item.nodeid
+        assert clone.parent is item.parent
+        assert clone.callspec is item.callspec  # type: ignore
+        assert clone._fixtureinfo is item._fixtureinfo  # type: ignore
+
+    def test_clone_has_its_own_run_state(self, items: list[pytest.Item]) -> None:
+        item = items[1]
+        item.user_properties.append(("collected", True))
+
+        clone = clone_item(item)
+        clone.add_marker("added_by_the_run")
+        clone.user_properties.append(("ran", True))
+
+        assert not list(item.iter_markers("added_by_the_run"))
+        assert item.user_properties == [("collected", True)]
+        assert clone.stash is not item.stash
+        assert clone._request._pyfuncitem is clone  # type: ignore
+        assert clone.funcargs == {}  # type: ignore
+
+    def test_methods_get_a_new_instance(self, items: list[pytest.Item]) -> None:
+        item = items[0]
+
+        clone = clone_item(item)
+
+        assert clone.obj.__self__ is not item.obj.__self__  # type: ignore
+        assert isinstance(clone.obj.__self__, type(item.obj.__self__))  # type: ignore
+
+    def test_clone_belongs_to_the_given_session(self, items: list[pytest.Item]) -> None:
+        # older versions of pytest look up the fixture manager through the session
+        session = SimpleNamespace(_fixturemanager=items[1].session._fixturemanager)
+
+        clone = clone_item(items[1], items[1].config, session)  # type: ignore
+
+        assert clone.session is session
@@ -0,0 +1,75 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+from pytest_hot_reloading.contexts import ModuleCache
+from pytest_hot_reloading.items import clone_item
+from pytest_hot_reloading.module_reuse import ModuleReuse
+
+MODULE = """
+import pytest
+
+
+class TestMethods:
+    def test_method(self):
+        pass
+
+
+@pytest.mark.parametrize("n", [1, 2])
+def test_function(n):
+    pass
+"""
+
+
+class Collection:
+    """
+    Collects with module reuse, the way the daemon does
+    """
+
+    def __init__(self, cache: ModuleCache) -> None:
+        self.cache = cache
+        self.reused: set[str] = set()
+        self.nodeids: list[str] = []
+
+    def pytest_sessionstart(self, session: pytest.Session) -> None:
+        self.module_reuse = ModuleReuse(self.cache, session.config, session)
+        session.config.pluginmanager.register(self.module_reuse)
+
+    def pytest_collection_finish(self, session: pytest.Session) -> None:
+        self.reused = self.module_reuse.reused
+        self.nodeids = [item.nodeid for item in session.items]
+        self.module_reuse.store({id(x): clone_item(x) for x in self.module_reuse.collected})
+
+
+def collect(project: Path, cache: ModuleCache, *args: str) -> Collection:
+    collection = Collection(cache)
+    status_code = pytest.main(
+        [str(project), "--co", "-q", "-p", "no:cacheprovider", *args], plugins=[collection]
+    )
+    assert status_code == pytest.ExitCode.OK
+    return collection
+
+
+class TestModuleReuse:
+    def test_unchanged_modules_are_reused(self, tmp_path: Path) -> None:
+        (tmp_path / "pytest.ini").write_text("[pytest]\n")
+        module = tmp_path / "test_reused_module.py"
+        module.write_text(MODULE)
+        cache = ModuleCache()
+
+        first = collect(tmp_path, cache)
+        second = collect(tmp_path, cache, "-k", "function")
+        module.write_text(MODULE + "\n\ndef test_added():\n    pass\n")
+        # the daemon has jurigged reload the changed module
+        del sys.modules["test_reused_module"]
+        third = collect(tmp_path, cache)
+
+        assert first.reused == set()
+        assert second.reused == {str(module)}
+        assert second.nodeids == [
+            "test_reused_module.py::test_function[1]",
+            "test_reused_module.py::test_function[2]",
+        ]
+        assert third.reused == set()
+        assert third.nodeids == [*first.nodeids, "test_reused_module.py::test_added"]
@@ -0,0 +1,25 @@
+from pytest_hot_reloading.path_matcher import PathMatcher
+
+
+def test_paths_matching_a_watch_glob_and_no_ignore_glob_are_watched() -> None:
+    matcher = PathMatcher(["/repo/*.py", "/other/*.py"], ["/repo/.venv/*", "/repo/build/*"])
+
+    assert matcher("/repo/package/module.py")
+    assert matcher("/other/module.py")
+    assert not matcher("/repo/.venv/lib/site-packages/module.py")
+    assert not matcher("/repo/build/module.py")
+    assert not matcher("/repo/README.md")
+    assert not matcher("/elsewhere/module.py")
+
+
+def test_both_answers_are_remembered() -> None:
+    matcher = PathMatcher(["/repo/*.py"], ["/repo/.venv/*"])
+
+    assert "/repo/module.py" not in matcher
+    assert matcher("/repo/module.py")
+    assert not matcher("/repo/.venv/module.py")
+
+    assert "/repo/module.py" in matcher
+    assert "/repo/.venv/module.py" in matcher
+    assert matcher("/repo/module.py")
+    assert not matcher("/repo/.venv/module.py")
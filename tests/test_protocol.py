@@ -0,0 +1,70 @@
+import socket
+import struct
+
+import pytest
+
+from pytest_hot_reloading.protocol import (
+    HEADER,
+    MAGIC,
+    ConnectionClosedError,
+    MessageType,
+    ProtocolError,
+    is_framed,
+    recv_message,
+    send_json,
+    send_message,
+)
+
+
+@pytest.fixture
+def sockets():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+def test_round_trip(sockets: tuple[socket.socket, socket.socket]) -> None:
+    a, b = sockets
+    send_message(a, MessageType.STDOUT, b"\x1b[32mpassed\x1b[0m")
+    send_json(a, MessageType.RESULT, {"status_code": 0})
+
+    assert recv_message(b) == (MessageType.STDOUT, b"\x1b[32mpassed\x1b[0m")
+    assert recv_message(b) == (MessageType.RESULT, b'{"status_code": 0}')
+
+
+def test_is_framed(sockets: tuple[socket.socket, socket.socket]) -> None:
+    a, b = sockets
+    send_message(a, MessageType.HELLO)
+
+    assert is_framed(b)
+    # peeking does not consume the message
+    assert recv_message(b) == (MessageType.HELLO, b"")
+
+
+def test_xmlrpc_is_not_framed(sockets: tuple[socket.socket, socket.socket]) -> None:
+    a, b = sockets
+    a.sendall(b"POST /RPC2 HTTP/1.1\r\n")
+
+    assert not is_framed(b)
+
+
+def test_unsupported_version(sockets: tuple[socket.socket, socket.socket]) -> None:
+    a, b = sockets
+    a.sendall(HEADER.pack(MAGIC, 99, MessageType.HELLO, 0))
+
+    with pytest.raises(ProtocolError, match="Unsupported protocol version 99"):
+        recv_message(b)
+
+
+def test_connection_closed_mid_message(sockets: tuple[socket.socket, socket.socket]) -> None:
+    a, b = sockets
+    a.sendall(HEADER.pack(MAGIC, 1, MessageType.STDOUT, 10) + b"short")
+    a.shutdown(socket.SHUT_WR)
+
+    with pytest.raises(ConnectionClosedError):
+        recv_message(b)
+
+
+def test_header_is_fixed_size() -> None:
+    assert HEADER.size == struct.calcsize("!3sBBI") == 9
@@ -0,0 +1,67 @@
+import pytest
+
+from pytest_hot_reloading.remote import OutputPathMapper, PathMap, is_loopback, sign, verify
+
+
+def test_path_map_to_daemon() -> None:
+    path_map = PathMap.parse("/home/me/project=/workspace:/home/me/project/lib=/lib")
+
+    assert path_map.to_daemon("/home/me/project") == "/workspace"
+    assert path_map.to_daemon("/home/me/project/tests/test_a.py") == "/workspace/tests/test_a.py"
+    # the longest prefix wins
+    assert path_map.to_daemon("/home/me/project/lib/a.py") == "/lib/a.py"
+    # prefixes only match whole path components
+    assert path_map.to_daemon("/home/me/project2/a.py") is None
+    assert path_map.arg_to_daemon("-x") == "-x"
+
+
+def test_path_map_to_client() -> None:
+    path_map = PathMap.parse("/home/me/project=/workspace")
+
+    assert (
+        path_map.to_client("/workspace/tests/test_a.py:3: AssertionError")
+        == "/home/me/project/tests/test_a.py:3: AssertionError"
+    )
+    # only whole path components where a path starts
+    assert path_map.to_client("/workspace2/a.py x/workspace/a.py") == (
+        "/workspace2/a.py x/workspace/a.py"
+    )
+    assert path_map.to_client("(/workspace) '/workspace/a.py'") == (
+        "(/home/me/project) '/home/me/project/a.py'"
+    )
+
+
+def test_output_path_mapper_maps_paths_split_between_chunks() -> None:
+    mapper = OutputPathMapper(PathMap.parse("/home/me/project=/app"))
+
+    output = mapper.feed("/application/run.py ..")
+    output += mapper.feed(". /ap")
+    output += mapper.feed("p/tests/test_a.py:3: AssertionError\n/a")
+    output += mapper.feed("pp")
+    output += mapper.flush()
+
+    assert output == (
+        "/application/run.py ... /home/me/project/tests/test_a.py:3: AssertionError\n"
+        "/home/me/project"
+    )
+    # progress without paths isn't held back
+    assert mapper.feed("..") == ".."
+
+
+def test_invalid_path_map() -> None:
+    with pytest.raises(ValueError, match="Invalid path mapping /home/me"):
+        PathMap.parse("/home/me")
+
+
+def test_empty_path_map() -> None:
+    assert not PathMap.parse("")
+
+
+def test_signature() -> None:
+    assert verify("s3cret", "challenge", sign("s3cret", "challenge"))
+    assert not verify("wrong", "challenge", sign("s3cret", "challenge"))
+
+
+def test_is_loopback() -> None:
+    assert is_loopback("localhost")
+    assert not is_loopback("0.0.0.0")
@@ -0,0 +1,170 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from pytest_hot_reloading.daemon import PytestDaemon
+from pytest_hot_reloading.jurigged_daemon_signalers import JuriggedDaemonSignaler
+from pytest_hot_reloading.runqueue import RunOutcomes, RunQueue, RunRequest
+
+
+@pytest.fixture
+def project(tmp_path: Path) -> str:
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_a.py").touch()
+    (tmp_path / "tests" / "test_b.py").touch()
+    return str(tmp_path)
+
+
+class MergingDaemon(PytestDaemon):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.runs: list[list[str]] = []
+
+    def _run_pytest_in_process(self, cwd, env, sys_path, args, stdout, stderr, plugins=None):
+        self.runs.append(args)
+        stdout.write("ran\n")
+        for plugin in plugins or []:
+            if isinstance(plugin, RunOutcomes):
+                plugin.paths = {
+                    "tests/test_a.py::test_one": os.path.join(cwd, "tests", "test_a.py"),
+                    "tests/test_b.py::test_two": os.path.join(cwd, "tests", "test_b.py"),
+                }
+                plugin.failed = {"tests/test_b.py::test_two"}
+                plugin.finished = set(plugin.paths)
+        return pytest.ExitCode.TESTS_FAILED
+
+
+class TestRunQueue:
+    def test_merges_requests_that_select_different_tests(self, project: str) -> None:
+        queue = RunQueue()
+        first = RunRequest(project, {}, [], ["-x", "tests/test_a.py::test_one"])
+        second = RunRequest(project, {}, [], ["-x", "tests/test_b.py::test_two"])
+        other_options = RunRequest(project, {}, [], ["-v", "tests/test_a.py"])
+        for request in (first, second, other_options):
+            queue.submit(request)
+
+        batch = queue.next_batch()
+
+        assert batch is not None
+        assert batch.requests == [first, second]
+        assert batch.args == ["-x", "tests/test_a.py::test_one", "tests/test_b.py::test_two"]
+        assert batch.outcomes is not None
+
+    def test_identical_request_joins_the_run_in_flight(self, project: str) -> None:
+        queue = RunQueue()
+        output: list[tuple[str, str]] = []
+        queue.submit(RunRequest(project, {}, [], ["tests"], lambda *_: None, lambda _: None))
+        batch = queue.next_batch()
+        assert batch is not None
+        batch.send_output("stdout", "collecting")
+
+        joined = RunRequest(
+            project,
+            {},
+            [],
+            ["tests"],
+            lambda stream, data: output.append((stream, data)),
+            lambda _: None,
+        )
+        queue.submit(joined)
+        batch.stop_joining()
+        late = RunRequest(project, {}, [], ["tests"], lambda *_: None, lambda _: None)
+        queue.submit(late)
+
+        assert joined.batch is batch
+        assert output == [("stdout", "collecting")]
+        assert late.batch is None
+
+    def test_cancelling_one_of_the_merged_requests_leaves_the_run_going(
+        self, project: str
+    ) -> None:
+        queue = RunQueue()
+        first = RunRequest(project, {}, [], ["tests/test_a.py"])
+        second = RunRequest(project, {}, [], ["tests/test_b.py"])
+        queue.submit(first)
+        queue.submit(second)
+        batch = queue.next_batch()
+        assert batch is not None
+
+        queue.cancel(first)
+
+        assert first.status_code == pytest.ExitCode.INTERRUPTED
+        assert not second.done
+        assert not batch.cancellation.cancelled
+
+    def test_cancelling_a_queued_request(self, project: str) -> None:
+        queue = RunQueue()
+        request = RunRequest(project, {}, [], ["tests"])
+        queue.submit(request)
+
+        queue.cancel(request)
+
+        assert request.status_code == pytest.ExitCode.INTERRUPTED
+        queue.close()
+        assert queue.next_batch() is None
+
+
+class TestDaemonRunBatch:
+    def test_each_request_gets_its_own_status_code(self, project: str) -> None:
+        daemon = MergingDaemon(JuriggedDaemonSignaler())
+        queue = RunQueue()
+        passing = RunRequest(project, {}, [], ["tests/test_a.py::test_one"])
+        failing = RunRequest(project, {}, [], ["tests/test_b.py"])
+        queue.submit(passing)
+        queue.submit(failing)
+        batch = queue.next_batch()
+        assert batch is not None
+
+        daemon._run_batch(batch)
+
+        assert daemon.runs == [["tests/test_a.py::test_one", "tests/test_b.py"]]
+        assert passing.status_code == pytest.ExitCode.OK
+        assert failing.status_code == pytest.ExitCode.TESTS_FAILED
+        assert passing.stdout == failing.stdout == "ran\n"
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="fork is not available")
+    def test_status_codes_come_back_from_the_fork(self, project: str) -> None:
+        daemon = MergingDaemon(JuriggedDaemonSignaler(), fork_per_run=True)
+        queue = RunQueue()
+        passing = RunRequest(project, {}, [], ["tests/test_a.py"])
+        failing = RunRequest(project, {}, [], ["tests/test_b.py"])
+        queue.submit(passing)
+        queue.submit(failing)
+        batch = queue.next_batch()
+        assert batch is not None
+
+        daemon._run_batch(batch)
+
+        assert passing.status_code == pytest.ExitCode.OK
+        assert failing.status_code == pytest.ExitCode.TESTS_FAILED
+        assert daemon.runs == []
+        assert passing.stdout == "ran\n"
+
+
+class TestRunOutcomes:
+    def test_requests_whose_tests_never_ran_are_interrupted(
+        self, project: str, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        tests = Path(project, "tests")
+        (tests / "test_a.py").write_text("def test_one():\n    assert False\n")
+        (tests / "test_b.py").write_text("def test_two():\n    pass\n")
+        Path(project, "pytest.ini").write_text("[pytest]\n")
+        queue = RunQueue()
+        failing = RunRequest(project, {}, [], ["-x", "tests/test_a.py"])
+        never_ran = RunRequest(project, {}, [], ["-x", "tests/test_b.py"])
+        queue.submit(failing)
+        queue.submit(never_ran)
+        batch = queue.next_batch()
+        assert batch is not None
+
+        monkeypatch.chdir(project)
+        # the first failure stops the session before the tests of the other request
+        status_code = pytest.main(
+            ["-p", "no:cacheprovider", "-q", *batch.args], plugins=batch.plugins
+        )
+        batch.finish(status_code)
+
+        assert status_code == pytest.ExitCode.TESTS_FAILED
+        assert failing.status_code == pytest.ExitCode.TESTS_FAILED
+        assert never_ran.status_code == pytest.ExitCode.INTERRUPTED
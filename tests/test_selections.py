@@ -0,0 +1,44 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from pytest_hot_reloading.selections import covers, selects, split_selections
+
+
+@pytest.fixture
+def project(tmp_path: Path) -> str:
+    (tmp_path / "tests").mkdir()
+    (tmp_path / "tests" / "test_a.py").touch()
+    (tmp_path / "tests" / "test_b.py").touch()
+    return str(tmp_path)
+
+
+class TestSelections:
+    def test_paths_are_selections(self, project: str) -> None:
+        args = ["-x", "-k", "one", "tests/test_a.py::test_one", "-v", "tests"]
+
+        assert split_selections(project, args) == (
+            ["-x", "-k", "one", "-v"],
+            ["tests/test_a.py::test_one", "tests"],
+        )
+
+    def test_path_option_values_are_not_selections(self, project: str) -> None:
+        args = ["--ignore", "tests/test_b.py"]
+
+        assert split_selections(project, args) == (args, [])
+
+    def test_selects(self) -> None:
+        path = os.path.abspath("tests/test_a.py")
+
+        assert selects("tests", "", path, "tests/test_a.py::test_one")
+        assert selects("tests/test_a.py::test_one", "", path, "tests/test_a.py::test_one[1]")
+        assert selects("tests/test_a.py::TestA", "", path, "tests/test_a.py::TestA::test_one")
+        assert not selects("tests/test_a.py::test_o", "", path, "tests/test_a.py::test_one")
+        assert not selects("test", "", path, "tests/test_a.py::test_one")
+
+    def test_covers(self) -> None:
+        assert covers("/repo/tests", "/repo/tests/api/test_x.py::test_y")
+        assert covers("/repo/tests/test_x.py::TestX", "/repo/tests/test_x.py::TestX::test_y")
+        assert not covers("/repo/tests/api", "/repo/tests")
+        assert not covers("/repo/tests/test_x.py::test_y", "/repo/tests/test_x.py")
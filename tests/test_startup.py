@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from pytest_hot_reloading.startup import DaemonStartupError, StartupReporter, wait_for_startup
+
+
+def _daemon(script: str) -> tuple[int, subprocess.Popen]:
+    read_fd, write_fd = os.pipe()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n"
+            "from pytest_hot_reloading.startup import StartupReporter\n"
+            "startup = StartupReporter(int(sys.argv[1]))\n" + script,
+            str(write_fd),
+        ],
+        pass_fds=(write_fd,),
+    )
+    os.close(write_fd)
+    return read_fd, process
+
+
+class TestStartup:
+    def test_reporter_without_a_pipe_does_nothing(self) -> None:
+        startup = StartupReporter(None)
+
+        startup.phase("watching")
+        startup.ready()
+
+    def test_wait_returns_once_serving(self, capsys: pytest.CaptureFixture) -> None:
+        read_fd, process = _daemon("startup.phase('watching')\nstartup.ready()\n")
+
+        elapsed = wait_for_startup(read_fd, process)
+
+        out = capsys.readouterr().out
+        assert "Daemon watching (" in out
+        assert f"Daemon ready in {elapsed:.3f} seconds" in out
+        process.wait()
+
+    def test_wait_raises_the_daemon_error(self) -> None:
+        read_fd, process = _daemon(
+            "startup.phase('watching')\nstartup.error('ImportError: foo')\n"
+        )
+
+        with pytest.raises(DaemonStartupError) as exc:
+            wait_for_startup(read_fd, process)
+
+        assert "while watching" in str(exc.value)
+        assert "ImportError: foo" in str(exc.value)
+        process.wait()
+
+    def test_wait_raises_when_the_daemon_exits(self) -> None:
+        read_fd, process = _daemon("sys.exit(3)\n")
+
+        with pytest.raises(DaemonStartupError) as exc:
+            wait_for_startup(read_fd, process)
+
+        assert "exit code 3" in str(exc.value)
+
+    def test_wait_gives_up_after_the_timeout(self) -> None:
+        read_fd, process = _daemon("import time\ntime.sleep(10)\n")
+
+        with pytest.raises(DaemonStartupError):
+            wait_for_startup(read_fd, process, timeout=0.2)
+
+        process.kill()
+        process.wait()
@@ -0,0 +1,33 @@
+import socket
+from pathlib import Path
+
+import pytest
+
+from pytest_hot_reloading.transport import connect, unix_socket_path
+
+
+def test_unix_socket_path_is_derived_from_the_project_root(tmp_path: Path) -> None:
+    project_a = tmp_path / "a"
+    project_b = tmp_path / "b"
+
+    assert unix_socket_path(project_a) == unix_socket_path(str(project_a))
+    assert unix_socket_path(project_a) != unix_socket_path(project_b)
+    assert unix_socket_path(project_a).endswith(".sock")
+
+
+def test_connect_over_unix_socket(tmp_path: Path) -> None:
+    socket_path = str(tmp_path / "daemon.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+
+    try:
+        sock = connect("localhost", 0, socket_path)
+        sock.close()
+    finally:
+        server.close()
+
+
+def test_connect_when_socket_does_not_exist(tmp_path: Path) -> None:
+    with pytest.raises(FileNotFoundError):
+        connect("localhost", 0, str(tmp_path / "missing.sock"))
@@ -0,0 +1,184 @@
+import io
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from jurigged.utils import EventSource  # type: ignore
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers.api import BaseObserver
+
+from pytest_hot_reloading import watcher
+from pytest_hot_reloading.watcher import AdaptivePollingObserver, BatchingWatcher, ReloadBatcher
+
+
+class CodeFile:
+    def __init__(self, registry: "FakeRegistry", filename: str) -> None:
+        self._registry = registry
+        self._filename = filename
+
+    def refresh(self) -> None:
+        self._registry.refreshed.append(self._filename)
+        self._registry.refreshed_event.set()
+
+
+class FakeRegistry:
+    def __init__(self) -> None:
+        self.precache_activity = EventSource(save_history=True)
+        self.refreshed: list[str] = []
+        self.refreshed_event = threading.Event()
+
+    def get(self, filename: str) -> CodeFile:
+        return CodeFile(self, filename)
+
+    def log(self, event: object) -> None:
+        pass
+
+
+def test_bursts_are_reloaded_once_in_one_batch() -> None:
+    batches: list[list[str]] = []
+    reloaded = threading.Event()
+
+    def reload(batch: list[str]) -> None:
+        batches.append(batch)
+        reloaded.set()
+
+    batcher = ReloadBatcher(reload, debounce=0.1)
+    batcher.start()
+    try:
+        for _ in range(5):
+            batcher.add("/repo/b.py")
+            batcher.add("/repo/a.py")
+        assert reloaded.wait(5)
+    finally:
+        batcher.stop()
+        batcher.join()
+
+    assert batches == [["/repo/a.py", "/repo/b.py"]]
+
+
+def test_saving_through_a_temporary_file_reloads_the_file(tmp_path: Path) -> None:
+    module = tmp_path / "module.py"
+    module.write_text("x = 1\n")
+    registry = FakeRegistry()
+    files = BatchingWatcher(registry)
+    registry.precache_activity.emit("module", str(module))
+    files.start()
+    try:
+        temporary = tmp_path / ".module.py.swp"
+        temporary.write_text("x = 2\n")
+        os.replace(temporary, module)
+        assert registry.refreshed_event.wait(5)
+    finally:
+        files.stop()
+        files.join()
+
+    assert registry.refreshed == [str(module)]
+
+
+def test_unwatched_files_that_changed_are_reloaded_once_watched_again(tmp_path: Path) -> None:
+    registry = FakeRegistry()
+    files = BatchingWatcher(registry, use_os_events=False)
+    assert isinstance(files.observer, AdaptivePollingObserver)
+    modules = [tmp_path / project / "module.py" for project in ("evicted", "kept")]
+    for module in modules:
+        module.parent.mkdir()
+        module.write_text("x = 1\n")
+        registry.precache_activity.emit("module", str(module))
+
+    def evicted(path: str) -> bool:
+        return path.startswith(str(tmp_path / "evicted"))
+
+    files.unwatch(evicted)
+    assert files.observer.stats()["directories"] == 1
+    files.start()
+    try:
+        modules[0].write_text("x = 22\n")
+        files.changed(str(modules[0]))
+        files.watch_again(evicted)
+        assert registry.refreshed_event.wait(5)
+    finally:
+        files.stop()
+        files.join()
+
+    assert registry.refreshed == [str(modules[0])]
+    assert files.observer.stats()["directories"] == 2
+
+
+class ExhaustedObserver(BaseObserver):
+    def __init__(self) -> None:
+        pass
+
+    def schedule(self, *args, **kwargs):
+        raise OSError(28, "inotify watch limit reached")
+
+
+def test_polling_is_used_when_os_events_cannot_be(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(watcher, "Observer", ExhaustedObserver)
+    registry = FakeRegistry()
+    files = BatchingWatcher(registry)
+
+    registry.precache_activity.emit("module", str(tmp_path / "module.py"))
+
+    assert files.polling
+
+
+class RecordingHandler(FileSystemEventHandler):
+    def __init__(self) -> None:
+        self.changed: list[str] = []
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        self.changed.append(os.fsdecode(event.src_path))
+
+
+def write(path: Path, text: str, age: float = 0.0) -> None:
+    path.write_text(text)
+    written = time.time() - age
+    os.utime(path, (written, written))
+
+
+def test_recently_changed_directories_are_polled_on_every_tick(tmp_path: Path) -> None:
+    handler = RecordingHandler()
+    # no budget, so each tick scans a single directory that isn't hot
+    observer = AdaptivePollingObserver(latency=1.0, budget=0.0)
+    directories = [tmp_path / name for name in ("a", "b", "c")]
+    for directory in directories:
+        directory.mkdir()
+        write(directory / "module.py", "x = 1\n", age=3600)
+        observer.schedule(handler, str(directory))
+    module = directories[2] / "module.py"
+
+    write(module, "x = 22\n")
+    observer.tick()
+    observer.tick()
+    assert handler.changed == []
+    # its turn comes
+    observer.tick()
+    assert handler.changed == [str(module)]
+    assert observer.sweep_time is not None
+
+    write(module, "x = 333\n")
+    observer.tick()
+    assert handler.changed == [str(module)] * 2
+    assert observer.stats()["changes_seen"] == 2
+
+
+def test_polling_output_stays_out_of_a_redirected_run(monkeypatch: pytest.MonkeyPatch) -> None:
+    daemon_output, run_output = io.StringIO(), io.StringIO()
+    monkeypatch.setattr(sys, "__stdout__", daemon_output)
+    monkeypatch.setattr(sys, "stdout", run_output)
+    monkeypatch.setattr(watcher, "LATENCY_SAMPLES", 3)
+    observer = AdaptivePollingObserver()
+
+    for latency in range(5):
+        observer._seen(float(latency))
+
+    assert run_output.getvalue() == ""
+    assert "Polling saw a change after 4.00 seconds" in daemon_output.getvalue()
+    # only the latest changes are kept
+    assert list(observer.detection_latencies) == [2.0, 3.0, 4.0]
+    assert observer.stats()["changes_seen"] == 5
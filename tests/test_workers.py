@@ -0,0 +1,77 @@
+import io
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from pytest_hot_reloading.daemon import PytestDaemon
+from pytest_hot_reloading.jurigged_daemon_signalers import JuriggedDaemonSignaler
+from pytest_hot_reloading.workers import ForkedWorkers, distribute
+
+
+def _items(*nodeids: str) -> list:
+    return [SimpleNamespace(nodeid=nodeid) for nodeid in nodeids]
+
+
+def test_distribute_keeps_modules_together() -> None:
+    items = _items("a.py::t1", "a.py::t2", "a.py::t3", "b.py::t1", "c.py::t1", "c.py::t2")
+
+    chunks = distribute(items, 2)  # type: ignore
+
+    assert [[item.nodeid for item in chunk] for chunk in chunks] == [
+        ["a.py::t1", "a.py::t2", "a.py::t3"],
+        ["c.py::t1", "c.py::t2", "b.py::t1"],
+    ]
+
+
+def test_distribute_with_more_workers_than_modules() -> None:
+    chunks = distribute(_items("a.py::t1", "a.py::t2"), 4)  # type: ignore
+
+    assert len(chunks) == 1
+
+
+def test_serial_run_is_left_to_pytest() -> None:
+    session = SimpleNamespace(
+        config=SimpleNamespace(option=SimpleNamespace(daemon_workers=1)),
+        items=_items("a.py::t1", "b.py::t1"),
+    )
+
+    assert ForkedWorkers().pytest_runtestloop(session) is None  # type: ignore
+
+
+WORKER_TEST = """
+import os
+from pathlib import Path
+
+
+def test_{name}():
+    Path(__file__).with_name("{name}.pid").write_text(str(os.getpid()))
+    assert 1 == {result}
+"""
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="fork is not available")
+def test_reports_from_the_workers_are_replayed_in_the_daemon(tmp_path: Path) -> None:
+    (tmp_path / "pytest.ini").write_text("[pytest]\n")
+    (tmp_path / "test_replayed_pass.py").write_text(WORKER_TEST.format(name="passes", result=1))
+    (tmp_path / "test_replayed_fail.py").write_text(WORKER_TEST.format(name="fails", result=2))
+    # the run is forked, so the daemon's patches stay out of this session
+    daemon = PytestDaemon(JuriggedDaemonSignaler(), fork_per_run=True)
+    args = [str(tmp_path), "-p", "pytest_hot_reloading.plugin", "-p", "no:cacheprovider"]
+    args += ["-p", "no:django", "--daemon-workers", "2", "-rA", "--color=no"]
+    stdout = io.StringIO()
+
+    status_code = daemon._run_pytest(
+        str(tmp_path), dict(os.environ), sys.path, args, stdout, io.StringIO()
+    )
+
+    output = stdout.getvalue()
+    assert status_code == pytest.ExitCode.TESTS_FAILED, output
+    assert "PASSED test_replayed_pass.py::test_passes" in output
+    assert "FAILED test_replayed_fail.py::test_fails - assert 1 == 2" in output
+    assert "1 failed, 1 passed" in output
+    # each module ran in its own worker
+    pids = {(tmp_path / name).read_text() for name in ("passes.pid", "fails.pid")}
+    assert len(pids) == 2